@@ -1472,6 +1472,10 @@ const DataSetViewModel = DataSetModel.extend({
             let values = Array(blockPB.columnCount);
 
             for (let c = 0; c < blockPB.columnCount; c++) {
+                if (response.packed && blockPB.clear === false) {
+                    values[c] = this._unpackColumn(blockPB.columns[c], blockPB.rowCount);
+                    continue;
+                }
                 values[c] = Array(blockPB.rowCount);
                 for (let r = 0; r < blockPB.rowCount; r++) {
                     let inValue = null;
@@ -1528,10 +1532,53 @@ const DataSetViewModel = DataSetModel.extend({
 
         return { data, filterData, rowNums };
     },
+    _unpackColumn(columnPB, rowCount) {
+        let values = Array(rowCount);
+        if (columnPB === undefined) {
+            values.fill(null);
+            return values;
+        }
+
+        let missing = new Uint8Array(columnPB.missing.toBuffer());
+        let data = new DataView(columnPB.values.toBuffer());
+        let Type = this.attributes.coms.Messages.DataSetRR.ColumnData.ColumnDataType;
+
+        if (columnPB.type === Type.TEXT) {
+            let decoder = new TextDecoder('utf-8');
+            let start = 0;
+            for (let r = 0; r < rowCount; r++) {
+                let end = columnPB.offsets[r];
+                if ( ! (missing[r >> 3] & (1 << (r & 7))))
+                    values[r] = decoder.decode(new Uint8Array(data.buffer, start, end - start));
+                else
+                    values[r] = null;
+                start = end;
+            }
+        }
+        else if (columnPB.type === Type.DECIMAL) {
+            for (let r = 0; r < rowCount; r++) {
+                if ( ! (missing[r >> 3] & (1 << (r & 7))))
+                    values[r] = data.getFloat64(r * 8, true);
+                else
+                    values[r] = null;
+            }
+        }
+        else {
+            for (let r = 0; r < rowCount; r++) {
+                if ( ! (missing[r >> 3] & (1 << (r & 7))))
+                    values[r] = data.getInt32(r * 4, true);
+                else
+                    values[r] = null;
+            }
+        }
+
+        return values;
+    },
     requestCells(viewport) {
         let coms = this.attributes.coms;
         let cellsRequest = new coms.Messages.DataSetRR();
         cellsRequest.incData = true;
+        cellsRequest.packed = true;
 
         let blockPB = new coms.Messages.DataSetRR.DataBlock();
         blockPB.rowStart = viewport.top;
@@ -1556,6 +1603,7 @@ const DataSetViewModel = DataSetModel.extend({
         let cellsRequest = new coms.Messages.DataSetRR();
         cellsRequest.op = coms.Messages.GetSet.SET;
         cellsRequest.incData = true;
+        cellsRequest.packed = true;
 
         if (typeof(data) === 'string') {
             let blockPB = new coms.Messages.DataSetRR.DataBlock();
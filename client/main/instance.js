@@ -731,8 +731,12 @@ const Instance = Backbone.Model.extend({
                 let selectedAnalysis = this.get('selectedAnalysis');
                 if (selectedAnalysis !== null && selectedAnalysis.id === analysis.id)
                     this.trigger("change:selectedAnalysis", { changed: { selectedAnalysis: analysis } });
-                this._runAnalysis(analysis, event.changed);
             }
+
+            // the server reruns the analyses whose data has changed (this
+            // includes level renames); this sends the options updated above
+            if (columnRenamed || columnDeleted || levelsRenamed)
+                this._runAnalysis(analysis, event.changed);
         }
     },
     _stringifyMeasureType(measureType) {
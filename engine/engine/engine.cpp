@@ -104,7 +104,13 @@ void Engine::start()
 
         lock.unlock();
 
-        _R->run(_running);
+        // a cancel supersedes the analysis which was running (it's
+        // aborted at its next checkpoint), and runs nothing itself. it's
+        // acknowledged, as the analysis has stopped reading the data set
+        if (_running->perform != 8)  // CANCEL
+            _R->run(_running);
+        else
+            opEventReceived("");
         delete _running;
         _running = NULL;
     }
@@ -33,25 +33,23 @@ DataFrame readDF(
     DataSet &dataset = *DataSet::retrieve(mm);
 
     int columnCount = dataset.columnCount();
-    int rowCount = 0;
     int rowCountExFiltered = 0;
 
     if ( ! headerOnly)
-    {
-        rowCount = dataset.rowCount();
         rowCountExFiltered = dataset.rowCountExFiltered();
-    }
+
+    // the rows not filtered, read from the filter mask in one pass
+
+    vector<int> rows(rowCountExFiltered);
+    if (rowCountExFiltered > 0)
+        dataset.getIndicesExFiltered(0, rowCountExFiltered, &rows[0]);
 
     CharacterVector rowNames(rowCountExFiltered);
 
-    int rowNo = 0;
     int colNo = 0;
 
-    for (int i = 0; i < rowCount; i++)
-    {
-        if ( ! dataset.isRowFiltered(i))
-            rowNames[rowNo++] = String(std::to_string(i+1));
-    }
+    for (int i = 0; i < rowCountExFiltered; i++)
+        rowNames[i] = String(std::to_string(rows[i] + 1));
 
     bool readAllColumns;
     StringVector columnsRequired;
@@ -114,26 +112,18 @@ DataFrame readDF(
         else if (column.dataType() == DataType::DECIMAL)
         {
             NumericVector v(rowCountExFiltered, NumericVector::get_na());
-            rowNo = 0;
 
-            for (int j = 0; j < rowCount; j++)
-            {
-                if ( ! dataset.isRowFiltered(j))
-                    v[rowNo++] = column.raw<double>(j);
-            }
+            for (int j = 0; j < rowCountExFiltered; j++)
+                v[j] = column.raw<double>(rows[j]);
 
             columns[colNo] = v;
         }
         else if (column.dataType() == DataType::INTEGER && ! column.hasLevels())
         {
             IntegerVector v(rowCountExFiltered, IntegerVector::get_na());
-            rowNo = 0;
 
-            for (int j = 0; j < rowCount; j++)
-            {
-                if ( ! dataset.isRowFiltered(j))
-                    v[rowNo++] = column.raw<int>(j);
-            }
+            for (int j = 0; j < rowCountExFiltered; j++)
+                v[j] = column.raw<int>(rows[j]);
 
             if (column.measureType() == MeasureType::ID)
                 v.attr("jmv-id") = true;
@@ -144,13 +134,9 @@ DataFrame readDF(
                  column.measureType() == MeasureType::ID)
         {
             StringVector v(rowCountExFiltered, StringVector::get_na());
-            rowNo = 0;
 
-            for (int j = 0; j < rowCount; j++)
-            {
-                if ( ! dataset.isRowFiltered(j))
-                    v[rowNo++] = String(column.raws(j));
-            }
+            for (int j = 0; j < rowCountExFiltered; j++)
+                v[j] = String(column.raws(rows[j]));
 
             v.attr("jmv-id") = true;
             columns[colNo] = v;
@@ -200,17 +186,12 @@ DataFrame readDF(
             // populate cells
 
             IntegerVector v(rowCountExFiltered, MISSING);
-            rowNo = 0;
 
-            for (int j = 0; j < rowCount; j++)
+            for (int j = 0; j < rowCountExFiltered; j++)
             {
-                if ( ! dataset.isRowFiltered(j))
-                {
-                    int value = column.raw<int>(j);
-                    if (value != MISSING)
-                        v[rowNo] = indexes[value];
-                    rowNo++;
-                }
+                int value = column.raw<int>(rows[j]);
+                if (value != MISSING)
+                    v[j] = indexes[value];
             }
 
             // assign levels
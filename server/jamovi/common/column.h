@@ -12,6 +12,8 @@
 #include <string>
 #include <vector>
 #include <utility>
+#include <stdexcept>
+#include <cstring>
 
 #ifdef _WIN32
 #define ALIGN_8 alignas(8)
@@ -27,6 +29,9 @@ typedef struct
     int length;
     int capacity;
 
+    int hashedCount;  // the number of values hashed, -1 if out of date
+    unsigned long long hash;
+
     char values[8] ALIGN_8;
 
 } Block;
@@ -78,6 +83,10 @@ typedef struct
 
     char changes;
 
+    int version;
+    int hashedVersion;
+    unsigned long long hash;
+
 } ColumnStruct;
 
 namespace ColumnType
@@ -132,6 +141,37 @@ public:
         return cellAt<T>(rowIndex);
     }
 
+    template<typename T> void readRange(int rowStart, int rowCount, T *dest)
+    {
+        ColumnStruct *cs = _mm->resolve<ColumnStruct>(_rel);
+
+        if (rowStart < 0 || rowCount < 0 || rowStart + rowCount > cs->rowCount)
+            throw std::runtime_error("index out of bounds");
+
+        // copy a block at a time, rather than resolving each cell
+        int perBlock = VALUES_SPACE / sizeof(T);
+        Block **blocks = _mm->resolve<Block*>(cs->blocks);
+
+        int rowNo = rowStart;
+        int remaining = rowCount;
+
+        while (remaining > 0)
+        {
+            int blockIndex = rowNo / perBlock;
+            int index = rowNo % perBlock;
+            int n = perBlock - index;
+            if (n > remaining)
+                n = remaining;
+
+            Block *block = _mm->resolve<Block>(blocks[blockIndex]);
+            memcpy(dest, &block->values[index * sizeof(T)], n * sizeof(T));
+
+            dest += n;
+            rowNo += n;
+            remaining -= n;
+        }
+    }
+
 protected:
 
     ColumnStruct *struc() const;
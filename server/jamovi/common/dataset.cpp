@@ -7,6 +7,7 @@
 #include <cstring>
 #include <climits>
 #include <stdexcept>
+#include <bitset>
 
 using namespace std;
 
@@ -90,39 +91,116 @@ int DataSet::columnCount() const
     return _mm->resolve(_rel)->columnCount;
 }
 
+int DataSet::bitCount(unsigned long long word)
+{
+    return (int)std::bitset<64>(word).count();
+}
+
 bool DataSet::isRowFiltered(int index) const
 {
-    DataSet ds = *this;
+    DataSetStruct *dss = struc();
 
-    for (int colNo = 0; colNo < columnCount(); colNo++)
-    {
-        Column column = ds[colNo];
+    if (index < 0 || index / 64 >= dss->filterCapacity)
+        return false;
 
-        if (column.columnType() == ColumnType::FILTER)
-        {
-            if ( ! column.active())
-                continue;
+    unsigned long long *mask = _mm->resolve(dss->filterMask);
+    return (mask[index / 64] & (1ULL << (index % 64))) == 0;
+}
 
-            int value = column.raw<int>(index);
-            if (value != 1)
-                return true;
-        }
-        else
+const unsigned long long *DataSet::filterMask() const
+{
+    DataSetStruct *dss = struc();
+    if (dss->filterMask == NULL)
+        return NULL;
+    return _mm->resolve(dss->filterMask);
+}
+
+int DataSet::filterMaskSize() const
+{
+    // the number of words of the mask which cover the rows
+
+    DataSetStruct *dss = struc();
+    int nWords = (dss->rowCount + 63) / 64;
+    if (nWords > dss->filterCapacity)
+        return 0;
+    return nWords;
+}
+
+int DataSet::getIndexExFiltered(int index)
+{
+    // descend the fenwick tree to the word holding the row, then count
+    // through the bits of that word
+
+    DataSetStruct *dss = struc();
+    unsigned long long *mask = _mm->resolve(dss->filterMask);
+    int *ranks = _mm->resolve(dss->filterRanks);
+    int nWords = dss->filterCapacity;
+
+    if (index < 0 || index >= dss->rowCountExFiltered)
+        throw runtime_error("index out of bounds");
+
+    int step = 1;
+    while (step * 2 <= nWords)
+        step *= 2;
+
+    int wordNo = 0;
+    int remaining = index;
+
+    for (; step > 0; step /= 2)
+    {
+        int next = wordNo + step;
+        if (next <= nWords && ranks[next] <= remaining)
         {
-            return false;
+            wordNo = next;
+            remaining -= ranks[next];
         }
     }
 
-    return false;
-}
+    unsigned long long word = mask[wordNo];
+    for (; remaining > 0; remaining--)
+        word &= word - 1;  // clear the lowest bit set
 
-Column DataSet::indices()
-{
-    DataSetStruct *dss = _mm->resolve<DataSetStruct>(_rel);
-    return Column(this, _mm, dss->indices);
+    int bitNo = 0;
+    while ((word & 1) == 0)
+    {
+        word >>= 1;
+        bitNo++;
+    }
+
+    return wordNo * 64 + bitNo;
 }
 
-int DataSet::getIndexExFiltered(int index)
+void DataSet::getIndicesExFiltered(int start, int count, int *dest)
 {
-    return indices().raw<int>(index);
+    // indices beyond the rows not filtered follow on from the end of
+    // the data set
+
+    DataSetStruct *dss = struc();
+    int exCount = dss->rowCountExFiltered;
+    int rowCount = dss->rowCount;
+
+    int i = 0;
+
+    if (start < exCount && count > 0)
+    {
+        unsigned long long *mask = _mm->resolve(dss->filterMask);
+        int rowNo = getIndexExFiltered(start);
+
+        for (;;)
+        {
+            dest[i++] = rowNo;
+            if (i == count || start + i == exCount)
+                break;
+
+            // advance to the next row not filtered
+            rowNo++;
+            while ((mask[rowNo / 64] >> (rowNo % 64)) == 0)
+                rowNo = (rowNo / 64 + 1) * 64;
+            while ((mask[rowNo / 64] & (1ULL << (rowNo % 64))) == 0)
+                rowNo++;
+        }
+    }
+
+    for (; i < count; i++)
+        dest[i] = start + i - exCount + rowCount;
 }
@@ -19,7 +19,12 @@ typedef struct
     int nextColumnId;
     ColumnStruct *scratch;
     int rowCountExFiltered;
-    ColumnStruct *indices;
+
+    // a bit per row, set where the row isn't filtered, and a fenwick
+    // tree of the number of bits set in each word of it (1-based)
+    unsigned long long *filterMask;
+    int *filterRanks;
+    int filterCapacity;  // in words
 
 } DataSetStruct;
 
@@ -35,6 +40,9 @@ public:
     bool isRowFiltered(int index) const;
     int rowCountExFiltered() const;
     int getIndexExFiltered(int index);
+    void getIndicesExFiltered(int start, int count, int *dest);
+    const unsigned long long *filterMask() const;
+    int filterMaskSize() const;
 
     Column operator[](int index);
     Column operator[](const char *name);
@@ -45,7 +53,8 @@ protected:
     DataSet(MemoryMap *memoryMap);
     DataSetStruct *struc() const;
     ColumnStruct *strucC(int index) const;
-    Column indices();
+
+    static int bitCount(unsigned long long word);
 
     DataSetStruct *_rel;
 
@@ -10,6 +10,9 @@ from libcpp.pair cimport pair
 
 from cython.operator cimport dereference as deref, postincrement as inc
 
+from cpython cimport array
+import array
+
 import math
 import os
 import os.path
@@ -36,6 +39,9 @@ cdef extern from "column.h":
         CDataTypeDecimal  "DataType::DECIMAL"
         CDataTypeText     "DataType::TEXT"
 
+cdef array.array _double_array = array.array('d')
+cdef array.array _int_array = array.array('i')
+
 cdef extern from "datasetw.h":
     cdef cppclass CDataSet "DataSetW":
         @staticmethod
@@ -49,11 +55,17 @@ cdef extern from "datasetw.h":
         CColumn appendColumn(const char *name, const char *importName) except +
         CColumn insertColumn(int index, const char *name, const char *importName) except +
         void setRowCount(size_t count) except +
+        void reserve(size_t size) except +
         void insertRows(int start, int end) except +
         void deleteRows(int start, int end) except +
+        void deleteRows(vector[pair[int, int]] ranges) except +
         void deleteColumns(int start, int end) except +
+        void compact() except +
         void refreshFilterState() except +
         int getIndexExFiltered(int index) except +
+        void getIndicesExFiltered(int start, int count, int *dest) except +
+        const unsigned long long *filterMask() const
+        int filterMaskSize() const
         CColumn operator[](int index) except +
         CColumn operator[](const char *name) except +
         CColumn getColumnById(int id) except +
@@ -120,12 +132,25 @@ cdef class DataSet:
     def set_row_count(self, count):
         self._this.setRowCount(count)
 
+    def reserve(self, size):
+        self._this.reserve(size)
+
+    def compact(self):
+        self._this.compact()
+
     def insert_rows(self, row_start, row_end):
         self._this.insertRows(row_start, row_end)
 
     def delete_rows(self, row_start, row_end):
         self._this.deleteRows(row_start, row_end)
 
+    def delete_row_ranges(self, ranges):
+        # the (start, end) ranges are inclusive, in order, and mustn't overlap
+        cdef vector[pair[int, int]] c_ranges
+        for row_start, row_end in ranges:
+            c_ranges.push_back(pair[int, int](row_start, row_end))
+        self._this.deleteRows(c_ranges)
+
     def delete_columns(self, col_start, col_end):
         self._this.deleteColumns(col_start, col_end)
 
@@ -151,9 +176,22 @@ cdef class DataSet:
             return index - self.row_count_ex_filtered + self.row_count
 
     def get_indices_ex_filtered(self, row_start, row_count):
-        offsets = map(self.get_index_ex_filtered, range(row_start, row_start + row_count))
-        offsets = list(offsets)
-        return offsets
+        cdef array.array offsets
+        offsets = array.clone(_int_array, row_count, zero=False)
+        if row_count > 0:
+            self._this.getIndicesExFiltered(row_start, row_count, offsets.data.as_ints)
+        return offsets.tolist()
+
+    @property
+    def filter_mask(self):
+        # a view onto the mask of the rows which aren't filtered, a bit
+        # per row. it isn't copied, so is only valid until the data set
+        # is next modified
+        cdef int size = self._this.filterMaskSize()
+        cdef unsigned char *mask = <unsigned char*>self._this.filterMask()
+        if size == 0 or mask == NULL:
+            return None
+        return memoryview(<unsigned char[:size * 8]>mask)
 
     property is_edited:
         def __get__(self):
@@ -191,6 +229,8 @@ cdef extern from "columnw.h":
         void append[T](const T &value)
         T raw[T](int index)
         const char *raws(int index);
+        void readRange[T](int start, int count, T *dest) except +
+        void writeRange[T](int start, int count, const T *src, bool initing) except +
         void setIValue(int index, int value, bool init)
         void setDValue(int index, double value, bool init)
         void setSValue(int index, const char *value, bool init)
@@ -216,6 +256,8 @@ cdef extern from "columnw.h":
         int rowCount() const;
         int rowCountExFiltered() const;
         int changes() const;
+        int version() const;
+        unsigned long long contentHash();
         const char *formula() const;
         void setFormula(const char *value);
         const char *formulaMessage() const;
@@ -233,6 +275,7 @@ cdef extern from "columnw.h":
         CColumnTypeRecoded    "ColumnType::RECODED"
         CColumnTypeFilter     "ColumnType::FILTER"
 
+
 class CellIterator:
     def __init__(self, column):
         self._i = 0
@@ -460,6 +503,13 @@ cdef class Column:
     def changes(self):
         return self._this.changes();
 
+    @property
+    def version(self):
+        return self._this.version();
+
+    def content_hash(self):
+        return self._this.contentHash();
+
     def clear_at(self, index):
         if self.data_type == DataType.DECIMAL:
             self._this.setDValue(index, float('nan'), False)
@@ -535,6 +585,47 @@ cdef class Column:
         else:
             return self._this.raw[int](index)
 
+    def read_range(self, row_start, row_count):
+        cdef array.array values
+
+        if row_start < 0 or row_count < 0 or row_start + row_count > self.row_count:
+            raise IndexError()
+
+        if self.data_type is DataType.DECIMAL:
+            values = array.clone(_double_array, row_count, zero=False)
+            if row_count > 0:
+                self._this.readRange[double](row_start, row_count, values.data.as_doubles)
+        elif self.data_type is DataType.TEXT and self.measure_type is MeasureType.ID:
+            raise TypeError('read_range() does not support ID text columns')
+        else:
+            values = array.clone(_int_array, row_count, zero=False)
+            if row_count > 0:
+                self._this.readRange[int](row_start, row_count, values.data.as_ints)
+
+        return values
+
+    def write_range(self, row_start, values, initing=False):
+        cdef const double[::1] dvalues
+        cdef const int[::1] ivalues
+        cdef int n
+
+        if self.data_type is DataType.DECIMAL:
+            dvalues = values
+            n = dvalues.shape[0]
+            if row_start < 0 or row_start + n > self.row_count:
+                raise IndexError()
+            if n > 0:
+                self._this.writeRange[double](row_start, n, &dvalues[0], initing)
+        elif self.data_type is DataType.TEXT and self.measure_type is MeasureType.ID:
+            raise TypeError('write_range() does not support ID text columns')
+        else:
+            ivalues = values
+            n = ivalues.shape[0]
+            if row_start < 0 or row_start + n > self.row_count:
+                raise IndexError()
+            if n > 0:
+                self._this.writeRange[int](row_start, n, &ivalues[0], initing)
+
     def set_data_type(self, data_type):
         self._this.setDataType(data_type.value)
 
@@ -651,7 +742,12 @@ cdef extern from "memorymapw.h":
     cdef cppclass CMemoryMap "MemoryMapW":
         @staticmethod
         CMemoryMap *create(string path, unsigned long long size) except +
+        @staticmethod
+        CMemoryMap *attach(string path, size_t used) except +
         void close() except +
+        void recycle() except +
+        size_t usedSize() const
+        size_t releasedSize() const
 
 cdef class MemoryMap:
     cdef CMemoryMap *_this
@@ -662,12 +758,29 @@ cdef class MemoryMap:
         mm._this = CMemoryMap.create(path.encode('utf-8'), size=size)
         return mm
 
+    @staticmethod
+    def attach(path, used_size):
+        mm = MemoryMap()
+        mm._this = CMemoryMap.attach(path.encode('utf-8'), used_size)
+        return mm
+
     def __init__(self):
         pass
 
     def close(self):
         self._this.close()
 
+    def recycle(self):
+        self._this.recycle()
+
+    @property
+    def used_size(self):
+        return self._this.usedSize()
+
+    @property
+    def released_size(self):
+        return self._this.releasedSize()
+
 
 def decode(string str):
     return str.c_str().decode('utf-8')
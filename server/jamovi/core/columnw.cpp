@@ -7,6 +7,7 @@
 #include <stdexcept>
 #include <climits>
 #include <map>
+#include <algorithm>
 #include <set>
 #include <iomanip>
 #include <cmath>
@@ -35,8 +36,10 @@ void ColumnW::setName(const char *name)
     memcpy(chars, name, length);
 
     ColumnStruct *s = struc();
+    _releaseChars(s->name);
     s->name = _mm->base(chars);
     s->changes++;
+    s->version++;
 }
 
 void ColumnW::setImportName(const char *name)
@@ -48,37 +51,68 @@ void ColumnW::setImportName(const char *name)
     memcpy(chars, name, length);
 
     ColumnStruct *s = struc();
+    _releaseChars(s->importName);
     s->importName = _mm->base(chars);
     s->changes++;
+    s->version++;
 }
 
 void ColumnW::setColumnType(ColumnType::Type columnType)
 {
     ColumnStruct *s = struc();
+    bool wasFilter = (s->columnType == ColumnType::FILTER);
     s->columnType = (char)columnType;
     s->changes++;
+    s->version++;
+
+    if (wasFilter || columnType == ColumnType::FILTER)
+        _filterChanged(0, rowCount());
 }
 
 void ColumnW::setDataType(DataType::Type dataType)
 {
+    bool hadStrings = (this->dataType() == DataType::TEXT && measureType() == MeasureType::ID);
+
     ColumnStruct *s = struc();
     s->dataType = (char)dataType;
     s->changes++;
+    _touchAll();
 
     if (dataType == DataType::DECIMAL)
+    {
         _setRowCount<double>(rowCount()); // keeps the row count the same, but allocates space
+    }
     else if (dataType == DataType::TEXT && measureType() == MeasureType::ID)
+    {
         _setRowCount<char*>(rowCount()); // keeps the row count the same, but allocates space
+        if ( ! hadStrings)
+            _clearStrings();
+    }
 }
 
 void ColumnW::setMeasureType(MeasureType::Type measureType)
 {
+    bool hadStrings = (dataType() == DataType::TEXT && this->measureType() == MeasureType::ID);
+
     ColumnStruct *s = struc();
     s->measureType = (char)measureType;
     s->changes++;
+    _touchAll();
 
     if (dataType() == DataType::TEXT && measureType == MeasureType::ID)
+    {
         _setRowCount<char*>(rowCount()); // keeps the row count the same, but allocates space
+        if ( ! hadStrings)
+            _clearStrings();
+    }
+}
+
+void ColumnW::_clearStrings()
+{
+    // the cells hold values of the previous type, rather than strings,
+    // so they're cleared before they're read (or released) as strings
+    for (int i = 0; i < rowCount(); i++)
+        cellAt<char*>(i) = NULL;
 }
 
 void ColumnW::setAutoMeasure(bool yes)
@@ -86,6 +120,7 @@ void ColumnW::setAutoMeasure(bool yes)
     ColumnStruct *s = struc();
     s->autoMeasure = yes;
     s->changes++;
+    s->version++;
 }
 
 void ColumnW::setDPs(int dps)
@@ -93,6 +128,7 @@ void ColumnW::setDPs(int dps)
     ColumnStruct *s = struc();
     s->dps = dps;
     s->changes++;
+    s->version++;
 }
 
 void ColumnW::setActive(bool active)
@@ -100,6 +136,10 @@ void ColumnW::setActive(bool active)
     ColumnStruct *s = struc();
     s->active = active;
     s->changes++;
+    s->version++;
+
+    if (columnType() == ColumnType::FILTER)
+        _filterChanged(0, rowCount());
 }
 
 void ColumnW::setTrimLevels(bool trim)
@@ -113,6 +153,7 @@ void ColumnW::setTrimLevels(bool trim)
 
     s->trimLevels = trim;
     s->changes++;
+    s->version++;
 }
 
 void ColumnW::trimUnusedLevels()
@@ -142,6 +183,7 @@ void ColumnW::setFormula(const char *value)
         char *space = _mm->allocateSize<char>(needed, &allocated);
         memcpy(space, value, needed);
         s = struc();
+        _mm->release(s->formula, s->formulaCapacity);
         s->formula = _mm->base<char>(space);
         s->formulaCapacity = allocated;
     }
@@ -152,6 +194,7 @@ void ColumnW::setFormula(const char *value)
     }
 
     s->changes++;
+    s->version++;
 }
 
 void ColumnW::setFormulaMessage(const char *value)
@@ -165,6 +208,7 @@ void ColumnW::setFormulaMessage(const char *value)
         char *space = _mm->allocateSize<char>(needed, &allocated);
         memcpy(space, value, needed);
         s = struc();
+        _mm->release(s->formulaMessage, s->formulaMessageCapacity);
         s->formulaMessage = _mm->base<char>(space);
         s->formulaMessageCapacity = allocated;
     }
@@ -175,6 +219,7 @@ void ColumnW::setFormulaMessage(const char *value)
     }
 
     s->changes++;
+    s->version++;
 }
 
 void ColumnW::setDValue(int rowIndex, double value, bool initing)
@@ -182,6 +227,7 @@ void ColumnW::setDValue(int rowIndex, double value, bool initing)
     if ( ! initing)
         _discardScratchColumn();
 
+    _touchRows<double>(rowIndex, 1);
     cellAt<double>(rowIndex) = value;
 }
 
@@ -193,6 +239,12 @@ void ColumnW::setSValue(int rowIndex, const char *value, bool initing)
     assert(dataType() == DataType::TEXT);
     assert(measureType() == MeasureType::ID);
 
+    _touchRows<char*>(rowIndex, 1);
+
+    // when initing, the cell may not yet hold a string
+    if ( ! initing)
+        _releaseChars(cellAt<char*>(rowIndex));
+
     if (value == NULL || value[0] == '\0')
     {
         cellAt<char*>(rowIndex) = NULL;
@@ -254,7 +306,31 @@ void ColumnW::setIValue(int rowIndex, int value, bool initing)
         }
     }
 
+    _touchRows<int>(rowIndex, 1);
     cellAt<int>(rowIndex) = value;
+
+    if (columnType() == ColumnType::FILTER)
+        _filterChanged(rowIndex, 1);
+}
+
+void ColumnW::_filterChanged(int rowStart, int rowCount)
+{
+    if (_parent != NULL)
+        ((DataSetW*)_parent)->refreshFilterState(rowStart, rowCount);
+}
+
+void ColumnW::adjustLevelCountExFiltered(int rowIndex, int delta)
+{
+    if (rowIndex >= rowCount())
+        return;
+
+    int value = cellAt<int>(rowIndex);
+    if (value == INT_MIN)
+        return;
+
+    Level *level = rawLevel(value);
+    if (level != NULL)
+        level->countExFiltered += delta;
 }
 
 void ColumnW::insertRows(int insStart, int insEnd)
@@ -266,32 +342,97 @@ void ColumnW::insertRows(int insStart, int insEnd)
     if (dataType() == DataType::DECIMAL)
     {
         setRowCount<double>(finalCount);
-
-        for (int j = finalCount - 1; j > insEnd; j--)
-            cellAt<double>(j) = cellAt<double>(j - insCount);
+        _moveRows<double>(insStart, insEnd + 1, startCount - insStart);
 
         for (int j = insStart; j <= insEnd; j++)
             cellAt<double>(j) = NAN;
+
+        _touchRows<double>(insStart, finalCount - insStart);
     }
     else if (dataType() == DataType::TEXT && measureType() == MeasureType::ID)
     {
         setRowCount<char*>(finalCount);
-
-        for (int j = finalCount - 1; j > insEnd; j--)
-            cellAt<char*>(j) = cellAt<char*>(j - insCount);
+        _moveRows<char*>(insStart, insEnd + 1, startCount - insStart);
 
         for (int j = insStart; j <= insEnd; j++)
             cellAt<char*>(j) = NULL;
+
+        _touchRows<char*>(insStart, finalCount - insStart);
     }
     else
     {
         setRowCount<int>(finalCount);
-
-        for (int j = finalCount - 1; j > insEnd; j--)
-            cellAt<int>(j) = cellAt<int>(j - insCount);
+        _moveRows<int>(insStart, insEnd + 1, startCount - insStart);
 
         for (int j = insStart; j <= insEnd; j++)
             cellAt<int>(j) = INT_MIN;
+
+        _touchRows<int>(insStart, finalCount - insStart);
+    }
+}
+
+void ColumnW::deleteRows(const vector<pair<int, int> > &ranges)
+{
+    // the ranges are inclusive, in order, and don't overlap
+
+    if (ranges.empty())
+        return;
+
+    _discardScratchColumn();
+
+    if (dataType() == DataType::DECIMAL)
+    {
+        setRowCount<double>(_compactRows<double>(ranges));
+    }
+    else if (dataType() == DataType::TEXT && measureType() == MeasureType::ID)
+    {
+        for (const pair<int, int> &range : ranges)
+        {
+            for (int j = range.first; j <= range.second; j++)
+                _releaseChars(cellAt<char*>(j));
+        }
+
+        setRowCount<char*>(_compactRows<char*>(ranges));
+    }
+    else
+    {
+        // the levels of the deleted values lose their counts, and are
+        // trimmed once the rows are gone
+        vector<int> emptied;
+
+        if (hasLevels())
+        {
+            for (const pair<int, int> &range : ranges)
+            {
+                for (int j = range.first; j <= range.second; j++)
+                {
+                    int value = cellAt<int>(j);
+                    if (value == INT_MIN)
+                        continue;
+                    Level *level = rawLevel(value);
+                    assert(level != NULL);
+                    level->count--;
+                    if (level->count == 0)
+                        emptied.push_back(value);
+                }
+            }
+        }
+
+        int startCount = rowCount();
+        int finalCount = _compactRows<int>(ranges);
+
+        for (int j = finalCount; j < startCount; j++)
+            cellAt<int>(j) = INT_MIN;
+
+        setRowCount<int>(finalCount);
+
+        if (trimLevels())
+        {
+            // from the highest, as removing text levels renumbers those above
+            sort(emptied.rbegin(), emptied.rend());
+            for (int value : emptied)
+                removeLevel(value);
+        }
     }
 }
 
@@ -331,6 +472,7 @@ void ColumnW::appendLevel(int value, const char *label, const char *importValue)
             }
         }
 
+        _mm->releaseCount(s->levels, oldCapacity);
         s->levels = _mm->base(newLevels);
         s->levelsCapacity = newCapacity;
     }
@@ -362,6 +504,7 @@ void ColumnW::appendLevel(int value, const char *label, const char *importValue)
 
     s->levelsUsed++;
     s->changes++;
+    s->version++;
 }
 
 void ColumnW::updateLevelCounts() {
@@ -472,6 +615,7 @@ void ColumnW::insertLevel(int value, const char *label, const char *importValue)
     }
 
     s->changes++;
+    s->version++;
 }
 
 void ColumnW::removeLevel(int value)
@@ -491,6 +635,9 @@ void ColumnW::removeLevel(int value)
 
     int index = i;
 
+    _mm->release(levels[i].label, levels[i].capacity);
+    _mm->release(levels[i].importValue, levels[i].importCapacity);
+
     for (; i < s->levelsUsed - 1; i++)
         levels[i] = levels[i+1];
 
@@ -508,16 +655,26 @@ void ColumnW::removeLevel(int value)
             if (v > value)
                 v--;
         }
+
+        _touchAll();
     }
 
     s->changes++;
+    s->version++;
 }
 
 void ColumnW::clearLevels()
 {
     ColumnStruct *s = struc();
+    Level *levels = _mm->resolve(s->levels);
+    for (int i = 0; i < s->levelsUsed; i++)
+    {
+        _mm->release(levels[i].label, levels[i].capacity);
+        _mm->release(levels[i].importValue, levels[i].importCapacity);
+    }
     s->levelsUsed = 0;
     s->changes++;
+    s->version++;
 }
 
 int ColumnW::changes() const
@@ -525,6 +682,115 @@ int ColumnW::changes() const
     return struc()->changes;
 }
 
+int ColumnW::version() const
+{
+    return struc()->version;
+}
+
+void ColumnW::_touchAll()
+{
+    ColumnStruct *s = struc();
+    s->version++;
+
+    Block **blocks = _mm->resolve<Block*>(s->blocks);
+    for (int i = 0; i < s->blocksUsed; i++)
+        _mm->resolve<Block>(blocks[i])->hashedCount = -1;
+}
+
+static const unsigned long long FNV_OFFSET = 14695981039346656037ULL;
+static const unsigned long long FNV_PRIME = 1099511628211ULL;
+
+static unsigned long long hashBytes(const char *bytes, size_t n, unsigned long long h)
+{
+    // FNV-1a, eight bytes at a time
+    size_t i = 0;
+    for (; i + 8 <= n; i += 8)
+    {
+        unsigned long long word;
+        memcpy(&word, &bytes[i], 8);
+        h = (h ^ word) * FNV_PRIME;
+    }
+    for (; i < n; i++)
+        h = (h ^ (unsigned char)bytes[i]) * FNV_PRIME;
+    return h;
+}
+
+unsigned long long ColumnW::contentHash()
+{
+    // the hashes of the blocks are kept, and only those blocks written
+    // to since are hashed again
+
+    ColumnStruct *s = struc();
+    if (s->hashedVersion == s->version)
+        return s->hash;
+
+    bool strings = (dataType() == DataType::TEXT && measureType() == MeasureType::ID);
+    size_t cellSize;
+    if (dataType() == DataType::DECIMAL)
+        cellSize = sizeof(double);
+    else if (strings)
+        cellSize = sizeof(char*);
+    else
+        cellSize = sizeof(int);
+
+    int rowCount = s->rowCount;
+    int perBlock = VALUES_SPACE / cellSize;
+    Block **blocks = _mm->resolve<Block*>(s->blocks);
+
+    unsigned long long h = FNV_OFFSET;
+    h = hashBytes(&s->dataType, 1, h);
+    h = hashBytes(&s->measureType, 1, h);
+    h = hashBytes((const char*)&rowCount, sizeof(int), h);
+
+    for (int i = 0; i * perBlock < rowCount; i++)
+    {
+        Block *block = _mm->resolve<Block>(blocks[i]);
+        int count = rowCount - i * perBlock;
+        if (count > perBlock)
+            count = perBlock;
+
+        if (block->hashedCount != count)
+        {
+            unsigned long long bh = FNV_OFFSET;
+            if (strings)
+            {
+                char **values = (char**)block->values;
+                for (int j = 0; j < count; j++)
+                {
+                    const char *value = "";
+                    if (values[j] != NULL)
+                        value = _mm->resolve<char>(values[j]);
+                    bh = hashBytes(value, strlen(value) + 1, bh);
+                }
+            }
+            else
+            {
+                bh = hashBytes(block->values, count * cellSize, bh);
+            }
+            block->hash = bh;
+            block->hashedCount = count;
+        }
+
+        h = (h ^ block->hash) * FNV_PRIME;
+    }
+
+    Level *levels = _mm->resolve(s->levels);
+    for (int i = 0; i < s->levelsUsed; i++)
+    {
+        Level &level = levels[i];
+        const char *label = _mm->resolve(level.label);
+        const char *importValue = _mm->resolve(level.importValue);
+        h = hashBytes((const char*)&level.value, sizeof(int), h);
+        h = hashBytes(label, strlen(label) + 1, h);
+        h = hashBytes(importValue, strlen(importValue) + 1, h);
+    }
+
+    s->hash = h;
+    s->hashedVersion = s->version;
+
+    return h;
+}
+
 void ColumnW::setLevels(const vector<LevelData> &newLevels)
 {
     if ( ! hasLevels())
@@ -957,6 +1223,41 @@ void ColumnW::_transferLevels(ColumnW &dest, ColumnW &src)
     }
 }
 
+void ColumnW::_releaseChars(char *chars)
+{
+    // chars is a relative pointer, as stored in the structures
+    if (chars != NULL)
+        _mm->release(chars, strlen(_mm->resolve(chars)) + 1);
+}
+
+void ColumnW::_release()
+{
+    // releases all the column's space, as it's being deleted
+
+    ColumnStruct *s = struc();
+
+    if (dataType() == DataType::TEXT && measureType() == MeasureType::ID)
+    {
+        for (int i = 0; i < s->rowCount; i++)
+            _releaseChars(cellAt<char*>(i));
+    }
+
+    Block **blocks = _mm->resolve(s->blocks);
+    for (int i = 0; i < s->blocksUsed; i++)
+        _mm->release(blocks[i], BLOCK_SIZE);
+    _mm->releaseCount(s->blocks, s->blockCapacity);
+
+    clearLevels();
+    _mm->releaseCount(s->levels, s->levelsCapacity);
+
+    _releaseChars(s->name);
+    _releaseChars(s->importName);
+    _mm->release(s->formula, s->formulaCapacity);
+    _mm->release(s->formulaMessage, s->formulaMessageCapacity);
+
+    _mm->releaseCount(_rel, 1);
+}
+
 void ColumnW::_discardScratchColumn()
 {
     DataSetW *ds = (DataSetW*)_parent;
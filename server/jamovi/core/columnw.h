@@ -37,6 +37,7 @@ public:
     void clearLevels();
     void updateLevelCounts();
     void insertRows(int from, int to);
+    void deleteRows(const std::vector<std::pair<int, int> > &ranges);
     void setDPs(int dps);
     void setFormula(const char *value);
     void setFormulaMessage(const char *value);
@@ -50,6 +51,8 @@ public:
     void setLevels(const std::vector<LevelData> &levels);
 
     int changes() const;
+    int version() const;
+    unsigned long long contentHash();
 
     template<typename T> void setRowCount(size_t count)
     {
@@ -74,6 +77,53 @@ public:
         *p = value;
     }
 
+    template<typename T> void writeRange(int rowStart, int rowCount, const T *src, bool initing = false)
+    {
+        ColumnStruct *cs = _mm->resolve<ColumnStruct>(_rel);
+
+        if (rowStart < 0 || rowCount < 0 || rowStart + rowCount > cs->rowCount)
+            throw std::runtime_error("index out of bounds");
+
+        if ( ! initing)
+            _discardScratchColumn();
+
+        if (hasLevels())
+        {
+            // the level counts need maintaining, so these go one at a time
+            for (int i = 0; i < rowCount; i++)
+                setIValue(rowStart + i, (int)src[i], initing);
+            return;
+        }
+
+        _touchRows<T>(rowStart, rowCount);
+
+        int perBlock = VALUES_SPACE / sizeof(T);
+        cs = _mm->resolve<ColumnStruct>(_rel);
+        Block **blocks = _mm->resolve<Block*>(cs->blocks);
+
+        int rowNo = rowStart;
+        int remaining = rowCount;
+
+        while (remaining > 0)
+        {
+            int blockIndex = rowNo / perBlock;
+            int index = rowNo % perBlock;
+            int n = perBlock - index;
+            if (n > remaining)
+                n = remaining;
+
+            Block *block = _mm->resolve<Block>(blocks[blockIndex]);
+            memcpy(&block->values[index * sizeof(T)], src, n * sizeof(T));
+
+            src += n;
+            rowNo += n;
+            remaining -= n;
+        }
+
+        if (columnType() == ColumnType::FILTER)
+            _filterChanged(rowStart, rowCount);
+    }
+
 private:
 
     int ivalue(int index);
@@ -83,6 +133,102 @@ private:
     MemoryMapW *_mm;
     static void _transferLevels(ColumnW &dest, ColumnW &src);
     void _discardScratchColumn();
+    void _touchAll();
+    void _releaseChars(char *chars);
+    void _clearStrings();
+    void _release();
+    void _filterChanged(int rowStart, int rowCount);
+    void adjustLevelCountExFiltered(int rowIndex, int delta);
+
+    template<typename T> void _touchRows(int rowStart, int rowCount)
+    {
+        // bumps the version, and marks the hashes of the blocks
+        // holding these rows as out of date
+        ColumnStruct *cs = _mm->resolve<ColumnStruct>(_rel);
+        cs->version++;
+
+        if (rowCount <= 0)
+            return;
+
+        int perBlock = VALUES_SPACE / sizeof(T);
+        int blockEnd = (rowStart + rowCount - 1) / perBlock;
+        if (blockEnd >= cs->blocksUsed)
+            blockEnd = cs->blocksUsed - 1;
+
+        Block **blocks = _mm->resolve<Block*>(cs->blocks);
+        for (int i = rowStart / perBlock; i <= blockEnd; i++)
+            _mm->resolve<Block>(blocks[i])->hashedCount = -1;
+    }
+
+    template<typename T> void _moveRows(int from, int to, int count)
+    {
+        // moves a run of rows (the runs may overlap), a memmove for
+        // each stretch which lies within a single block of both
+
+        ColumnStruct *cs = _mm->resolve<ColumnStruct>(_rel);
+        Block **blocks = _mm->resolve<Block*>(cs->blocks);
+        int perBlock = VALUES_SPACE / sizeof(T);
+
+        int remaining = count;
+
+        while (remaining > 0)
+        {
+            int src;
+            int dest;
+            int n = remaining;
+
+            if (to < from)
+            {
+                // forwards, from the start of the run
+                src = from + count - remaining;
+                dest = to + count - remaining;
+                if (n > perBlock - src % perBlock)
+                    n = perBlock - src % perBlock;
+                if (n > perBlock - dest % perBlock)
+                    n = perBlock - dest % perBlock;
+            }
+            else
+            {
+                // backwards, from the end of the run
+                if (n > (from + remaining - 1) % perBlock + 1)
+                    n = (from + remaining - 1) % perBlock + 1;
+                if (n > (to + remaining - 1) % perBlock + 1)
+                    n = (to + remaining - 1) % perBlock + 1;
+                src = from + remaining - n;
+                dest = to + remaining - n;
+            }
+
+            Block *srcBlock = _mm->resolve<Block>(blocks[src / perBlock]);
+            Block *destBlock = _mm->resolve<Block>(blocks[dest / perBlock]);
+            memmove(
+                &destBlock->values[(dest % perBlock) * sizeof(T)],
+                &srcBlock->values[(src % perBlock) * sizeof(T)],
+                n * sizeof(T));
+
+            remaining -= n;
+        }
+    }
+
+    template<typename T> int _compactRows(const std::vector<std::pair<int, int> > &ranges)
+    {
+        // closes up the rows which remain between and after the deleted
+        // ranges, returning the new row count
+
+        int count = rowCount();
+        int dest = ranges[0].first;
+
+        for (size_t i = 0; i < ranges.size(); i++)
+        {
+            int from = ranges[i].second + 1;
+            int to = (i + 1 < ranges.size()) ? ranges[i + 1].first : count;
+            _moveRows<T>(from, dest, to - from);
+            dest += to - from;
+        }
+
+        _touchRows<T>(ranges[0].first, count - ranges[0].first);
+
+        return dest;
+    }
 
     template<typename T> void _setRowCount(size_t count)
     {
@@ -92,6 +238,7 @@ private:
         for (int i = cs->blocksUsed; i < blocksRequired; i++)
         {
             Block *block = _mm->allocateSize<Block>(BLOCK_SIZE);
+            block->hashedCount = -1;
             cs = _mm->resolve<ColumnStruct>(_rel);
             Block **blocks = _mm->resolve<Block*>(cs->blocks);
             blocks[i] = _mm->base(block);
@@ -101,6 +248,9 @@ private:
         int oldCount = cs->rowCount;
         cs->rowCount = count;
 
+        if (count != (size_t)oldCount)
+            _touchRows<T>(oldCount, count - oldCount);
+
         if (dataType() == DataType::DECIMAL)
         {
             for (size_t i = oldCount; i < count; i++)
@@ -9,8 +9,31 @@
 #include <stdexcept>
 #include <cmath>
 
+#include <boost/nowide/cstdio.hpp>
+
 using namespace std;
 
+static char *copyChars(MemoryMapW *src, char *chars, MemoryMapW *dest, size_t capacity = 0, size_t *allocated = 0)
+{
+    // copies a string from one map to another, taking relative pointers
+
+    if (chars == NULL)
+    {
+        if (allocated != NULL)
+            *allocated = 0;
+        return NULL;
+    }
+
+    const char *value = src->resolve(chars);
+    size_t length = strlen(value) + 1;
+    if (capacity < length)
+        capacity = length;
+
+    char *copy = dest->allocate<char>(capacity, allocated);
+    memcpy(copy, value, length);
+    return dest->base(copy);
+}
+
 DataSetW *DataSetW::create(MemoryMapW *mm)
 {
     DataSetW *ds = new DataSetW(mm);
@@ -27,18 +50,9 @@ DataSetW *DataSetW::create(MemoryMapW *mm)
     dss->nextColumnId = 1;  // an id of zero is reserved for 'no column'
     dss->scratch = NULL;
     dss->rowCountExFiltered = 0;
-    dss->indices = NULL;
-
-    // add the filter indices column
-    ColumnStruct *col = mm->allocateBase<ColumnStruct>();
-    dss = mm->resolve<DataSetStruct>(ds->_rel);
-    dss->indices = col;
-
-    ColumnStruct *ind = mm->resolve(col);
-    initColumn(mm, ind);
-    ColumnW indices = ColumnW(ds, mm, col);
-    indices.setDataType(DataType::INTEGER);
-    indices.setMeasureType(MeasureType::ID);
+    dss->filterMask = NULL;
+    dss->filterRanks = NULL;
+    dss->filterCapacity = 0;
 
     return ds;
 }
@@ -58,6 +72,7 @@ DataSetW::DataSetW(MemoryMapW *mm)
     _mm = mm;
     _edited = false;
     _blank = false;
+    _filterStateDeferred = 0;
 }
 
 void DataSetW::setEdited(bool edited)
@@ -197,6 +212,9 @@ void DataSetW::initColumn(MemoryMapW *mm, ColumnStruct *&columnp)
     column->active = true;
     column->trimLevels = true;
     column->changes = 0;
+    column->version = 0;
+    column->hashedVersion = -1;
+    column->hash = 0;
 
     column->formula = NULL;
     column->formulaCapacity = 0;
@@ -220,9 +238,38 @@ void DataSetW::initColumn(MemoryMapW *mm, ColumnStruct *&columnp)
 
 void DataSetW::setRowCount(size_t count)
 {
+    _filterStateDeferred++;
+
     DataSetStruct *dss = _mm->resolve<DataSetStruct>(_rel);
     ColumnStruct **columns = _mm->resolve<ColumnStruct*>(dss->columns);
 
+    // room for the new blocks of every column is reserved up front, so
+    // the memory map grows (at most) once, rather than column by column
+
+    size_t required = 0;
+
+    for (int i = 0; i < dss->columnCount; i++)
+    {
+        ColumnStruct *c = columns[i];
+        ColumnW column(this, _mm, c);
+
+        size_t valueSize = sizeof(int);
+        if (column.dataType() == DataType::DECIMAL)
+            valueSize = sizeof(double);
+        else if (column.dataType() == DataType::TEXT && column.measureType() == MeasureType::ID)
+            valueSize = sizeof(char*);
+
+        int blocksUsed = _mm->resolve(c)->blocksUsed;
+        int blocksRequired = count * valueSize / VALUES_SPACE + 1;
+        if (blocksRequired > blocksUsed)
+            required += (size_t)(blocksRequired - blocksUsed) * BLOCK_SIZE;
+    }
+
+    _mm->reserve(required);
+
+    dss     = _mm->resolve(_rel);
+    columns = _mm->resolve(dss->columns);
+
     for (int i = 0; i < dss->columnCount; i++)
     {
         ColumnStruct *c = columns[i];
@@ -239,14 +286,22 @@ void DataSetW::setRowCount(size_t count)
         columns = _mm->resolve(dss->columns);
     }
 
-    indices()._setRowCount<int>(count);
-
     dss = _mm->resolve(_rel);
     dss->rowCount = count;
+
+    _filterStateDeferred--;
+    refreshFilterState();
+}
+
+void DataSetW::reserve(size_t size)
+{
+    _mm->reserve(size);
 }
 
 void DataSetW::appendRows(int n)
 {
+    _filterStateDeferred++;
+
     DataSetStruct *dss = _mm->resolve<DataSetStruct>(_rel);
     ColumnStruct **columns = _mm->resolve<ColumnStruct*>(dss->columns);
 
@@ -277,6 +332,9 @@ void DataSetW::appendRows(int n)
     }
 
     dss->rowCount += n;
+
+    _filterStateDeferred--;
+    refreshFilterState();
 }
 
 void DataSetW::insertRows(int insStart, int insEnd)
@@ -284,77 +342,62 @@ void DataSetW::insertRows(int insStart, int insEnd)
     int insCount = insEnd - insStart + 1;
     int finalCount = rowCount() + insCount;
 
+    _filterStateDeferred++;
+
     for (int i = 0; i < columnCount(); i++)
         (*this)[i].insertRows(insStart, insEnd);
 
     setRowCount(finalCount);
+
+    _filterStateDeferred--;
+    refreshFilterState();
 }
 
 void DataSetW::deleteRows(int delStart, int delEnd)
 {
-    DataSetStruct *dss = _mm->resolve<DataSetStruct>(_rel);
-    ColumnStruct **columns = _mm->resolve<ColumnStruct*>(dss->columns);
+    deleteRows(vector<pair<int, int> >(1, make_pair(delStart, delEnd)));
+}
 
-    int delCount = delEnd - delStart + 1;
-    int startCount = dss->rowCount;
-    int finalCount = dss->rowCount - delCount;
+void DataSetW::deleteRows(const vector<pair<int, int> > &ranges)
+{
+    // deletes several ranges of rows in a single pass over each column.
+    // the ranges are inclusive, in order, and don't overlap
 
-    // delete from right to left, so filter rows are deleted last
-    for (int i = dss->columnCount - 1; i >= 0; i--)
-    {
-        ColumnStruct *c = columns[i];
-        ColumnW column(this, _mm, c);
+    if (ranges.empty())
+        return;
 
-        if (column.dataType() == DataType::DECIMAL)
-        {
-            for (int j = delStart; j < finalCount; j++)
-            {
-                int from = j + delCount;
-                int to = j;
-                double value = column.raw<double>(from);
-                column.setDValue(to, value);
-            }
+    DataSetStruct *dss = _mm->resolve<DataSetStruct>(_rel);
 
-            column.setRowCount<double>(finalCount);
-        }
-        else if (column.dataType() == DataType::TEXT &&
-                 column.measureType() == MeasureType::ID)
-        {
-             for (int j = delStart; j < finalCount; j++)
-             {
-                 int from = j + delCount;
-                 int to = j;
-                 const char* value = column.raws(from);
-                 column.setSValue(to, value);
-             }
-
-             column.setRowCount<char*>(finalCount);
-        }
-        else
-        {
-            for (int j = delStart; j < finalCount; j++)
-            {
-                int from = j + delCount;
-                int to = j;
-                column.setIValue(to, INT_MIN);
-                int value = column.raw<int>(from);
-                column.setIValue(to, value);
-            }
+    int finalCount = dss->rowCount;
+    for (const pair<int, int> &range : ranges)
+        finalCount -= range.second - range.first + 1;
 
-            for (int j = finalCount; j < startCount; j++)
-                column.setIValue(j, INT_MIN);
+    _filterStateDeferred++;
 
-            column.setRowCount<int>(finalCount);
-        }
-    }
+    // delete from right to left, so filter rows are deleted last
+    for (int i = dss->columnCount - 1; i >= 0; i--)
+        (*this)[i].deleteRows(ranges);
 
+    dss = _mm->resolve<DataSetStruct>(_rel);
     dss->rowCount = finalCount;
+
+    _filterStateDeferred--;
+    refreshFilterState();
 }
 
 void DataSetW::deleteColumns(int delStart, int delEnd)
 {
-    // at the moment this just leaks memory, but we
-    // should store the deleted columns for re-use
+    // the space of the deleted columns is released for re-use
+
+    bool filterDeleted = false;
+    for (int i = delStart; i <= delEnd; i++)
+    {
+        ColumnW column = (*this)[i];
+        if (column.columnType() == ColumnType::FILTER)
+            filterDeleted = true;
+        discardScratchColumn(column.id());
+        column._release();
+    }
 
     DataSetStruct *dss = _mm->resolve<DataSetStruct>(_rel);
 
@@ -367,36 +410,126 @@ void DataSetW::deleteColumns(int delStart, int delEnd)
     memmove(&columns[delStart], &columns[delEnd+1], nToMove * sizeof(ColumnStruct*));
 
     dss->columnCount -= delCount;
+
+    if (filterDeleted)
+        refreshFilterState(0, rowCount());
 }
 
-ColumnW DataSetW::indices()
+vector<ColumnW> DataSetW::activeFilters()
 {
-    DataSetStruct *dss = _mm->resolve<DataSetStruct>(_rel);
-    return ColumnW(this, _mm, dss->indices);
+    vector<ColumnW> filters;
+
+    for (int i = 0; i < columnCount(); i++)
+    {
+        ColumnW column = (*this)[i];
+        if (column.columnType() != ColumnType::FILTER)
+            break;
+        if (column.active())
+            filters.push_back(column);
+    }
+
+    return filters;
+}
+
+void DataSetW::allocateFilterState(int rowCount)
+{
+    // the mask and ranks are reallocated where the rows outgrow them,
+    // their contents are rebuilt by refreshFilterState()
+
+    int nWords = rowCount / 64 + 1;
+    if (nWords <= struc()->filterCapacity)
+        return;
+
+    int capacity = 2 * struc()->filterCapacity;
+    if (capacity < nWords)
+        capacity = nWords;
+
+    unsigned long long *mask = _mm->allocateBase<unsigned long long>(capacity);
+    int *ranks = _mm->allocateBase<int>(capacity + 1);
+
+    DataSetStruct *dss = struc();
+    if (dss->filterCapacity > 0)
+    {
+        _mm->releaseCount(dss->filterMask, dss->filterCapacity);
+        _mm->releaseCount(dss->filterRanks, dss->filterCapacity + 1);
+    }
+    dss->filterMask = mask;
+    dss->filterRanks = ranks;
+    dss->filterCapacity = capacity;
 }
 
 void DataSetW::refreshFilterState()
 {
-    int nRows = 0;
+    if (_filterStateDeferred > 0)
+        return;
+
+    allocateFilterState(rowCount());
+
+    vector<ColumnW> filters = activeFilters();
+
+    DataSetStruct *dss = struc();
+    unsigned long long *mask = _mm->resolve(dss->filterMask);
+    int *ranks = _mm->resolve(dss->filterRanks);
+    int nWords = dss->filterCapacity;
+    int nRows = dss->rowCount;
 
-    ColumnW indices = this->indices();
+    memset(mask, 0, nWords * sizeof(unsigned long long));
 
-    for (int rowNo = 0; rowNo < rowCount(); rowNo++)
+    int nRowWords = (nRows + 63) / 64;
+    for (int i = 0; i < nRowWords; i++)
+        mask[i] = ~0ULL;
+    if (nRows % 64 != 0)
+        mask[nRowWords - 1] = (1ULL << (nRows % 64)) - 1;
+
+    // each filter is read a chunk at a time, and its values packed into
+    // words which are ANDed into the mask
+
+    const int CHUNK_WORDS = 64;
+    int values[CHUNK_WORDS * 64];
+
+    for (ColumnW &filter : filters)
     {
-        if ( ! isRowFiltered(rowNo))
+        for (int wordStart = 0; wordStart < nRowWords; wordStart += CHUNK_WORDS)
         {
-            indices.setIValue(nRows, rowNo);
-            nRows++;
+            int rowStart = wordStart * 64;
+            int rowCount = CHUNK_WORDS * 64;
+            if (rowStart + rowCount > nRows)
+                rowCount = nRows - rowStart;
+
+            filter.readRange<int>(rowStart, rowCount, values);
+
+            for (int i = 0; i * 64 < rowCount; i++)
+            {
+                int n = rowCount - i * 64;
+                if (n > 64)
+                    n = 64;
+                int *v = &values[i * 64];
+                unsigned long long word = 0;
+                for (int j = 0; j < n; j++)
+                    word |= (unsigned long long)(v[j] == 1) << j;
+                mask[wordStart + i] &= word;
+            }
         }
     }
 
-    for (int rowNo = nRows; rowNo < rowCount(); rowNo++)
-        indices.setIValue(rowNo, INT_MIN);
+    // build the fenwick tree in place
+    int nIncluded = 0;
+    ranks[0] = 0;
+    for (int i = 1; i <= nWords; i++)
+    {
+        ranks[i] = bitCount(mask[i - 1]);
+        nIncluded += ranks[i];
+    }
+    for (int i = 1; i <= nWords; i++)
+    {
+        int parent = i + (i & -i);
+        if (parent <= nWords)
+            ranks[parent] += ranks[i];
+    }
 
-    DataSetStruct *dss = _mm->resolve<DataSetStruct>(_rel);
-    ColumnStruct **columns = _mm->resolve(struc()->columns);
+    dss->rowCountExFiltered = nIncluded;
 
-    dss->rowCountExFiltered = nRows;
+    ColumnStruct **columns = _mm->resolve(dss->columns);
 
     for (int i = 0; i < dss->columnCount; i++)
     {
@@ -407,6 +540,201 @@ void DataSetW::refreshFilterState()
     }
 }
 
+void DataSetW::refreshFilterState(int rowStart, int rowCount)
+{
+    // updates the filter state of just these rows, following a change
+    // to the filters
+
+    if (_filterStateDeferred > 0 || rowStart < 0)
+        return;
+
+    DataSetStruct *dss = struc();
+    if (rowStart + rowCount > dss->rowCount)
+        rowCount = dss->rowCount - rowStart;
+    if (rowCount <= 0)
+        return;
+
+    vector<ColumnW> filters = activeFilters();
+    vector<ColumnW> levelled;
+    bool levelledFound = false;
+
+    dss = struc();
+    unsigned long long *mask = _mm->resolve(dss->filterMask);
+    int *ranks = _mm->resolve(dss->filterRanks);
+    int nWords = dss->filterCapacity;
+
+    for (int rowNo = rowStart; rowNo < rowStart + rowCount; rowNo++)
+    {
+        bool filtered = false;
+        for (ColumnW &filter : filters)
+        {
+            if (filter.raw<int>(rowNo) != 1)
+            {
+                filtered = true;
+                break;
+            }
+        }
+
+        unsigned long long bit = 1ULL << (rowNo % 64);
+        unsigned long long &word = mask[rowNo / 64];
+        if (filtered == ((word & bit) == 0))
+            continue;
+
+        word ^= bit;
+        int delta = filtered ? -1 : 1;
+        for (int i = rowNo / 64 + 1; i <= nWords; i += i & -i)
+            ranks[i] += delta;
+        dss->rowCountExFiltered += delta;
+
+        // the level counts of the other columns change too
+        if ( ! levelledFound)
+        {
+            for (int i = 0; i < dss->columnCount; i++)
+            {
+                ColumnW column = (*this)[i];
+                if (column.columnType() != ColumnType::FILTER && column.hasLevels())
+                    levelled.push_back(column);
+            }
+            levelledFound = true;
+        }
+
+        for (ColumnW &column : levelled)
+            column.adjustLevelCountExFiltered(rowNo, delta);
+    }
+}
+
+void DataSetW::compact()
+{
+    // the live structures are copied end to end into a fresh map, and its
+    // contents taken back in place of this map's. this reclaims the
+    // space of everything deleted or replaced, released or not
+
+    string path = _mm->path() + ".compact";
+    MemoryMapW *dest = MemoryMapW::create(path, _mm->usedSize() - _mm->releasedSize() + 1024 * 1024);
+
+    DataSetStruct *from = struc();
+
+    // the data set is allocated first, at the root, as in create()
+    DataSetStruct *rel = dest->allocateBase<DataSetStruct>();
+    *dest->resolve(rel) = *from;
+
+    ColumnStruct **columns = dest->allocateBase<ColumnStruct*>(from->capacity);
+    ColumnStruct **fromColumns = _mm->resolve(from->columns);
+    for (int i = 0; i < from->columnCount; i++)
+    {
+        ColumnStruct *column = copyColumn(_mm, fromColumns[i], dest);
+        dest->resolve(columns)[i] = column;
+    }
+
+    // the scratch column is only worth keeping while it's in use
+    ColumnStruct *scratch = NULL;
+    if (from->scratch != NULL && _mm->resolve(from->scratch)->id != -1)
+        scratch = copyColumn(_mm, from->scratch, dest, true);
+
+    unsigned long long *filterMask = NULL;
+    int *filterRanks = NULL;
+    if (from->filterCapacity > 0)
+    {
+        filterMask = dest->allocateBase<unsigned long long>(from->filterCapacity);
+        filterRanks = dest->allocateBase<int>(from->filterCapacity + 1);
+        memcpy(dest->resolve(filterMask), _mm->resolve(from->filterMask), from->filterCapacity * sizeof(unsigned long long));
+        memcpy(dest->resolve(filterRanks), _mm->resolve(from->filterRanks), (from->filterCapacity + 1) * sizeof(int));
+    }
+
+    DataSetStruct *dss = dest->resolve(rel);
+    dss->columns = columns;
+    dss->scratch = scratch;
+    dss->filterMask = filterMask;
+    dss->filterRanks = filterRanks;
+
+    _mm->copyFrom(dest);
+
+    dest->close();
+    delete dest;
+    boost::nowide::remove(path.c_str());
+}
+
+ColumnStruct *DataSetW::copyColumn(MemoryMapW *src, ColumnStruct *rel, MemoryMapW *dest, bool scratch)
+{
+    // copies a column from one map to another, returning its relative
+    // pointer in the destination
+
+    ColumnStruct *from = src->resolve(rel);
+    ColumnStruct column = *from;
+    size_t allocated;
+
+    if (scratch)
+    {
+        // the names and formulas of the scratch column may be stale,
+        // they're replaced whenever it's swapped in
+        column.name = NULL;
+        column.importName = NULL;
+        column.formula = NULL;
+        column.formulaCapacity = 0;
+        column.formulaMessage = NULL;
+        column.formulaMessageCapacity = 0;
+    }
+    else
+    {
+        column.name = copyChars(src, from->name, dest);
+        column.importName = copyChars(src, from->importName, dest);
+        column.formula = copyChars(src, from->formula, dest, from->formulaCapacity, &allocated);
+        column.formulaCapacity = allocated;
+        column.formulaMessage = copyChars(src, from->formulaMessage, dest, from->formulaMessageCapacity, &allocated);
+        column.formulaMessageCapacity = allocated;
+    }
+
+    column.levels = NULL;
+    if (from->levelsCapacity > 0)
+    {
+        Level *fromLevels = src->resolve(from->levels);
+        column.levels = dest->allocateBase<Level>(from->levelsCapacity);
+
+        for (int i = 0; i < from->levelsUsed; i++)
+        {
+            Level level = fromLevels[i];
+            level.label = copyChars(src, level.label, dest, level.capacity, &allocated);
+            level.capacity = allocated;
+            level.importValue = copyChars(src, level.importValue, dest, level.importCapacity, &allocated);
+            level.importCapacity = allocated;
+            dest->resolve(column.levels)[i] = level;
+        }
+    }
+
+    Block **fromBlocks = src->resolve(from->blocks);
+    column.blocks = dest->allocateBase<Block*>(from->blockCapacity);
+
+    for (int i = 0; i < from->blocksUsed; i++)
+    {
+        Block *block = dest->allocateSize<Block>(BLOCK_SIZE);
+        memcpy(block, src->resolve(fromBlocks[i]), BLOCK_SIZE);
+        dest->resolve(column.blocks)[i] = dest->base(block);
+    }
+
+    if (from->dataType == DataType::TEXT && from->measureType == MeasureType::ID)
+    {
+        // the strings of the cells are copied too
+        int perBlock = VALUES_SPACE / sizeof(char*);
+
+        for (int i = 0; i < from->rowCount; i++)
+        {
+            Block *fromBlock = src->resolve(fromBlocks[i / perBlock]);
+            char *value = ((char**)fromBlock->values)[i % perBlock];
+            if (value == NULL)
+                continue;
+
+            char *copy = copyChars(src, value, dest);
+            Block *block = dest->resolve(dest->resolve(column.blocks)[i / perBlock]);
+            ((char**)block->values)[i % perBlock] = copy;
+        }
+    }
+
+    ColumnStruct *copy = dest->allocateBase<ColumnStruct>();
+    *dest->resolve(copy) = column;
+
+    return copy;
+}
+
 ColumnW DataSetW::swapWithScratchColumn(ColumnW &column)
 {
     ColumnStruct *scratch = struc()->scratch;
@@ -448,6 +776,8 @@ ColumnW DataSetW::swapWithScratchColumn(ColumnW &column)
     scratch->active = old->active;
     scratch->trimLevels = old->trimLevels;
     scratch->changes = old->changes;
+    scratch->version = old->version + 1;
+    scratch->hashedVersion = -1;
 
     scratch->formula = old->formula;
     scratch->formulaCapacity = old->formulaCapacity;
@@ -6,6 +6,8 @@
 #define DATASETW_H
 
 #include <string>
+#include <vector>
+#include <utility>
 
 #include "dataset.h"
 #include "memorymapw.h"
@@ -25,14 +27,18 @@ public:
     void appendRows(int n);
     void insertRows(int rowStart, int rowEnd);
     void deleteRows(int rowStart, int rowEnd);
+    void deleteRows(const std::vector<std::pair<int, int> > &ranges);
     void deleteColumns(int rowStart, int rowEnd);
     void setRowCount(size_t count);
+    void reserve(size_t size);
     void refreshFilterState();
+    void refreshFilterState(int rowStart, int rowCount);
 
     ColumnW operator[](int index);
     ColumnW operator[](const char *name);
     ColumnW getColumnById(int id);
-    ColumnW indices();
+
+    void compact();
 
     ColumnW swapWithScratchColumn(ColumnW &column);
     void discardScratchColumn(int id);
@@ -50,9 +56,15 @@ protected:
 
 private:
 
+    static ColumnStruct *copyColumn(MemoryMapW *src, ColumnStruct *rel, MemoryMapW *dest, bool scratch = false);
+
+    std::vector<ColumnW> activeFilters();
+    void allocateFilterState(int rowCount);
+
     MemoryMapW *_mm;
     bool _edited;
     bool _blank;
+    int _filterStateDeferred;
 };
 
 #endif // DATASETW_H
@@ -4,6 +4,8 @@
 
 #include "memorymapw.h"
 
+#include <stdexcept>
+
 #include <boost/nowide/fstream.hpp>
 
 using namespace std;
@@ -14,6 +16,7 @@ MemoryMapW::MemoryMapW(const string &path, interprocess::file_mapping *file, int
 {
     _cursor = _start + MM_START_OFFSET;
     _end   = _start + _region->get_size();
+    _releasedSize = 0;
 }
 
 MemoryMapW *MemoryMapW::create(const string &path, unsigned long long size)
@@ -43,38 +46,130 @@ MemoryMapW *MemoryMapW::create(const string &path, unsigned long long size)
     return mm;
 }
 
-void MemoryMapW::enlarge(int percent)
+MemoryMapW *MemoryMapW::attach(const string &path, size_t used)
 {
-    flush();
+    // attaches to a map written earlier (perhaps by another process),
+    // with allocations continuing after the used bytes
 
-    delete _region;
-    delete _file;
+    interprocess::file_mapping  *file   = new interprocess::file_mapping(path.c_str(), interprocess::read_write);
+    interprocess::mapped_region *region = new interprocess::mapped_region(*file,       interprocess::read_write);
+
+    MemoryMapW *mm = new MemoryMapW(path, file, region);
+    mm->_size = region->get_size();
+    mm->check();
+
+    if (used < MM_START_OFFSET || used > mm->_size)
+        throw runtime_error("Memory segment is smaller than its contents");
+
+    mm->_cursor = mm->_start + used;
+
+    return mm;
+}
+
+void MemoryMapW::reserve(size_t size)
+{
+    // ensures there's room for size more bytes. the map at least doubles
+    // each time it grows, so a large import only remaps it a few times
+
+    size_t required = (_cursor - _start) + size + 1;
+    if (required <= _size)
+        return;
 
-    size_t newSize = (_size * (100 + percent)) / 100;
+    size_t newSize = 2 * _size;
+    if (newSize < required)
+        newSize = required;
     if ((newSize % 8) != 0)
         newSize += 8 - (newSize % 8);
 
-    //cout << "enlarging memory map to " << newSize << "\n";
+    resize(newSize);
+}
+
+void MemoryMapW::resize(size_t size)
+{
+    // the region needn't be flushed first; its pages stay in the file
+    // cache when it's unmapped, and extending the file with a single
+    // byte leaves the rest of it sparse
+
+    delete _region;
+    delete _file;
+
+    //cout << "enlarging memory map to " << size << "\n";
     //cout.flush();
 
     nowide::fstream stream;
     stream.open(_path.c_str(), ios::in | ios::out);
-    stream.seekg(newSize - 1);
+    stream.seekg(size - 1);
     stream.put('\0');
     stream.close();
 
     _file   = new interprocess::file_mapping(_path.c_str(), interprocess::read_write);
-    _region = new interprocess::mapped_region(*_file,       interprocess::read_write, 0, newSize);
+    _region = new interprocess::mapped_region(*_file,       interprocess::read_write, 0, size);
 
     char *cursorOffset = base<char>(_cursor);
 
-    _size = newSize;
+    _size = size;
 
     _start = (char*)_region->get_address();
     _cursor = resolve<char>(cursorOffset);
     _end = _start + _region->get_size();
 }
 
+size_t MemoryMapW::sizeClass(size_t size)
+{
+    // small sizes (strings, mostly) are rounded up to a power of two, so
+    // the space they release is more readily reused. larger sizes
+    // (blocks, tables) recur exactly, and are only aligned at 8 bytes
+
+    if (size <= 4096)
+    {
+        size_t sc = 8;
+        while (sc < size)
+            sc *= 2;
+        return sc;
+    }
+
+    if ((size % 8) != 0)
+        size += 8 - (size % 8);
+    return size;
+}
+
+void MemoryMapW::copyFrom(MemoryMapW *other)
+{
+    // takes the contents of another map, laid out at the same offsets,
+    // in place of this map's. the space beyond is cleared for reuse
+
+    size_t used = other->usedSize();
+    size_t oldUsed = usedSize();
+
+    if (used > oldUsed)
+        reserve(used - oldUsed);
+
+    memcpy(_start + MM_START_OFFSET, other->_start + MM_START_OFFSET, used - MM_START_OFFSET);
+    if (oldUsed > used)
+        memset(_start + used, 0, oldUsed - used);
+
+    _cursor = _start + used;
+    _released.clear();
+    _pending.clear();
+    _releasedSize = 0;
+}
+
+void MemoryMapW::recycle()
+{
+    // the space released since the last call becomes available for
+    // reuse. the engines read the map directly (and may be reading the
+    // released space still), so this is only called when they're not
+
+    std::map<size_t, std::vector<char*> >::iterator itr;
+    for (itr = _pending.begin(); itr != _pending.end(); itr++)
+    {
+        std::vector<char*> &released = _released[itr->first];
+        released.insert(released.end(), itr->second.begin(), itr->second.end());
+    }
+
+    _pending.clear();
+}
+
 void MemoryMapW::flush()
 {
     _region->flush(0, _region->get_size(), false);
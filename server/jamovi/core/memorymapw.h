@@ -7,29 +7,49 @@
 
 #include "memorymap.h"
 
+#include <map>
+#include <vector>
+#include <cstring>
+
 class MemoryMapW : public MemoryMap {
 
 public:
     static MemoryMapW *create(const std::string &path, unsigned long long size);
+    static MemoryMapW *attach(const std::string &path, size_t used);
     
-    void enlarge(int percent = 50);
+    void reserve(size_t size);
     void flush();
     void close();
-    
+    void copyFrom(MemoryMapW *other);
+    void recycle();
+
+    std::string path() const { return _path; }
+    size_t usedSize() const { return _cursor - _start; }
+    size_t releasedSize() const { return _releasedSize; }
+
     template<class T> T *allocateSize(size_t size, size_t *allocated = 0)
     {   
-        size_t padding = 8 - (size % 8);   // align at 8 bytes
-        if (padding > 0 && padding < 8)
-            size += padding;
+        size = sizeClass(size);
         
         if (allocated != NULL)
             *allocated = size;
         
         //std::cout << "allocating " << size << " bytes at " << (unsigned long long)(_cursor - _start) << "\n";
         //std::cout.flush();
+
+        // reuse space released earlier, where there's some of this size
+        std::map<size_t, std::vector<char*> >::iterator itr = _released.find(size);
+        if (itr != _released.end() && ! itr->second.empty())
+        {
+            char *pos = resolve<char>(itr->second.back());
+            itr->second.pop_back();
+            _releasedSize -= size;
+            memset(pos, 0, size);
+            return (T*)pos;
+        }
         
-        while (_cursor + size >= _end)
-            enlarge();
+        if (_cursor + size >= _end)
+            reserve(size);
 
         void *pos = _cursor;
         _cursor += size;
@@ -50,12 +70,36 @@ public:
     {
         return base<T>(allocateSize<T>(size, allocated));
     }
+
+    template<class T> void release(T *p, size_t size)
+    {
+        // makes the space available to later allocations of the same
+        // size, once recycle() is called. p is a relative pointer, as
+        // stored in the structures
+        if (p == NULL)
+            return;
+        size = sizeClass(size);
+        _pending[size].push_back((char*)p);
+        _releasedSize += size;
+    }
+
+    template<class T> void releaseCount(T *p, int count)
+    {
+        release<T>(p, count * sizeof(T));
+    }
     
 private:
     MemoryMapW(const std::string &path, boost::interprocess::file_mapping *file, boost::interprocess::mapped_region *region);
 
+    void resize(size_t size);
+    static size_t sizeClass(size_t size);
+
     char *_cursor;
     char *_end;
+
+    std::map<size_t, std::vector<char*> > _released;  // relative pointers, by size
+    std::map<size_t, std::vector<char*> > _pending;   // released, not yet reusable
+    size_t _releasedSize;
 };
 
 #endif // MEMORYMAPW_H
\ No newline at end of file
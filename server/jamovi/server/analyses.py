@@ -307,6 +307,17 @@ class Analyses:
         for analysis in self:
             analysis.rerun()
 
+    def invalidate(self, column_names):
+        # runs the analyses which use any of the named columns,
+        # as the data they use has changed
+        for analysis in self:
+            if not analysis.enabled:
+                continue
+            using = column_names.intersection(analysis.options.get_using())
+            if len(using) > 0:
+                analysis.changes |= using
+                analysis.run()
+
     @property
     def needs_init(self):
         return AnalysisIterator(self, True)
@@ -355,6 +366,8 @@ class Analyses:
         for analysis in self._analyses:
             if analysis.id == id:
                 self._analyses.remove(analysis)
+                analysis.status = Analysis.Status.DELETED
+                self._notify_options_changed(analysis)  # cancels any run
                 break
         else:
             raise KeyError(id)
@@ -1,6 +1,9 @@
 
 import ast
 import re
+from array import array
+
+import numpy as np
 
 from jamovi.core import ColumnType
 from jamovi.core import MeasureType
@@ -19,6 +22,9 @@ from .compute import Messages
 from .compute import FValues
 from .compute import convert
 from .compute import is_missing
+from .compute import vfvalues
+from .compute import vconvert
+from .compute import vset_missing
 
 
 NaN = float('nan')
@@ -46,29 +52,53 @@ class Column:
         self._needs_parse = False
         self._needs_recalc = False
         self._formula_status = FormulaStatus.EMPTY
+        self._loader = None
 
     def _create_child(self):
         if self._child is None:
             self._parent._realise_column(self)
 
+    def set_loader(self, loader):
+        # the values of the column are loaded with loader(column) when they
+        # are first accessed, rather than up front
+        self._loader = loader
+
+    @property
+    def needs_load(self):
+        return self._loader is not None
+
+    def load(self):
+        if self._loader is not None:
+            loader = self._loader
+            self._loader = None
+            loader(self)
+
     def __setitem__(self, index, value):
         if self._child is None:
             self._create_child()
+        if self._loader is not None:
+            self.load()
         self._child.set_value(index, value)
 
     def set_value(self, index, value):
         if self._child is None:
             self._create_child()
+        if self._loader is not None:
+            self.load()
         self._child.set_value(index, value)
 
     def __getitem__(self, index):
         if self._child is not None:
+            if self._loader is not None:
+                self.load()
             return self._child[index]
         else:
             return (-2147483648, '')
 
     def get_value(self, index):
         if self._child is not None:
+            if self._loader is not None:
+                self.load()
             return self._child.get_value(index)
         else:
             return -2147483648
@@ -79,6 +109,8 @@ class Column:
 
     def fvalue(self, index, row_count, filt):
         if self._child is not None:
+            if self._loader is not None:
+                self.load()
             if filt and self._parent.is_row_filtered(index):
                 return (-2147483648, '')
             v = self._child[index]
@@ -95,6 +127,26 @@ class Column:
     def fvalues(self, row_count, filt):
         return FValues(self, row_count, filt)
 
+    def vvalues(self, start, end, row_count, filt):
+        if self._child is None or self.data_type is DataType.TEXT:
+            return vfvalues(self, start, end, row_count, filt)
+        self.load()
+        values = np.array(self._child.read_range(start, end - start))
+        if self.data_type is DataType.INTEGER:
+            values = values.astype(np.int64)
+        if filt:
+            vset_missing(values, self._filtered_rows(start, end))
+        return values, np.zeros(end - start, dtype=bool)
+
+    @property
+    def yields_tuples(self):
+        return self.data_type is DataType.INTEGER and self.has_levels
+
+    def _filtered_rows(self, start, end):
+        if not self._parent.has_filters:
+            return np.zeros(end - start, dtype=bool)
+        return self._parent.filtered_rows(start, end)
+
     def is_atomic_node(self):
         return False
 
@@ -116,6 +168,7 @@ class Column:
         self._needs_parse = False
         self._needs_recalc = False
         self._formula_status = FormulaStatus.EMPTY
+        self._loader = None
 
     @property
     def is_filter(self):
@@ -264,6 +317,7 @@ class Column:
     def measure_type(self, measure_type):
         if self._child is None:
             self._create_child()
+        self.load()
         self._child.measure_type = measure_type
 
     @property
@@ -325,11 +379,13 @@ class Column:
 
     def determine_dps(self):
         if self._child is not None:
+            self.load()
             self._child.determine_dps()
 
     def append(self, value):
         if self._child is None:
             self._create_child()
+        self.load()
         self._child.append(value)
 
     def insert_level(self, raw, label, importValue=None):
@@ -361,6 +417,7 @@ class Column:
     def trim_unused_levels(self):
         if self._child is None:
             self._create_child()
+        self.load()
         self._child.trim_unused_levels()
 
     @property
@@ -421,29 +478,59 @@ class Column:
             return self._child.changes
         return False
 
+    @property
+    def version(self):
+        if self._child is not None:
+            return self._child.version
+        return 0
+
+    def content_hash(self):
+        if self._child is None:
+            return 0
+        self.load()
+        return self._child.content_hash()
+
     def clear_at(self, index):
         if self._child is None:
             self._create_child()
+        self.load()
         self._child.clear_at(index)
 
     def __iter__(self):
         if self._child is None:
             self._create_child()
+        self.load()
         return self._child.__iter__()
 
     def raw(self, index):
         if self._child is not None:
+            if self._loader is not None:
+                self.load()
             return self._child.raw(index)
         return -2147483648
 
+    def read_range(self, row_start, row_count):
+        if self._child is not None:
+            self.load()
+            return self._child.read_range(row_start, row_count)
+        return array('i', [ -2147483648 ]) * row_count
+
+    def write_range(self, row_start, values, initing=False):
+        if self._child is None:
+            self._create_child()
+        self.load()
+        self._child.write_range(row_start, values, initing)
+
     def set_data_type(self, data_type):
         if self._child is None:
             self._create_child()
+        self.load()
         self._child.set_data_type(data_type)
 
     def set_measure_type(self, measure_type):
         if self._child is None:
             self._create_child()
+        self.load()
         self._child.set_measure_type(measure_type)
 
     def change(self,
@@ -453,6 +540,7 @@ class Column:
 
         if self._child is None:
             self._create_child()
+        self.load()
 
         self._child.change(
             data_type=data_type,
@@ -510,53 +598,202 @@ class Column:
             if dep.needs_recalc:
                 dep.recalc()
 
+        self.commit(self.evaluate(start, end))
+
+    def evaluate(self, start=None, end=None):
+        # evaluates the formula without modifying the column (or anything
+        # else), so it can be performed off the main thread. the result is
+        # applied with commit()
+
         if start is None:
             start = 0
             end = self.row_count
         elif end is None:
             end = start + 1
 
-        self._child.clear_levels()
-
+        levels = [ ]
         if self._node is not None and self._node.has_levels:
-            for level in self._node.get_levels(self.row_count):
-                self._child.append_level(level[0], level[1])
+            levels = list(self._node.get_levels(self.row_count))
 
-        if self.data_type is DataType.DECIMAL:
-            ul_type = float
-        elif self.data_type is DataType.TEXT:
-            ul_type = str
-        else:
-            ul_type = int
+        ul_type = self._ul_type()
 
         if self._node is None:
             if not self.is_filter:
                 v = convert(NaN, ul_type)
             else:
                 v = 1
-            for row_no in range(start, end):
-                self._child.set_value(row_no, v, True)
+            values = [ v ] * (end - start)
         else:
-            for row_no in range(start, end):
-                try:
-                    if self.is_filter:
-                        v = self._node.fvalue(row_no, self.row_count, False)
-                    elif self.uses_column_formula and self._parent.is_row_filtered(row_no):
-                        v = NaN
-                    else:
-                        v = self._node.fvalue(row_no, self.row_count, self.uses_column_formula)
-                    v = convert(v, ul_type)
-                except Exception as e:
-                    if not self.is_filter:
-                        v = convert(NaN, ul_type)
-                    else:
-                        v = 1
-                    self._parent._log.exception(e)
-                self._child.set_value(row_no, v, True)
+            values = self._evaluate(start, end, ul_type)
+
+        return (start, levels, values)
+
+    def commit(self, evaluation):
+
+        start, levels, values = evaluation
+
+        if start == 0 and len(values) == self.row_count:
+            self._loader = None  # every value is replaced
+        else:
+            self.load()
+
+        self._child.clear_levels()
+        for level in levels:
+            self._child.append_level(level[0], level[1])
+
+        self._write(start, values, True)
+
+        if self._node is not None:
             self.determine_dps()
 
         self._needs_recalc = False
 
+    def recalc_rows(self, ranges):
+        # recalculates only the rows in ranges, a list of (start, end)
+        # tuples, falling back to recalculating everything if the values
+        # of the column depend on rows other than their own
+
+        if not self.needs_recalc:
+            return
+
+        if not self.can_recalc_rows:
+            self.recalc()
+            return
+
+        self.load()
+
+        for dep in self.dependencies:
+            if dep.needs_recalc:
+                dep.recalc_rows(ranges)
+
+        ul_type = self._ul_type()
+        levels = self.levels
+        old_dps = 0
+        new_dps = 0
+
+        for start, end in ranges:
+            end = min(end, self.row_count)
+            if start >= end:
+                continue
+            if ul_type is float:
+                old_dps = max(old_dps, self._range_dps(start, end))
+            self._write(start, self._evaluate(start, end, ul_type), False)
+            if ul_type is float:
+                new_dps = max(new_dps, self._range_dps(start, end))
+
+        if self.levels != levels:
+            # levels were added or trimmed, the full recalc determines these
+            self.recalc()
+            return
+
+        if ul_type is float:
+            if new_dps >= self.dps:
+                self.dps = new_dps
+            elif old_dps >= self.dps:
+                self.determine_dps()
+
+        self._needs_recalc = False
+
+    @property
+    def can_recalc_rows(self):
+        if self._node is None or self.is_filter:
+            return False
+        if self.data_type is DataType.TEXT:
+            return False  # the levels are determined from every row
+        if self.uses_column_formula:
+            return False
+        for column in [ self ] + list(self.dependencies):
+            if column._uses_offset():
+                return False
+        return True
+
+    def _uses_offset(self):
+        if self._node is None:
+            return False
+        for node in ast.walk(self._node):
+            if isinstance(node, ast.Call) and node.func.id == 'OFFSET':
+                return True
+        return False
+
+    def _range_dps(self, start, end):
+        dps = 0
+        for value in self._child.read_range(start, end - start):
+            dps = max(dps, self._child.how_many_dps(value, 3))
+            if dps == 3:
+                break
+        return dps
+
+    def _ul_type(self):
+        if self.data_type is DataType.DECIMAL:
+            return float
+        elif self.data_type is DataType.TEXT:
+            return str
+        else:
+            return int
+
+    def _evaluate(self, start, end, ul_type):
+        if ul_type is str:
+            return self._evaluate_rows(start, end, ul_type)
+        try:
+            return self._evaluate_vectorised(start, end, ul_type)
+        except Exception as e:
+            self._parent._log.exception(e)
+            return self._evaluate_rows(start, end, ul_type)
+
+    def _write(self, start, values, initing):
+        if isinstance(values, np.ndarray):
+            self._child.write_range(start, values, initing)
+        else:
+            for i, v in enumerate(values):
+                self._child.set_value(start + i, v, initing)
+
+    def _evaluate_rows(self, start, end, ul_type):
+        values = [ None ] * (end - start)
+        if self.uses_column_formula and not self.is_filter:
+            filtered = self._parent.filtered_rows(start, end)
+        for row_no in range(start, end):
+            try:
+                if self.is_filter:
+                    v = self._node.fvalue(row_no, self.row_count, False)
+                elif self.uses_column_formula and filtered[row_no - start]:
+                    v = NaN
+                else:
+                    v = self._node.fvalue(row_no, self.row_count, self.uses_column_formula)
+                v = convert(v, ul_type)
+            except Exception as e:
+                if not self.is_filter:
+                    v = convert(NaN, ul_type)
+                else:
+                    v = 1
+                self._parent._log.exception(e)
+            values[row_no - start] = v
+        return values
+
+    def _evaluate_vectorised(self, start, end, ul_type):
+        if self.is_filter:
+            filt = False
+        else:
+            filt = self.uses_column_formula
+
+        values, errors = self._node.vvalues(start, end, self.row_count, filt)
+        values = vconvert(values, ul_type)
+
+        if self.is_filter:
+            values = values.copy()
+            values[errors] = 1
+        else:
+            if filt:
+                errors = errors | self._filtered_rows(start, end)
+            values = vset_missing(values.copy(), errors)
+
+        if ul_type is int:
+            out_of_range = (values < -2147483648) | (values > 2147483647)
+            values = vset_missing(values, out_of_range).astype(np.int32)
+        else:
+            values = values.astype(np.float64)
+
+        return values
+
     def parse_formula(self):
 
         if not self.needs_parse:
@@ -9,6 +9,11 @@ from .typevalues import is_missing
 from .typevalues import is_equal
 from .typevalues import get_missing
 
+from .vectorvalues import vfvalues
+from .vectorvalues import vconvert
+from .vectorvalues import vis_missing
+from .vectorvalues import vset_missing
+
 from .parser import Parser
 from .transmogrifier import Transmogrifier
 from .transfilterifier import Transfilterifier
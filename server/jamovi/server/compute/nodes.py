@@ -9,6 +9,8 @@ from collections import OrderedDict
 from numbers import Number
 from itertools import compress
 
+import numpy as np
+
 from jamovi.core import DataType
 from jamovi.core import MeasureType
 from . import FValues
@@ -17,6 +19,14 @@ from . import is_missing
 from . import get_missing
 from . import is_equal
 from . import functions
+from . import vfunctions
+from .vectorvalues import INT_MIN
+from .vectorvalues import vfvalues
+from .vectorvalues import vget_missing
+from .vectorvalues import vconvert
+from .vectorvalues import vis_missing
+from .vectorvalues import vset_missing
+from .vectorvalues import vis_close
 
 NaN = float('nan')
 
@@ -91,6 +101,83 @@ class SplitValues:
                 return self._cache[convert(value, str)]
 
 
+class VSplitValues:
+    # the vectorised counterpart of SplitValues; the argument is
+    # evaluated for every row at once, and split by group_by with a
+    # single sort
+
+    def __init__(self, split_by, func, arg, arg_type):
+        self._split_by = split_by
+        self._func = func
+        self._arg = arg
+        self._arg_type = arg_type
+        self._values = None
+        self._error = None
+
+    def _calculate(self, row_count, filt):
+
+        values, errors = self._arg.vvalues(0, row_count, row_count, filt)
+        values = vconvert(values, self._arg_type).copy()
+        vset_missing(values, errors)
+
+        if self._split_by is None:
+            try:
+                value = self._func(values)
+                self._values = np.full(row_count, value)
+            except Exception as e:
+                self._error = e
+                self._values = vget_missing(row_count, float)
+        else:
+            keys, missing = self._keys(row_count, filt)
+            present = np.flatnonzero(~missing)
+            order = present[np.argsort(keys[present], kind='stable')]
+            sorted_keys = keys[order]
+            starts = np.flatnonzero(sorted_keys[1:] != sorted_keys[:-1]) + 1
+
+            groups = [ ]
+            results = [ ]
+            for group in np.split(order, starts):
+                if len(group) == 0:
+                    continue
+                try:
+                    results.append(self._func(values[group]))
+                    groups.append(group)
+                except Exception:
+                    pass
+
+            if all(map(lambda result: isinstance(result, int), results)):
+                self._values = vget_missing(row_count, int)
+            else:
+                self._values = vget_missing(row_count, float)
+
+            for group, result in zip(groups, results):
+                self._values[group] = result
+
+    def _keys(self, row_count, filt):
+        if self._split_by.data_type is DataType.TEXT:
+            keys = map(
+                lambda v: '' if is_missing(v) else convert(v, str),
+                self._split_by.fvalues(row_count, filt))
+            keys = np.array(list(keys), dtype=str)
+            return keys, keys == ''
+        else:
+            keys, errors = self._split_by.vvalues(0, row_count, row_count, filt)
+            return keys, vis_missing(keys) | errors
+
+    def fvalue(self, index, row_count, filt):
+        if self._values is None:
+            self._calculate(row_count, filt)
+        if self._error is not None:
+            raise self._error
+        return self._values[index].item()
+
+    def vvalues(self, start, end, row_count, filt):
+        if self._values is None:
+            self._calculate(row_count, filt)
+        errors = np.full(end - start, self._error is not None)
+        return self._values[start:end], errors
+
+
 class Node:
     def __init__(self):
         self._node_parents = [ ]
@@ -111,6 +198,16 @@ class Node:
     def fvalues(self, row_count, filt):
         return FValues(self, row_count, filt)
 
+    def vvalues(self, start, end, row_count, filt):
+        # evaluates the rows start to end at once, returning a tuple of
+        # (values, errors). nodes without a vectorised implementation
+        # fall back to evaluating each row with fvalue()
+        return vfvalues(self, start, end, row_count, filt)
+
+    @property
+    def yields_tuples(self):
+        return False
+
     @property
     def has_levels(self):
         return False
@@ -149,6 +246,11 @@ class Num(ast.Num, Node):
     def fvalue(self, index, row_count, filt):
         return self.n
 
+    def vvalues(self, start, end, row_count, filt):
+        dtype = np.float64 if isinstance(self.n, float) else np.int64
+        return (np.full(end - start, self.n, dtype=dtype),
+                np.zeros(end - start, dtype=bool))
+
     def is_atomic_node(self):
         return True
 
@@ -244,6 +346,26 @@ class UnaryOp(ast.UnaryOp, Node):
         else:
             raise RuntimeError("Shouldn't get here")
 
+    def vvalues(self, start, end, row_count, filt):
+        if self.operand.data_type is DataType.TEXT:
+            return Node.vvalues(self, start, end, row_count, filt)
+
+        op = self.op
+        v, errors = self.operand.vvalues(start, end, row_count, filt)
+        missing = vis_missing(v)
+        if isinstance(op, ast.USub):
+            v = vset_missing(-v, missing)
+        elif isinstance(op, ast.Not):
+            v = vset_missing((v == 0).astype(np.int64), missing)
+        elif isinstance(op, ast.Invert):
+            v = v.copy()
+            v[missing] = 0
+        return v, errors
+
+    @property
+    def yields_tuples(self):
+        return isinstance(self.op, ast.Invert) and self.operand.yields_tuples
+
     def is_atomic_node(self):
         return self.operand.is_atomic_node()
 
@@ -317,6 +439,33 @@ class BoolOp(ast.BoolOp, Node):
         else:
             raise RuntimeError("Shouldn't get here")
 
+    def vvalues(self, start, end, row_count, filt):
+        for v in self.values:
+            if v.data_type is DataType.TEXT:
+                return Node.vvalues(self, start, end, row_count, filt)
+
+        # rows are 'decided' once a value short-circuits the expression
+        is_and = isinstance(self.op, ast.And)
+        count = end - start
+        decided = np.zeros(count, dtype=bool)
+        missing = np.zeros(count, dtype=bool)
+        errors = np.zeros(count, dtype=bool)
+
+        for v in self.values:
+            value, errs = v.vvalues(start, end, row_count, filt)
+            errors |= errs & ~decided
+            undecided = ~decided & ~errors
+            value_missing = vis_missing(value)
+            missing |= value_missing & undecided
+            if is_and:
+                decided |= undecided & ~value_missing & (value == 0)
+            else:
+                decided |= undecided & ~value_missing & (value != 0)
+
+        values = np.where(decided, 0 if is_and else 1, 1 if is_and else 0)
+        values[missing & ~decided] = INT_MIN
+        return values.astype(np.int64), errors
+
     def is_atomic_node(self):
         for value in self.values:
             if not value.is_atomic_node():
@@ -413,6 +562,8 @@ class Call(ast.Call, Node):
             else:
                 value = self.args[0].fvalue(index - offset, row_count, False)
         elif self._function.meta.is_column_wise:
+            if self._cached_value is None:
+                self._cached_value = self._vsplit_values()
             if self._cached_value is None:
                 group_by = None
                 args = list(self.args)
@@ -458,6 +609,86 @@ class Call(ast.Call, Node):
 
         return value
 
+    def _vsplit_values(self):
+        # the vectorised column-wise functions take a single argument,
+        # and optionally group_by
+
+        vfunction = getattr(vfunctions, self._function.__name__, None)
+        if vfunction is None:
+            return None
+
+        args = list(self.args)
+        group_by = None
+        if len(args) == 2:
+            group_by = args.pop(1)
+        for kwarg in self.keywords:
+            if kwarg.arg == 'group_by':
+                group_by = kwarg.value
+            else:
+                return None
+
+        if len(args) != 1 or args[0].data_type is DataType.TEXT:
+            return None
+
+        return VSplitValues(group_by, vfunction, args[0], self._arg_types[0])
+
+    def vvalues(self, start, end, row_count, filt):
+
+        if self._function.meta.is_column_wise:
+            if self._cached_value is None:
+                self._cached_value = self._vsplit_values()
+            if isinstance(self._cached_value, VSplitValues):
+                return self._cached_value.vvalues(start, end, row_count, filt)
+            return Node.vvalues(self, start, end, row_count, filt)
+
+        vfunction = getattr(vfunctions, self._function.__name__, None)
+
+        if vfunction is None:
+            return Node.vvalues(self, start, end, row_count, filt)
+
+        arg_types = [ ]
+        for i, arg in enumerate(self.args):
+            arg_type_i = min(i, len(self._arg_types) - 1)
+            arg_types.append(self._arg_types[arg_type_i])
+        nodes = list(self.args) + list(map(lambda kw: kw.value, self.keywords))
+        types = arg_types + self._kw_types[:len(self.keywords)]
+
+        for node, arg_type in zip(nodes, types):
+            if node.data_type is DataType.TEXT or arg_type is str:
+                return Node.vvalues(self, start, end, row_count, filt)
+            if arg_type is None and node.yields_tuples:
+                # the function receives the (value, label) tuple
+                return Node.vvalues(self, start, end, row_count, filt)
+
+        errors = np.zeros(end - start, dtype=bool)
+
+        args = [ ]
+        for arg, arg_type in zip(self.args, arg_types):
+            values, errs = arg.vvalues(start, end, row_count, filt)
+            args.append(vconvert(values, arg_type))
+            errors |= errs
+
+        kwargs = { }
+        for i, kwarg in enumerate(self.keywords):
+            values, errs = kwarg.vvalues(start, end, row_count, filt)
+            kwargs[kwarg.arg] = vconvert(values, self._kw_types[i])
+            errors |= errs
+
+        with np.errstate(all='ignore'):
+            values, errs = vfunction(np.arange(start, end), *args, **kwargs)
+
+        return values, errors | errs
+
+    @property
+    def yields_tuples(self):
+        if self._function.meta.is_column_wise:
+            return False
+        for i, arg in enumerate(self.args):
+            arg_type_i = min(i, len(self._arg_types) - 1)
+            if self._arg_types[arg_type_i] is None and arg.yields_tuples:
+                return True
+        return False
+
     def is_atomic_node(self):
         return False
 
@@ -670,6 +901,52 @@ class BinOp(ast.BinOp, Node):
         else:
             return get_missing()
 
+    def vvalues(self, start, end, row_count, filt):
+
+        op = self.op
+
+        if self.data_type is DataType.TEXT:
+            return Node.vvalues(self, start, end, row_count, filt)
+        elif self.data_type is DataType.DECIMAL:
+            ul_type = float
+        else:
+            ul_type = int
+
+        lv, lerrs = self.left.vvalues(start, end, row_count, filt)
+        rv, rerrs = self.right.vvalues(start, end, row_count, filt)
+        lv = vconvert(lv, ul_type)
+        rv = vconvert(rv, ul_type)
+        errors = lerrs | rerrs
+        missing = vis_missing(lv) | vis_missing(rv)
+
+        with np.errstate(all='ignore'):
+            if isinstance(op, ast.Add):
+                values = lv + rv
+            elif isinstance(op, ast.Sub):
+                values = lv - rv
+            elif isinstance(op, ast.Mult):
+                values = lv * rv
+            elif isinstance(op, ast.Div):
+                values = vconvert(lv, float) / vconvert(rv, float)
+                missing |= (rv == 0)
+            elif isinstance(op, ast.Mod):
+                errors |= (rv == 0) & ~missing
+                rv = np.where(rv == 0, 1, rv)
+                values = np.mod(lv, rv)
+            elif isinstance(op, ast.Pow) or isinstance(op, ast.BitXor):
+                lv = vconvert(lv, float)
+                rv = vconvert(rv, float)
+                values = np.power(lv, rv)
+                # python raises on overflow, and on zero to a negative power
+                errors |= (np.isinf(values)
+                           & np.isfinite(lv)
+                           & np.isfinite(rv)
+                           & ~missing)
+            else:
+                return Node.vvalues(self, start, end, row_count, filt)
+
+        return vset_missing(values, missing), errors
+
     def is_atomic_node(self):
         return self.left.is_atomic_node() and self.right.is_atomic_node()
 
@@ -744,6 +1021,56 @@ class Compare(ast.Compare, Node):
             v1 = v2
         return 1
 
+    def vvalues(self, start, end, row_count, filt):
+        for node in [ self.left ] + list(self.comparators):
+            if node.data_type is DataType.TEXT:
+                return Node.vvalues(self, start, end, row_count, filt)
+
+        v1, errors = self.left.vvalues(start, end, row_count, filt)
+        missing = vis_missing(v1)
+        decided = errors | missing
+        values = np.ones(end - start, dtype=np.int64)
+
+        for op, comparator in zip(self.ops, self.comparators):
+            v2, errs = comparator.vvalues(start, end, row_count, filt)
+            errs = errs & ~decided
+            errors = errors | errs
+            decided |= errs
+
+            v2_missing = vis_missing(v2) & ~decided
+            missing |= v2_missing
+            decided |= v2_missing
+
+            with np.errstate(invalid='ignore'):
+                result = Compare._vtest(v1, op, v2)
+            failed = ~result & ~decided
+            values[failed] = 0
+            decided |= failed
+            v1 = v2
+
+        values[missing] = INT_MIN
+        return values, errors
+
+    @staticmethod
+    def _vtest(v1, op, v2):
+
+        is_float = v1.dtype.kind == 'f' or v2.dtype.kind == 'f'
+
+        if isinstance(op, ast.Lt):
+            return v1 < v2
+        elif isinstance(op, ast.Gt):
+            return v1 > v2
+        elif isinstance(op, ast.GtE):
+            return v1 >= v2
+        elif isinstance(op, ast.LtE):
+            return v1 <= v2
+        elif isinstance(op, ast.Eq):
+            return vis_close(v1, v2) if is_float else v1 == v2
+        elif isinstance(op, ast.NotEq):
+            return ~vis_close(v1, v2)
+        else:
+            raise RuntimeError("Shouldn't get here")
+
     @staticmethod
     def _test(v1, op, v2):
 
@@ -829,6 +1156,13 @@ class keyword(ast.keyword, Node):
     def fvalue(self, index, row_count, filt):
         return self.value.fvalue(index, row_count, filt)
 
+    def vvalues(self, start, end, row_count, filt):
+        return self.value.vvalues(start, end, row_count, filt)
+
+    @property
+    def yields_tuples(self):
+        return self.value.yields_tuples
+
     def is_atomic_node(self):
         return self.value.is_atomic_node()
 
@@ -863,6 +1197,14 @@ class Tuple(ast.Tuple, Node):
     def fvalue(self, index, row_count, filt):
         return (self.elts[0].n, self.elts[1].s)
 
+    def vvalues(self, start, end, row_count, filt):
+        return (np.full(end - start, self.elts[0].n, dtype=np.int64),
+                np.zeros(end - start, dtype=bool))
+
+    @property
+    def yields_tuples(self):
+        return True
+
     @property
     def data_type(self):
         return DataType.INTEGER
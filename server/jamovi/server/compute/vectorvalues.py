@@ -0,0 +1,107 @@
+
+import numpy as np
+
+
+INT_MIN = -2147483648
+INT_MAX = 2147483647
+
+
+def vfvalues(node, start, end, row_count, filt):
+    # the per-row fallback, for nodes without a vector implementation
+    count = end - start
+    values = [ INT_MIN ] * count
+    errors = np.zeros(count, dtype=bool)
+    is_float = False
+
+    for i in range(count):
+        try:
+            v = node.fvalue(start + i, row_count, filt)
+        except Exception:
+            errors[i] = True
+            continue
+        if isinstance(v, tuple):
+            v = v[0]
+        elif isinstance(v, float):
+            is_float = True
+        elif not isinstance(v, int):
+            v = INT_MIN
+        values[i] = v
+
+    if is_float:
+        values = map(lambda v: float('nan') if v == INT_MIN else v, values)
+        values = np.fromiter(values, dtype=np.float64, count=count)
+    else:
+        try:
+            values = np.array(values, dtype=np.int64)
+        except OverflowError:
+            values = np.array(values, dtype=np.float64)
+
+    return values, errors
+
+
+def vget_missing(count, hint=None):
+    if hint is float:
+        return np.full(count, np.nan)
+    else:
+        return np.full(count, INT_MIN, dtype=np.int64)
+
+
+def vis_missing(values):
+    if values.dtype.kind == 'f':
+        return np.isnan(values)
+    else:
+        return values == INT_MIN
+
+
+def vset_missing(values, mask):
+    if values.dtype.kind == 'f':
+        values[mask] = np.nan
+    else:
+        values[mask] = INT_MIN
+    return values
+
+
+def vexpand(value, count):
+    if isinstance(value, np.ndarray):
+        return value
+    elif isinstance(value, float):
+        return np.full(count, value)
+    else:
+        return np.full(count, value, dtype=np.int64)
+
+
+def vcommon(*arrays):
+    # brings arrays to a common type, so they can be combined
+    for values in arrays:
+        if values.dtype.kind == 'f':
+            return tuple(map(lambda values: vconvert(values, float), arrays))
+    return arrays
+
+
+def vis_close(a, b):
+    # matches math.isclose() with its default tolerances
+    a = vconvert(a, float)
+    b = vconvert(b, float)
+    with np.errstate(invalid='ignore'):
+        close = np.abs(a - b) <= 1e-09 * np.maximum(np.abs(a), np.abs(b))
+    return (a == b) | (close & np.isfinite(a) & np.isfinite(b))
+
+
+def vconvert(values, to_type):
+    if to_type is float:
+        if values.dtype.kind == 'f':
+            return values
+        converted = values.astype(np.float64)
+        converted[values == INT_MIN] = np.nan
+        return converted
+    elif to_type is int:
+        if values.dtype.kind != 'f':
+            return values
+        # magnitudes beyond int64 are clamped, retaining their sign
+        limit = float(2 ** 62)
+        finite = np.isfinite(values)
+        converted = np.full(len(values), INT_MIN, dtype=np.int64)
+        converted[finite] = np.clip(values[finite], -limit, limit).astype(np.int64)
+        return converted
+    else:
+        return values
@@ -0,0 +1,269 @@
+
+# vectorised counterparts of the functions in functions.py
+#
+# the row-wise functions take the row indices and their arguments as
+# numpy arrays (converted to the argument types of the original
+# function), and return a tuple of (values, errors), where errors flags
+# the rows on which the original function would have raised.
+#
+# the column-wise functions take the values of a column (or of a group
+# within a column) as a numpy array, and return a single value, raising
+# where the original function would have.
+
+import math
+
+import numpy as np
+from scipy.stats import boxcox
+
+from .vectorvalues import INT_MIN
+from .vectorvalues import vis_missing
+from .vectorvalues import vset_missing
+from .vectorvalues import vexpand
+from .vectorvalues import vcommon
+from .vectorvalues import vconvert
+
+
+def _stack(index, arg0, args):
+    values = [ vexpand(arg0, len(index)) ]
+    values.extend(map(lambda arg: vexpand(arg, len(index)), args))
+    return np.vstack(values)
+
+
+def _no_errors(index):
+    return np.zeros(len(index), dtype=bool)
+
+
+def MAX(index, arg0, *args):
+    values = _stack(index, arg0, args)
+    errors = np.all(np.isnan(values), axis=0)
+    return np.fmax.reduce(values, axis=0), errors
+
+
+def MIN(index, arg0, *args):
+    values = _stack(index, arg0, args)
+    errors = np.all(np.isnan(values), axis=0)
+    return np.fmin.reduce(values, axis=0), errors
+
+
+def _moments(values, ignore_missing):
+    # values are scaled by the largest magnitude in each row, so the
+    # squared deviations don't overflow where statistics (which uses
+    # exact fractions) wouldn't
+    ignore = np.broadcast_to(np.asarray(ignore_missing) != 0, values.shape[1])
+    valid = ~np.isnan(values)
+    n = np.where(ignore, valid.sum(axis=0), values.shape[0])
+    with np.errstate(all='ignore'):
+        scale = np.fmax.reduce(np.abs(values), axis=0)
+        scale = np.where(np.isfinite(scale) & (scale > 0), scale, 1.0)
+        scaled = values / scale
+        total = np.where(ignore, np.nansum(scaled, axis=0), scaled.sum(axis=0))
+        mean = total / n
+        dev = np.where(valid, scaled - mean, 0.0) ** 2
+        ss = np.where(ignore | valid.all(axis=0), dev.sum(axis=0), np.nan)
+    return n, mean * scale, ss, scale, ignore, valid
+
+
+def _overflowed(values, result):
+    return np.isinf(result) & ~np.any(np.isinf(values), axis=0)
+
+
+def MEAN(index, arg0, *args, ignore_missing=0):
+    values = _stack(index, arg0, args)
+    n, mean, ss, scale, ignore, valid = _moments(values, ignore_missing)
+    return mean, n == 0
+
+
+def STDEV(index, arg0, *args, ignore_missing=0):
+    values = _stack(index, arg0, args)
+    n, mean, ss, scale, ignore, valid = _moments(values, ignore_missing)
+    with np.errstate(all='ignore'):
+        result = np.sqrt(ss / (n - 1)) * scale
+    # statistics.stdev() fails, rather than returning NaN, with missings
+    errors = (n < 2) | (~ignore & ~valid.all(axis=0))
+    return result, errors
+
+
+def VAR(index, arg0, *args, ignore_missing=0):
+    values = _stack(index, arg0, args)
+    n, mean, ss, scale, ignore, valid = _moments(values, ignore_missing)
+    with np.errstate(all='ignore'):
+        result = ss / (n - 1) * scale * scale
+    return result, (n < 2) | _overflowed(values, result)
+
+
+def SUM(index, arg0, *args, ignore_missing=0):
+    values = _stack(index, arg0, args)
+    ignore = np.broadcast_to(np.asarray(ignore_missing) != 0, values.shape[1])
+    with np.errstate(all='ignore'):
+        result = np.where(ignore, np.nansum(values, axis=0), values.sum(axis=0))
+    return result, _overflowed(values, result)
+
+
+def ABS(index, value):
+    value = vexpand(value, len(index))
+    missing = vis_missing(value)
+    result = np.abs(value)
+    result[missing] = value[missing]
+    return result, _no_errors(index)
+
+
+def _unary(index, value, func, domain=None):
+    value = vexpand(value, len(index))
+    with np.errstate(all='ignore'):
+        result = func(value)
+        # math raises on overflow, and outside the domain of the function
+        errors = np.isfinite(value) & ~np.isfinite(result)
+        if domain is not None:
+            errors |= ~domain(value)
+    return result, errors & ~np.isnan(value)
+
+
+def EXP(index, value):
+    return _unary(index, value, np.exp)
+
+
+def LN(index, value):
+    return _unary(index, value, np.log, lambda x: x > 0)
+
+
+def LOG10(index, value):
+    return _unary(index, value, np.log10, lambda x: x > 0)
+
+
+def SQRT(index, value):
+    return _unary(index, value, np.sqrt, lambda x: x >= 0)
+
+
+def ROW(index):
+    return index + 1, _no_errors(index)
+
+
+def IF(index, cond, x=1, y=INT_MIN):
+    x, y = vcommon(vexpand(x, len(index)), vexpand(y, len(index)))
+    result = np.where(cond != 0, x, y)
+    return vset_missing(result, vis_missing(cond)), _no_errors(index)
+
+
+def IFMISS(index, cond, x=1, y=INT_MIN):
+    x, y = vcommon(vexpand(x, len(index)), vexpand(y, len(index)))
+    return np.where(vis_missing(cond), x, y), _no_errors(index)
+
+
+def NOT(index, x):
+    result = (x == 0).astype(np.int64)
+    return vset_missing(result, vis_missing(x)), _no_errors(index)
+
+
+def FILTER(index, x, *conds):
+    exclude = np.zeros(len(index), dtype=bool)
+    for cond in conds:
+        exclude |= vis_missing(cond) | (cond == 0)
+    result = vexpand(x, len(index)).copy()
+    return vset_missing(result, exclude), _no_errors(index)
+
+
+def INT(index, x):
+    if x.dtype.kind == 'f':
+        return vconvert(x, int), ~np.isfinite(x)
+    return x, _no_errors(index)
+
+
+def _present(values):
+    return values[~np.isnan(values)]
+
+
+def _require(values, n):
+    if len(values) < n:
+        raise ValueError('Insufficient values')
+    return values
+
+
+def _scaled(values):
+    # where the sums overflow, values are scaled by their largest
+    # magnitude; statistics (which uses exact fractions) doesn't overflow
+    scale = np.max(np.abs(values))
+    if not np.isfinite(scale) or scale == 0:
+        scale = 1.0
+    return values / scale, scale
+
+
+def _variance(values, ddof):
+    with np.errstate(over='ignore'):
+        var = np.var(values, ddof=ddof)
+    if np.isfinite(var):
+        return var, 1.0
+    scaled, scale = _scaled(values)
+    return np.var(scaled, ddof=ddof), scale
+
+
+def VMEAN(values):
+    values = _require(_present(values), 1)
+    with np.errstate(over='ignore'):
+        mean = np.mean(values)
+    if np.isfinite(mean):
+        return float(mean)
+    scaled, scale = _scaled(values)
+    return float(np.mean(scaled) * scale)
+
+
+def VSTDEV(values):
+    values = _require(_present(values), 2)
+    var, scale = _variance(values, 1)
+    return float(np.sqrt(var) * scale)
+
+
+def VSE(values):
+    values = _require(_present(values), 1)
+    var, scale = _variance(values, 0)
+    return float(np.sqrt(var) * scale)
+
+
+def VVAR(values):
+    values = _require(_present(values), 2)
+    var, scale = _variance(values, 1)
+    with np.errstate(over='ignore'):
+        var = var * scale * scale
+    if np.isinf(var):
+        raise OverflowError('Variance is too large')
+    return float(var)
+
+
+def VMED(values):
+    values = _require(_present(values), 1)
+    return float(np.median(values))
+
+
+def VMODE(values):
+    values = _require(_present(values), 1)
+    uniq, first, counts = np.unique(
+        values, return_index=True, return_counts=True)
+    # where there are several modes, the first encountered is used
+    modes = np.flatnonzero(counts == counts.max())
+    return float(uniq[modes[np.argmin(first[modes])]])
+
+
+def VN(values):
+    return int(np.count_nonzero(~vis_missing(values)))
+
+
+def VSUM(values):
+    return math.fsum(_present(values))
+
+
+def VROWS(values):
+    return len(values)
+
+
+def VMIN(values):
+    values = _require(_present(values), 1)
+    return float(np.min(values))
+
+
+def VMAX(values):
+    values = _require(_present(values), 1)
+    return float(np.max(values))
+
+
+def VBOXCOXLAMBDA(values):
+    values = _present(values)
+    return float(boxcox(values)[1])
@@ -6,9 +6,12 @@ import platform
 
 import threading
 import tempfile
+import time
+import heapq
 import subprocess
 from enum import Enum
 from uuid import uuid4
+from weakref import WeakKeyDictionary
 
 import nanomsg
 
@@ -30,6 +33,7 @@ class Engine:
         INITING = 1
         RUNNING = 2
         OPPING = 3  # performing operation
+        CANCELLING = 4  # waiting for the analysis to abort
 
     def __init__(self, parent, data_path, conn_path):
         self._parent = parent
@@ -38,21 +42,30 @@ class Engine:
 
         self.analysis = None
         self.status = Engine.Status.WAITING
+        self.revision = None  # of the analysis running
+        self.cache_key = None  # of the analysis running, for its results
 
         self._process = None
         self._socket = None
         self._thread = None
         self._message_id = 0
         self._restarting = False
+        self._retiring = False
         self._stopping = False
         self._stopped = False
 
+        self.idle_since = time.monotonic()
+
         self._ioloop = asyncio.get_event_loop()
 
     @property
     def is_waiting(self):
         return self.status is Engine.Status.WAITING
 
+    @property
+    def is_running(self):
+        return self._socket is not None and not self._stopping and not self._stopped
+
     def start(self):
 
         exe_dir = path.join(conf.get('home'), 'bin')
@@ -127,6 +140,10 @@ class Engine:
         self._restarting = True
         self.stop()
 
+    def retire(self):
+        self._retiring = True
+        self.stop()
+
     def _run(self):
         parent = threading.main_thread()
 
@@ -157,6 +174,9 @@ class Engine:
             log.info('Restarting engine')
             self._stopping = False
             self.start()
+        elif self._retiring:
+            self._stopped = True
+            log.info('Engine retired')
         else:
             self._stopped = True
             log.error('Engine process terminated with exit code {}\n'.format(self._process.returncode))
@@ -171,9 +191,21 @@ class Engine:
             self._process.terminate()
 
     def send(self, analysis, run=True):
+        # returns False, leaving everything unchanged, where the engine
+        # isn't connected yet (it's starting, or restarting), or where
+        # the data set is busy
+
+        # the engines read the data set directly, so the columns are
+        # loaded first. loading allocates in the memory map, which
+        # can't happen while the instance holds the data set (i.e. it's
+        # being read from other threads)
+        dataset = analysis.dataset
+        if dataset.needs_load:
+            if analysis.instance.is_dataset_locked:
+                return False
+            dataset.load_columns()
 
         self._message_id += 1
-        self.analysis = analysis
 
         request = jcoms.AnalysisRequest()
 
@@ -185,17 +217,14 @@ class Engine:
 
         if analysis.status is Analysis.Status.COMPLETE and analysis.needs_op:
 
-            analysis.op.waiting = False
             request.options.CopyFrom(analysis.options.as_pb())
             request.perform = jcoms.AnalysisRequest.Perform.Value('SAVE')
             request.path = analysis.op.path
             request.part = analysis.op.part
-            self.status = Engine.Status.OPPING
+            status = Engine.Status.OPPING
 
         else:
 
-            analysis.status = Analysis.Status.RUNNING
-
             request.options.CopyFrom(analysis.options.as_pb())
             request.changed.extend(analysis.changes)
             request.revision = analysis.revision
@@ -203,35 +232,89 @@ class Engine:
 
             if run:
                 request.perform = jcoms.AnalysisRequest.Perform.Value('RUN')
-                self.status = Engine.Status.RUNNING
+                status = Engine.Status.RUNNING
             else:
                 request.perform = jcoms.AnalysisRequest.Perform.Value('INIT')
-                self.status = Engine.Status.INITING
+                status = Engine.Status.INITING
 
         message = jcoms.ComsMessage()
         message.id = self._message_id
         message.payload = request.SerializeToString()
         message.payloadType = 'AnalysisRequest'
 
-        self._socket.send(message.SerializeToString())
+        try:
+            self._socket.send(message.SerializeToString(), nanomsg.DONTWAIT)
+        except nanomsg.NanoMsgAPIError as e:
+            if e.errno != nanomsg.EAGAIN:
+                raise e
+            return False
+
+        if status is Engine.Status.OPPING:
+            analysis.op.waiting = False
+        else:
+            analysis.status = Analysis.Status.RUNNING
+            self.revision = analysis.revision
+
+        self.analysis = analysis
+        self.status = status
+        return True
+
+    def cancel(self):
+        # the engine aborts the analysis at its next checkpoint, and then
+        # acknowledges the cancel. until then, the engine may still be
+        # reading the data set, so it isn't waiting. where the engine is
+        # stopped (or restarting), there's nothing to cancel
+        if not self.is_running:
+            return
+
+        self._message_id += 1
+
+        request = jcoms.AnalysisRequest()
+        request.perform = jcoms.AnalysisRequest.Perform.Value('CANCEL')
+
+        message = jcoms.ComsMessage()
+        message.id = self._message_id
+        message.payload = request.SerializeToString()
+        message.payloadType = 'AnalysisRequest'
+
+        try:
+            self._socket.send(message.SerializeToString(), nanomsg.DONTWAIT)
+        except nanomsg.NanoMsgAPIError as e:
+            if e.errno != nanomsg.EAGAIN:
+                raise e
+
+        self.status = Engine.Status.CANCELLING
+
+    def _set_waiting(self):
+        analysis = self.analysis
+        self.status = Engine.Status.WAITING
+        self.analysis = None
+        self.idle_since = time.monotonic()
+        self._parent._on_engine_waiting(analysis)
 
     def _receive(self, message):
 
         if self.status is Engine.Status.WAITING:
             log.info('id : {}, response received when not running'.format(message.id))
+        elif self.status is Engine.Status.CANCELLING:
+            # the results of the analysis aborting are discarded. once it
+            # has stopped (the cancel is acknowledged, or the analysis
+            # completed before it could abort), the engine is waiting
+            if message.status != jcoms.Status.Value('IN_PROGRESS'):
+                self._set_waiting()
         elif self.status is Engine.Status.OPPING:
-            self.status = Engine.Status.WAITING
             if message.status == jcoms.Status.Value('ERROR'):
                 self.analysis.op.set_exception(RuntimeError(message.error.cause))
             else:
                 self.analysis.op.set_result(message)
-            self.analysis = None
-            self._parent._send_next()
+            self._set_waiting()
         else:
             results = jcoms.AnalysisResponse()
             results.ParseFromString(message.payload)
 
-            if results.revision == self.analysis.revision:
+            if (results.analysisId == self.analysis.id
+                    and results.instanceId == self.analysis.instance.id
+                    and results.revision == self.analysis.revision):
                 complete = False
                 if results.incAsText and results.status == jcoms.AnalysisStatus.Value('ANALYSIS_COMPLETE'):
                     complete = True
@@ -243,13 +326,24 @@ class Engine:
                 self.analysis.set_results(results)
 
                 if complete:
-                    self.status = Engine.Status.WAITING
-                    self.analysis = None
-                    self._parent._send_next()
+                    if (self.status is Engine.Status.RUNNING
+                            and self.cache_key is not None
+                            and results.status == jcoms.AnalysisStatus.Value('ANALYSIS_COMPLETE')):
+                        self.analysis.instance.results_cache.put(self.cache_key, results)
+                    self._set_waiting()
 
 
 class EngineManager:
 
+    # the number of engines grows, between min_engines and max_engines
+    # (from the config), while there's work waiting and the cpus aren't
+    # already busy. engines in excess of min_engines are retired once
+    # they've been idle for ENGINE_IDLE_TIMEOUT seconds
+
+    ENGINE_IDLE_TIMEOUT = 60
+    RETRY_INTERVAL = 0.2
+    COALESCE_WINDOW = 0.25
+
     def __init__(self, data_path, analyses):
 
         self._data_path = data_path
@@ -264,17 +358,46 @@ class EngineManager:
 
         self._engine_listeners  = [ ]
 
+        self._cpu_count = os.cpu_count() or 1
+        self._min_engines = max(int(conf.get('min_engines', 3)), 1)
+        self._max_engines = int(conf.get('max_engines', max(self._cpu_count, self._min_engines)))
+        self._max_engines = max(self._max_engines, self._min_engines)
+
         self._engines = [ ]
-        for index in range(3):
-            conn_path = '{}-{}'.format(self._conn_root, index)
-            engine = Engine(
-                parent=self,
-                data_path=data_path,
-                conn_path=conn_path)
-            self._engines.append(engine)
+        self._engine_count = 0
+        for index in range(self._min_engines):
+            self._create_engine()
+
+        # the analyses waiting for an engine, as a heap of
+        # (priority, seq, analysis). where an analysis is queued more
+        # than once, only the entry recorded in _queued is current
+        self._queue = [ ]
+        self._queued = { }
+        self._seq = 0
+
+        # the time of the last change to each analysis, and the timers
+        # of those whose changes are being coalesced
+        self._changed = WeakKeyDictionary()
+        self._coalescing = { }
+
+        # the results cache keys of the queued analyses
+        self._cache_keys = WeakKeyDictionary()
+
+        self._retry_handle = None
+        self._retire_handle = None
 
         self._restart_task = Queue()
 
+    def _create_engine(self):
+        conn_path = '{}-{}'.format(self._conn_root, self._engine_count)
+        engine = Engine(
+            parent=self,
+            data_path=self._data_path,
+            conn_path=conn_path)
+        self._engines.append(engine)
+        self._engine_count += 1
+        return engine
+
     def start(self):
         for index in range(len(self._engines)):
             self._engines[index].start()
@@ -302,18 +425,208 @@ class EngineManager:
     def _send_next(self, analysis=None):
         if analysis is not None:
             for engine in self._engines:
-                if analysis is engine.analysis:
-                    engine.send(analysis)
+                if analysis is engine.analysis and self._is_superseded(engine):
+                    engine.cancel()
+            if analysis.status is Analysis.Status.NONE:
+                self._coalesce(analysis)
+            else:
+                # an op (i.e. saving an image) isn't a change. where the
+                # analysis is running, the op is queued when it finishes
+                self._enqueue(analysis)
+        self._dispatch()
+
+    def _is_superseded(self, engine):
+        # whether the engine's run is of an earlier revision of the
+        # analysis (or the analysis is deleted). ops aren't superseded
+        if engine.status is not Engine.Status.RUNNING and engine.status is not Engine.Status.INITING:
+            return False
+        analysis = engine.analysis
+        return (analysis.status is Analysis.Status.NONE
+                or analysis.status is Analysis.Status.DELETED
+                or engine.revision < analysis.revision)
+
+    def _coalesce(self, analysis):
+        # the first change to an analysis is queued straight away, but
+        # where changes follow within COALESCE_WINDOW of one another
+        # (i.e. dragging a slider), they're coalesced into a single run,
+        # queued once the changes stop
+        ioloop = asyncio.get_event_loop()
+        now = ioloop.time()
+        last = self._changed.get(analysis)
+        self._changed[analysis] = now
+
+        handle = self._coalescing.pop(analysis, None)
+        if handle is not None:
+            handle.cancel()
+        elif last is None or now - last >= EngineManager.COALESCE_WINDOW:
+            self._enqueue(analysis)
+            return
+
+        self._coalescing[analysis] = ioloop.call_later(
+            EngineManager.COALESCE_WINDOW, self._coalesced, analysis)
+
+    def _coalesced(self, analysis):
+        del self._coalescing[analysis]
+        self._enqueue(analysis)
+        self._dispatch()
+
+    def _on_engine_waiting(self, analysis):
+        # the analysis may have more to do; i.e. running after initing
+        self._enqueue(analysis)
+        self._dispatch()
+        if analysis is not None and not self.is_busy(analysis.instance):
+            self._notify_engine_event({
+                'type': 'idle',
+                'instance': analysis.instance,
+            })
+
+    def is_busy(self, instance):
+        # whether an engine is running (or initing, cancelling, etc.) an
+        # analysis of the instance, and so may be reading its data set
+        for engine in self._engines:
+            if not engine.is_waiting and engine.analysis is not None and engine.analysis.instance is instance:
+                return True
+        return False
+
+    def _enqueue(self, analysis):
+        if analysis is None or self._work_for(analysis) is None:
+            return
+        key = self._cache_key(analysis)
+        if self._replay(analysis, key):
+            return
+        self._cache_keys[analysis] = key
+        self._seq += 1
+        self._queued[analysis] = self._seq
+        heapq.heappush(self._queue, (self._priority(analysis), self._seq, analysis))
+
+    def _priority(self, analysis):
+        # analyses of instances with a client attached come first, and
+        # initing (which is quick, and lays out the results) before
+        # saving, before running
+        visible = analysis.instance.is_active
+        run = self._work_for(analysis)
+        if run is False:
+            kind = 0
+        elif analysis.status is Analysis.Status.COMPLETE:
+            kind = 1
+        else:
+            kind = 2
+        return (0 if visible else 1, kind)
+
+    def _work_for(self, analysis):
+        # None if there's nothing to do, False to init, True to run (or
+        # perform an op)
+        if analysis.status is Analysis.Status.NONE:
+            return False
+        elif analysis.status is Analysis.Status.COMPLETE and analysis.needs_op:
+            return True
+        elif analysis.status is Analysis.Status.INITED and analysis.enabled:
+            return True
+        return None
+
+    def _next(self):
+        while len(self._queue) > 0:
+            entry = heapq.heappop(self._queue)
+            priority, seq, analysis = entry
+            if self._queued.get(analysis) != seq:
+                continue  # superseded by a later entry
+            del self._queued[analysis]
+            if analysis in self._coalescing:
+                continue  # queued again once the changes stop
+            if analysis not in self._analyses:
+                continue  # deleted
+            run = self._work_for(analysis)
+            if run is not None:
+                return entry, run
+        return None, None
+
+    def _requeue(self, entry):
+        priority, seq, analysis = entry
+        self._queued[analysis] = seq
+        heapq.heappush(self._queue, entry)
+
+    def _dispatch(self):
+        not_ready = [ ]
+
         for engine in self._engines:
-            if engine.is_waiting:
-                for analysis in self._analyses.needs_init:
-                    engine.send(analysis, False)
-                    break
-            if engine.is_waiting:
-                for analysis in self._analyses.needs_op:
-                    engine.send(analysis, True)
-                    break
-            if engine.is_waiting:
-                for analysis in self._analyses.needs_run:
-                    engine.send(analysis, True)
-                    break
+            if not engine.is_waiting:
+                continue
+            entry, run = self._next()
+            if entry is None:
+                break
+            if engine.send(entry[2], run):
+                engine.cache_key = self._cache_keys.pop(entry[2], None)
+            else:
+                not_ready.append(entry)
+
+        for entry in not_ready:
+            self._requeue(entry)
+
+        if len(self._queued) > 0:
+            if len(not_ready) == 0 and self._can_grow():
+                self._create_engine().start()
+                not_ready.append(None)
+            if len(not_ready) > 0 and self._retry_handle is None:
+                self._retry_handle = asyncio.get_event_loop().call_later(
+                    EngineManager.RETRY_INTERVAL, self._retry)
+
+        if len(self._engines) > self._min_engines and self._retire_handle is None:
+            self._retire_handle = asyncio.get_event_loop().call_later(
+                EngineManager.ENGINE_IDLE_TIMEOUT, self._retire_idle)
+
+    def _cache_key(self, analysis):
+        # None for ops, which aren't cached
+        if analysis.status is Analysis.Status.COMPLETE or not analysis.enabled:
+            return None
+        return analysis.instance.results_cache.key(analysis)
+
+    def _replay(self, analysis, key):
+        # uses the cached results, where the analysis has been run with
+        # the same options and data before (and its images still exist)
+        if key is None:
+            return False
+        instance = analysis.instance
+        results = instance.results_cache.get(key)
+        if results is None:
+            return False
+        for resource in Analysis._get_resources(results.results):
+            if not path.exists(instance.get_path_to_resource(resource)):
+                return False
+
+        results.instanceId = instance.id
+        results.analysisId = analysis.id
+        results.revision = analysis.revision
+        results.index = 0
+        analysis.set_results(results)
+        # the state the engine holds is from a different run
+        analysis.clear_state = True
+        return True
+
+    def _can_grow(self):
+        if len(self._engines) >= self._max_engines:
+            return False
+        if any(map(lambda engine: engine.is_waiting, self._engines)):
+            return False
+        try:
+            load = os.getloadavg()[0]
+        except (AttributeError, OSError):  # not available on windows
+            return True
+        return load < self._cpu_count
+
+    def _retry(self):
+        self._retry_handle = None
+        self._dispatch()
+
+    def _retire_idle(self):
+        self._retire_handle = None
+        now = time.monotonic()
+        for engine in reversed(list(self._engines)):
+            if len(self._engines) <= self._min_engines:
+                break
+            if engine.is_waiting and now - engine.idle_since >= EngineManager.ENGINE_IDLE_TIMEOUT:
+                self._engines.remove(engine)
+                engine.retire()
+
+        if len(self._engines) > self._min_engines:
+            self._retire_handle = asyncio.get_event_loop().call_later(
+                EngineManager.ENGINE_IDLE_TIMEOUT, self._retire_idle)
@@ -64,7 +64,7 @@ def get_writers():
     return _writers
 
 
-def read(data, path, prog_cb, is_example=False):
+def read(data, path, prog_cb, is_example=False, lazy=False):
 
     data.title = os.path.splitext(os.path.basename(path))[0]
     ext = os.path.splitext(path)[1].lower()
@@ -74,7 +74,7 @@ def read(data, path, prog_cb, is_example=False):
     if path == '':
         blank.read(data)
     elif ext == '.omv':
-        omv.read(data, path, prog_cb)
+        omv.read(data, path, prog_cb, lazy)
         if not is_example:
             data.path = path
     elif ext == '.omt':
@@ -87,11 +87,32 @@ def read(data, path, prog_cb, is_example=False):
     data.setup()
 
 
+def read_to_buffer(path, buffer_path):
+    # reads a file into a memory map of its own, returning the size of
+    # its contents. this allows files to be read in other processes,
+    # with their memory maps attached to afterwards
+
+    from jamovi.core import MemoryMap
+    from jamovi.core import DataSet
+    from ..instancemodel import InstanceModel
+
+    mm = MemoryMap.create(buffer_path, 4 * 1024 * 1024)
+    try:
+        data = InstanceModel(None)
+        data.dataset = DataSet.create(mm)
+        read(data, path, lambda p: None)
+        return mm.used_size
+    finally:
+        mm.close()
+
+
 def _import(data, path, prog_cb, is_example=False):
     readers = get_readers()
 
     ext = os.path.splitext(path)[1].lower()[1:]
     if ext in readers:
+        # the imported data takes about as much space as the file
+        data.reserve(os.path.getsize(path))
         readers[ext][1](data, path, prog_cb)
     else:
         raise RuntimeError('Unrecognised file format')
@@ -6,10 +6,21 @@ import os
 import csv
 import math
 import re
+import mmap
+import codecs
+import multiprocessing
 from io import TextIOWrapper
+from io import BytesIO
+from itertools import islice
+from itertools import chain
+from functools import partial
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 import chardet
 import logging
 
+import numpy as np
+
 from jamovi.core import ColumnType
 from jamovi.core import DataType
 from jamovi.core import MeasureType
@@ -20,6 +31,11 @@ settings.specify_default('missings', 'NA')
 
 log = logging.getLogger('jamovi')
 
+CHUNK_SIZE = 16384
+SEGMENT_SIZE = 16 * 1024 * 1024
+PARALLEL_THRESHOLD = 4 * SEGMENT_SIZE
+NaN = float('nan')
+
 
 def get_readers():
     return [ ( 'csv', read ), ( 'txt', read ) ]
@@ -40,9 +56,9 @@ def write(data, path, prog_cb):
             sep = ','
         file.write('\n')
 
-        for row_no in range(data.row_count):
-            if data.is_row_filtered(row_no):
-                continue
+        row_nos = data.get_indices_ex_filtered(0, data.row_count_ex_filtered)
+
+        for row_no in row_nos:
             sep = ''
             for column in data:
                 if column.is_virtual or (column.is_filter and column.active):
@@ -134,45 +150,262 @@ def read(data, path, prog_cb):
             column_writers.append(ColumnWriter(column, i))
             column_count += 1
 
+        segments = None
+        if file_size >= PARALLEL_THRESHOLD and (os.cpu_count() or 1) > 1:
+            segments = split(file, encoding, dialect)
+
+        if segments is not None and len(segments) > 1:
+            read_parallel(data, path, encoding, dialect, segments, column_writers, prog_cb)
+            return
+
+        # the file is read a chunk of rows at a time. the types of the
+        # columns are inferred from the first chunk, and promoted as later
+        # chunks require. values are written a chunk at a time
+
         row_count = 0
 
-        csvfile.seek(0)
-        reader = csv.reader(csvfile, dialect)
-        first = True
+        while True:
+            rows = list(islice(itr, CHUNK_SIZE))
+            if len(rows) == 0:
+                break
 
-        for row in reader:
-            if first:
-                first = False
-            else:
-                for i in range(column_count):
-                    column_writers[i].examine_row(row)
+            for column_writer in column_writers:
+                column_writer.examine(rows)
+
+            # columns which turn out to be text need their earlier values
+            # re-reading, as the original strings weren't retained
+            to_rescan = list(filter(lambda x: x.needs_rescan, column_writers))
+            if to_rescan:
+                rescan(path, encoding, dialect, row_count, to_rescan)
+
+            data.set_row_count(row_count + len(rows))
+
+            for column_writer in column_writers:
+                column_writer.write(row_count)
 
-                row_count += 1
+            row_count += len(rows)
 
-            if row_count % 1000 == 0:
-                prog_cb(0.33333 * file.tell() / file_size)
+            prog_cb(file.tell() / file_size)
 
         for column_writer in column_writers:
             column_writer.ruminate()
 
-        data.set_row_count(row_count)
 
-        csvfile.seek(0)
+def rescan(path, encoding, dialect, row_count, column_writers):
+
+    with open(path, mode='rb') as file:
+        csvfile = TextIOWrapper(file, encoding=encoding, errors='replace')
         reader = csv.reader(csvfile, dialect)
-        first = True
+        itr = islice(reader, 1, row_count + 1)  # skip the column names
 
         row_no = 0
 
-        for row in reader:
-            if first:
-                first = False
-            else:
-                for i in range(column_count):
-                    column_writers[i].parse_row(row, row_no)
-                row_no += 1
+        while row_no < row_count:
+            rows = list(islice(itr, CHUNK_SIZE))
+            if len(rows) == 0:
+                break
+            for column_writer in column_writers:
+                column_writer.rewrite(rows, row_no)
+            row_no += len(rows)
+
+    for column_writer in column_writers:
+        column_writer.needs_rescan = False
+
+
+def split(file, encoding, dialect):
+
+    # splits the file into segments of whole records, which can be parsed
+    # independently. a newline ends a record only if it's outside of
+    # quotes, i.e. an even number of quote characters precede it. this
+    # requires the quotes be balanced (as they are in files written by a
+    # csv writer), and an encoding where newlines and quotes are the same
+    # single bytes as in ascii
+
+    if encoding is None:
+        return None
+    if dialect.quoting == csv.QUOTE_NONE or dialect.escapechar is not None:
+        return None
+    if codecs.lookup(encoding).name == 'utf-8-sig':
+        encoding = 'utf-8'
+
+    try:
+        quote = dialect.quotechar.encode(encoding)
+        if len(quote) != 1 or '\n'.encode(encoding) != b'\n':
+            return None
+    except (UnicodeError, LookupError):
+        return None
+
+    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+
+        size = len(mm)
+
+        def count_quotes(start, end):
+            count = 0
+            while start < end:
+                stop = min(start + SEGMENT_SIZE, end)
+                count += mm[start:stop].count(quote)
+                start = stop
+            return count
+
+        if count_quotes(0, size) % 2 != 0:
+            return None
+
+        def record_end(pos, parity):
+            # the position after the end of the record which spans pos
+            while True:
+                nl = mm.find(b'\n', pos)
+                if nl == -1:
+                    return size, parity
+                parity += mm[pos:nl].count(quote)
+                pos = nl + 1
+                if parity % 2 == 0:
+                    return pos, parity
+
+        pos, parity = record_end(0, 0)  # skip the column names
+        bounds = [ pos ]
+
+        while pos + SEGMENT_SIZE < size:
+            target = pos + SEGMENT_SIZE
+            parity += count_quotes(pos, target)
+            pos, parity = record_end(target, parity)
+            bounds.append(pos)
+
+        if bounds[-1] != size:
+            bounds.append(size)
+
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def read_parallel(data, path, encoding, dialect, segments, column_writers, prog_cb):
+
+    # the segments are examined in parallel, and the examinations merged
+    # to determine the column types. the segments are then parsed in
+    # parallel, and the values written to the columns in order
+
+    missings = column_writers[0].missings
+    fmtparams = dict(map(
+        lambda name: (name, getattr(dialect, name)),
+        ('delimiter', 'quotechar', 'escapechar', 'doublequote',
+         'skipinitialspace', 'lineterminator', 'quoting')))
+    starts = list(map(lambda segment: segment[0], segments))
+    ends = list(map(lambda segment: segment[1], segments))
+    n_segments = len(segments)
+    n_columns = len(column_writers)
+
+    context = multiprocessing.get_context('spawn')
+    n_workers = min(n_segments, os.cpu_count() or 1)
+
+    with ProcessPoolExecutor(n_workers, mp_context=context) as pool:
+
+        examine = partial(
+            examine_segment, path, encoding, fmtparams, missings, n_columns)
 
-            if row_no % 1000 == 0:
-                prog_cb(.33333 + .66666 * file.tell() / file_size)
+        row_count = 0
+        row_starts = [ ]
+
+        for i, (n_rows, examiners) in enumerate(pool.map(examine, starts, ends)):
+            for column_writer, examiner in zip(column_writers, examiners):
+                column_writer.merge(examiner)
+            row_starts.append(row_count)
+            row_count += n_rows
+            prog_cb(0.5 * (i + 1) / n_segments)
+
+        data.set_row_count(row_count)
+
+        types = list(map(lambda x: x.prepare(), column_writers))
+        parse = partial(
+            parse_segment, path, encoding, fmtparams, missings, types)
+
+        for i, columns in enumerate(pool.map(parse, starts, ends)):
+            for column_writer, values in zip(column_writers, columns):
+                column_writer.write_values(row_starts[i], values)
+            prog_cb(0.5 + 0.5 * (i + 1) / n_segments)
+
+    for column_writer in column_writers:
+        column_writer.ruminate()
+
+
+def read_segment(path, encoding, fmtparams, start, end):
+    with open(path, mode='rb') as file:
+        file.seek(start)
+        byts = file.read(end - start)
+    csvfile = TextIOWrapper(BytesIO(byts), encoding=encoding, errors='replace')
+    reader = csv.reader(csvfile, **fmtparams)
+    while True:
+        rows = list(islice(reader, CHUNK_SIZE))
+        if len(rows) == 0:
+            break
+        yield rows
+
+
+def examine_segment(path, encoding, fmtparams, missings, n_columns, start, end):
+    examiners = list(map(lambda i: ColumnExaminer(i, missings), range(n_columns)))
+    n_rows = 0
+    for rows in read_segment(path, encoding, fmtparams, start, end):
+        for examiner in examiners:
+            examiner.examine(examiner.extract(rows))
+        n_rows += len(rows)
+    return n_rows, examiners
+
+
+def parse_segment(path, encoding, fmtparams, missings, types, start, end):
+
+    columns = [ ]
+    for index, (data_type, measure_type, euro, levels) in enumerate(types):
+        if levels is not None:
+            level_index = partial(lookup_level, levels)
+        else:
+            level_index = None
+        parse = partial(
+            parse_values,
+            data_type=data_type,
+            measure_type=measure_type,
+            euro=euro,
+            level_index=level_index)
+        columns.append((index, parse, [ ]))
+
+    for rows in read_segment(path, encoding, fmtparams, start, end):
+        for index, parse, chunks in columns:
+            chunks.append(parse(extract(rows, index, missings)))
+
+    results = [ ]
+    for index, parse, chunks in columns:
+        if len(chunks) == 0:
+            results.append([ ])
+        elif isinstance(chunks[0], array):
+            results.append(array(chunks[0].typecode, b''.join(chunks)))
+        else:
+            results.append(list(chain.from_iterable(chunks)))
+    return results
+
+
+def lookup_level(levels, value):
+    if value is None:
+        return -2147483648
+    return levels[value]
+
+
+def extract(rows, index, missings):
+    values = [ row[index] if index < len(row) else None for row in rows ]
+    return [ None if v in missings else v for v in values ]
+
+
+def parse_values(values, data_type, measure_type, euro, level_index):
+
+    if data_type == DataType.INTEGER:
+        values = map(lambda v: -2147483648 if v is None else int(v), values)
+        return array('i', values)
+
+    elif data_type == DataType.DECIMAL:
+        parse = ColumnExaminer.parse_euro_float if euro else float
+        values = map(lambda v: NaN if v is None else parse(v), values)
+        return array('d', values)
+
+    elif measure_type != MeasureType.ID:
+        return array('i', map(level_index, values))
+
+    else:
+        return values
 
 
 def trim_after_last_newline(text):
@@ -189,58 +422,96 @@ def trim_after_last_newline(text):
     return text
 
 
-class ColumnWriter:
+class ColumnExaminer:
 
     euro_float_pattern = re.compile(r'^(-)?([0-9]*),([0-9]+)$')
     euro_float_repl = r'\1\2.\3'
 
-    def _is_euro_float(self, v):
-        if ColumnWriter.euro_float_pattern.match(v):
+    @staticmethod
+    def is_euro_float(v):
+        if ColumnExaminer.euro_float_pattern.match(v):
             return True
         return False
 
-    def _parse_euro_float(self, v):
+    @staticmethod
+    def parse_euro_float(v):
         v = re.sub(
-            ColumnWriter.euro_float_pattern,
-            ColumnWriter.euro_float_repl,
+            ColumnExaminer.euro_float_pattern,
+            ColumnExaminer.euro_float_repl,
             v)
         return float(v)
 
-    def __init__(self, column, column_index):
-        self._column = column
+    def __init__(self, column_index, missings):
         self._column_index = column_index
-        self._missings = settings.get('missings')
+        self.missings = missings
 
         self._only_integers = True
         self._only_floats = True
         self._only_euro_floats = True
         self._is_empty = True
         self._unique_values = set()
-        self._n_uniques = 0
         self._many_uniques = False
-        self._measure_type = None
-        self._data_type = None
-        self._ruminated = False
         self._dps = 0
 
-    def examine_row(self, row):
+    def extract(self, rows):
+        return extract(rows, self._column_index, self.missings)
 
-        if self._column_index >= len(row):
-            return
+    def examine(self, values):
 
-        value = row[self._column_index]
+        # returns the values parsed, where they all parse as integers or
+        # floats, saving them being parsed a second time
 
-        if value == self._missings or value == '' or value == ' ':
-            return
-        else:
-            self._is_empty = False
+        present = list(filter(lambda v: v is not None, values))
+
+        if len(present) == 0:
+            return None
+
+        self._is_empty = False
 
         if not self._many_uniques:
-            if value not in self._unique_values:
-                self._unique_values.add(value)
-                self._n_uniques += 1
-                if self._n_uniques > 49:
-                    self._many_uniques = True
+            self._add_uniques(present)
+
+        if self._only_integers:
+            try:
+                parsed = list(map(lambda v: -2147483648 if v is None else int(v), values))
+                if min(parsed) >= -2147483648 and max(parsed) <= 2147483647:
+                    return parsed
+            except ValueError:
+                pass
+
+        if not self._only_integers and not self._only_euro_floats and self._only_floats:
+            try:
+                parsed = list(map(lambda v: NaN if v is None else float(v), values))
+                self._update_dps(parsed)
+                return parsed
+            except ValueError:
+                pass
+
+        if self._only_integers or self._only_floats or self._only_euro_floats:
+            for value in present:
+                self._examine_value(value)
+
+        return None
+
+    def merge(self, other):
+        self._only_integers = self._only_integers and other._only_integers
+        self._only_floats = self._only_floats and other._only_floats
+        self._only_euro_floats = self._only_euro_floats and other._only_euro_floats
+        self._is_empty = self._is_empty and other._is_empty
+        self._dps = max(self._dps, other._dps)
+        if other._many_uniques:
+            self._many_uniques = True
+            self._unique_values = set()
+        elif not self._many_uniques:
+            self._add_uniques(other._unique_values)
+
+    def _add_uniques(self, values):
+        self._unique_values.update(values)
+        if len(self._unique_values) > 49:
+            self._many_uniques = True
+            self._unique_values = set()
+
+    def _examine_value(self, value):
 
         try:
             i = int(value)
@@ -259,111 +530,172 @@ class ColumnWriter:
             except ValueError:
                 self._only_floats = False
 
-                if self._only_euro_floats and self._is_euro_float(value):
-                    f = self._parse_euro_float(value)
+                if self._only_euro_floats and self.is_euro_float(value):
+                    f = self.parse_euro_float(value)
                     self._dps = max(self._dps, calc_dps(f))
                 else:
                     self._only_euro_floats = False
 
-    def ruminate(self):
-
+    def _update_dps(self, parsed):
+        if self._dps >= 3:
+            return
+        # calc_dps() is only called for each distinct fractional part
+        values = np.array(parsed)
+        values = values[np.isfinite(values)]
+        fractions = np.unique(np.mod(values, 1))
+        for fraction in fractions:
+            self._dps = max(self._dps, calc_dps(fraction))
+            if self._dps >= 3:
+                break
+
+    @property
+    def _euro(self):
+        return self._only_euro_floats and not self._only_floats
+
+    def _types(self):
+        # integers are written without levels while importing; the levels
+        # are added at the end, if the column turns out to be nominal
         if self._only_integers:
-            if self._many_uniques is False:
-                self._data_type = DataType.INTEGER
-                self._measure_type = MeasureType.NOMINAL
-                self._column.change(
-                    data_type=DataType.INTEGER,
-                    measure_type=MeasureType.NOMINAL)
+            return DataType.INTEGER, MeasureType.CONTINUOUS
+        elif self._only_floats or self._only_euro_floats:
+            return DataType.DECIMAL, MeasureType.CONTINUOUS
+        elif self._many_uniques:
+            return DataType.TEXT, MeasureType.ID
+        else:
+            return DataType.TEXT, MeasureType.NOMINAL
 
-                self._unique_values = list(self._unique_values)
-                self._unique_values = list(map(lambda x: int(x), self._unique_values))
-                self._unique_values.sort()
-                for level in self._unique_values:
-                    self._column.append_level(level, str(level))
-            else:
-                self._data_type = DataType.INTEGER
-                self._measure_type = MeasureType.CONTINUOUS
-                self._column.change(
-                    data_type=DataType.INTEGER,
-                    measure_type=MeasureType.CONTINUOUS)
 
-        elif self._only_floats or self._only_euro_floats:
-            self._data_type = DataType.DECIMAL
-            self._measure_type = MeasureType.CONTINUOUS
-            self._column.change(
-                data_type=DataType.DECIMAL,
-                measure_type=MeasureType.CONTINUOUS)
+class ColumnWriter(ColumnExaminer):
 
-            if self._only_floats and self._only_euro_floats:
-                self._only_euro_floats = False
+    def __init__(self, column, column_index):
+        ColumnExaminer.__init__(
+            self,
+            column_index,
+            ( settings.get('missings'), '', ' ' ))
 
-        else:
-            if self._many_uniques is False:
-                self._data_type = DataType.TEXT
-                self._measure_type = MeasureType.NOMINAL
-                self._column.change(
-                    data_type=DataType.TEXT,
-                    measure_type=MeasureType.NOMINAL)
+        self._column = column
+        self._levels = { }
 
-                self._unique_values = list(self._unique_values)
-                self._unique_values.sort()
-                for i in range(0, len(self._unique_values)):
-                    label = self._unique_values[i]
-                    self._column.append_level(i, label)
-            else:
-                self._data_type = DataType.TEXT
-                self._measure_type = MeasureType.ID
-                self._column.change(
-                    data_type=DataType.TEXT,
-                    measure_type=MeasureType.ID)
+        self._values = None
+        self._parsed = None
+        self._row_count = 0
+        self.needs_rescan = False
 
-        self._column.dps = self._dps
-        self._ruminated = True
+        self._data_type, self._measure_type = self._types()
+        self._column.change(
+            data_type=self._data_type,
+            measure_type=self._measure_type)
 
-    def parse_row(self, row, row_no):
+    def examine(self, rows):
+        values = self.extract(rows)
+        self._values = values
+        self._parsed = ColumnExaminer.examine(self, values)
+        self._promote()
 
-        if self._ruminated is False:
-            self.ruminate()
+    def _promote(self):
 
-        if self._column_index >= len(row):
-            value = None
-        else:
-            value = row[self._column_index]
+        data_type, measure_type = self._types()
 
-            if value == self._missings or value == '' or value == ' ':
-                value = None
+        if data_type == self._data_type and measure_type == self._measure_type:
+            return
 
-        if self._data_type == DataType.INTEGER:
-            if value is None:
-                self._column.clear_at(row_no)
+        if data_type == DataType.TEXT and self._data_type != DataType.TEXT:
+            # the values written so far were parsed as numbers, so they're
+            # cleared, and re-read from the file as text
+            if self._data_type == DataType.DECIMAL:
+                missing = array('d', [ NaN ])
             else:
-                self._column.set_value(row_no, int(value))
+                missing = array('i', [ -2147483648 ])
+            self._column.write_range(0, missing * self._row_count)
+            self.needs_rescan = self._row_count > 0
+
+        self._column.change(data_type=data_type, measure_type=measure_type)
+        self._data_type = data_type
+        self._measure_type = measure_type
+        self._levels = { }
+
+    def prepare(self):
+
+        # sets up the column from the merged examinations, and returns the
+        # types needed to parse its values
+
+        self._promote()
+
+        levels = None
+        if self._data_type == DataType.TEXT and self._measure_type != MeasureType.ID:
+            for label in sorted(self._unique_values):
+                self._level_index(label)
+            levels = self._levels
+
+        return self._data_type, self._measure_type, self._euro, levels
+
+    def _level_index(self, value):
+        if value is None:
+            return -2147483648
+        index = self._levels.get(value)
+        if index is None:
+            index = len(self._levels)
+            self._levels[value] = index
+            self._column.append_level(index, value)
+        return index
+
+    def _parse(self, values):
+        return parse_values(
+            values,
+            self._data_type,
+            self._measure_type,
+            self._euro,
+            self._level_index)
+
+    def write_values(self, row_start, values):
+        if isinstance(values, array):
+            self._column.write_range(row_start, values)
+        else:
+            for i, value in enumerate(values):
+                if value is not None:
+                    self._column.set_value(row_start + i, value)
+        self._row_count = max(self._row_count, row_start + len(values))
 
-        elif self._data_type == DataType.DECIMAL:
+    def rewrite(self, rows, row_start):
+        self.write_values(row_start, self._parse(self.extract(rows)))
 
-            if value is None:
-                self._column.set_value(row_no, float('nan'))
-            else:
-                if self._only_euro_floats:
-                    value = re.sub(
-                        ColumnWriter.euro_float_pattern,
-                        ColumnWriter.euro_float_repl,
-                        value)
-                self._column.set_value(row_no, float(value))
-
-        elif self._data_type == DataType.TEXT:
-
-            if self._measure_type != MeasureType.ID:
-                if value is None:
-                    self._column.set_value(row_no, -2147483648)
-                else:
-                    index = self._unique_values.index(value)
-                    self._column.set_value(row_no, index)
-            elif self._measure_type is MeasureType.ID:
-                if value is None:
-                    self._column.set_value(row_no, '')
-                else:
-                    self._column.set_value(row_no, str(value))
+    def write(self, row_start):
 
+        if self._parsed is not None:
+            if self._data_type == DataType.DECIMAL:
+                values = array('d', self._parsed)
+            else:
+                values = array('i', self._parsed)
         else:
-            self._column.clear_at(row_no)
+            values = self._parse(self._values)
+
+        self.write_values(row_start, values)
+        self._values = None
+        self._parsed = None
+
+    def ruminate(self):
+
+        if self._data_type == DataType.INTEGER:
+            if self._many_uniques is False:
+                self._measure_type = MeasureType.NOMINAL
+                self._column.change(
+                    data_type=DataType.INTEGER,
+                    measure_type=MeasureType.NOMINAL)
+
+        elif self._data_type == DataType.TEXT and self._measure_type != MeasureType.ID:
+            # the levels were added in the order encountered; they're
+            # sorted, and the values recoded to match
+            labels = sorted(self._levels)
+            if labels != list(self._levels):
+                recode = np.empty(len(labels), dtype=np.int32)
+                for index, label in enumerate(labels):
+                    recode[self._levels[label]] = index
+                values = np.asarray(self._column.read_range(0, self._row_count))
+                missing = values == -2147483648
+                values = np.where(missing, values, recode[np.where(missing, 0, values)])
+                self._column.clear_levels()
+                for index, label in enumerate(labels):
+                    self._column.append_level(index, label)
+                self._column.write_range(0, values.astype(np.int32), True)
+
+        self._column.dps = self._dps
@@ -4,8 +4,11 @@ from zipfile import ZipFile
 import io
 import json
 from tempfile import NamedTemporaryFile
-from tempfile import TemporaryDirectory
+from array import array
 import struct
+from functools import partial
+import mmap
+import sys
 import os
 import os.path
 import re
@@ -16,6 +19,16 @@ from jamovi.core import MeasureType
 from jamovi.server.appinfo import app_info
 
 
+BUFF_ROWS = 1048576
+
+
+def _write_values(file, values):
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    values.tofile(file)
+
+
 def write(data, path, prog_cb, html=None, is_template=False):
 
     with ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zip:
@@ -64,6 +77,7 @@ def write(data, path, prog_cb, html=None, is_template=False):
             field['parentId'] = column.parent_id
             if column.data_type == DataType.DECIMAL:
                 field['type'] = 'number'
+                field['dps'] = column.dps
             elif column.data_type == DataType.TEXT and column.measure_type == MeasureType.ID:
                 field['type'] = 'string'
                 string_table_required = True
@@ -141,35 +155,26 @@ def write(data, path, prog_cb, html=None, is_template=False):
             column = data[col_no]
             if column.is_virtual is True:
                 continue
-            if column.data_type == DataType.DECIMAL:
-                for i in range(0, row_count):
-                    value = column.raw(i)
-                    byts = struct.pack('<d', value)
-                    temp_file.write(byts)
-                    if i % 100000 == 0:
-                        prog_cb((col_no + i / row_count) / data.column_count)
-            elif column.data_type == DataType.TEXT and column.measure_type == MeasureType.ID:
-                for i in range(0, row_count):
-                    value = column[i]
-                    if value != '':
-                        string_file.write(value.encode('utf-8'))
-                        string_file.write(bytes(1))
-                        n = len(value) + 1
-                        byts = struct.pack('<i', cursor)
-                        temp_file.write(byts)
-                        cursor += n
-                    else:
-                        byts = struct.pack('<i', -2147483648)
-                        temp_file.write(byts)
-                    if i % 100000 == 0:
-                        prog_cb((col_no + i / row_count) / data.column_count)
+            if column.data_type == DataType.TEXT and column.measure_type == MeasureType.ID:
+                for row_offset in range(0, row_count, BUFF_ROWS):
+                    n_rows = min(row_count - row_offset, BUFF_ROWS)
+                    positions = array('i', [ -2147483648 ]) * n_rows
+                    for i in range(n_rows):
+                        value = column[row_offset + i]
+                        if value != '':
+                            byts = value.encode('utf-8')
+                            string_file.write(byts)
+                            string_file.write(bytes(1))
+                            positions[i] = cursor
+                            cursor += len(byts) + 1
+                    _write_values(temp_file, positions)
+                    prog_cb((col_no + row_offset / row_count) / data.column_count)
             else:
-                for i in range(0, row_count):
-                    value = column.raw(i)
-                    byts = struct.pack('<i', value)
-                    temp_file.write(byts)
-                    if i % 100000 == 0:
-                        prog_cb((col_no + i / row_count) / data.column_count)
+                for row_offset in range(0, row_count, BUFF_ROWS):
+                    n_rows = min(row_count - row_offset, BUFF_ROWS)
+                    values = column.read_range(row_offset, n_rows)
+                    _write_values(temp_file, values)
+                    prog_cb((col_no + row_offset / row_count) / data.column_count)
 
         temp_file.close()
         zip.write(temp_file.name, 'data.bin')
@@ -201,19 +206,158 @@ def write(data, path, prog_cb, html=None, is_template=False):
         #         pass
 
 
-_buffer = bytearray(512)
+BUFF_SIZE = 4 * 1024 * 1024
 
 
-def _read_string_from_table(stream, pos):
-    final_pos = stream.seek(pos)
-    if pos != final_pos:
+def _read_string_from_table(table, pos):
+    if table is None:
+        return str(pos)
+    if pos < 0 or pos >= len(table):
         return ''
-    stream.readinto(_buffer)
-    try:
-        end = _buffer.index(bytes(1))  # find string terminator
-        return _buffer[0:end].decode('utf-8', errors='ignore')
-    except ValueError:
-        return _buffer.decode('utf-8', errors='ignore')
+    end = table.find(b'\0', pos, pos + 512)  # find string terminator
+    if end == -1:
+        end = pos + 512
+    return table[pos:end].decode('utf-8', errors='ignore')
+
+
+class _MemberReader:
+
+    # reads a zip member as a series of memoryviews. where the member is
+    # stored uncompressed, these are views onto the memory mapped zip
+    # file, and no copying takes place. each view is released when the
+    # next is read
+
+    def __init__(self, zip, path, name):
+        info = zip.getinfo(name)
+        self._file = None
+        self._mm = None
+        self._stream = None
+        self._views = ( )
+        self._pos = 0
+
+        if info.compress_type == zipfile.ZIP_STORED and info.file_size > 0:
+            self._file = open(path, 'rb')
+            self._file.seek(info.header_offset)
+            header = self._file.read(30)
+            name_len, extra_len = struct.unpack('<HH', header[26:30])
+            self._pos = info.header_offset + 30 + name_len + extra_len
+            self._start = self._pos
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._stream = zip.open(name)
+            self._buff = bytearray(BUFF_SIZE)
+
+    def seek(self, offset):
+        self._release()
+        if self._mm is not None:
+            self._pos = self._start + offset
+        else:
+            self._stream.seek(offset)
+
+    def read(self, n_bytes, fmt):
+        self._release()
+        if self._mm is not None:
+            view = memoryview(self._mm)[self._pos:self._pos + n_bytes]
+            self._pos += n_bytes
+        else:
+            view = memoryview(self._buff)[0:n_bytes]
+            n_read = 0
+            while n_read < n_bytes:
+                n = self._stream.readinto(view[n_read:])
+                if n == 0:
+                    raise EOFError('data.bin is truncated')
+                n_read += n
+        values = view.cast(fmt)
+        self._views = ( values, view )
+        return values
+
+    def _release(self):
+        for view in self._views:
+            view.release()
+        self._views = ( )
+
+    def close(self):
+        self._release()
+        if self._mm is not None:
+            self._mm.close()
+            self._file.close()
+        else:
+            self._stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _load_column(column, data_file, string_table, row_count, repair_levels, prog_cb=None):
+
+    if column.data_type == DataType.DECIMAL:
+        elem_fmt = 'd'
+        elem_width = 8
+    else:
+        elem_fmt = 'i'
+        elem_width = 4
+
+    is_id = (column.data_type == DataType.TEXT and column.measure_type == MeasureType.ID)
+    repair_levels = repair_levels and not is_id
+
+    for row_offset in range(0, row_count, int(BUFF_SIZE / elem_width)):
+        n_rows = min(row_count - row_offset, int(BUFF_SIZE / elem_width))
+        values = data_file.read(n_rows * elem_width, elem_fmt)
+
+        if sys.byteorder != 'little':
+            values = array(elem_fmt, values)
+            values.byteswap()
+
+        if is_id:
+            for i, value in enumerate(values):
+                if value != -2147483648:  # missing value
+                    column.set_value(
+                        row_offset + i,
+                        _read_string_from_table(string_table, value))
+        else:
+            if repair_levels:
+                # dict.fromkeys() retains the order encountered
+                for v in dict.fromkeys(values):
+                    if v != -2147483648 and not column.has_level(v):
+                        column.append_level(v, str(v))
+            column.write_range(row_offset, values)
+
+        if prog_cb is not None:
+            prog_cb(row_offset / row_count)
+
+
+class _DataLoader:
+
+    # loads the values of columns from data.bin on demand. the archive is
+    # opened on the first load, and remains open until every column has
+    # been loaded (when the last reference to the loader is dropped)
+
+    def __init__(self, path, row_count):
+        self._path = path
+        self._row_count = row_count
+        self._zip = None
+        self._data_file = None
+        self._string_table = None
+
+    def load(self, offset, repair_levels, column):
+        if self._zip is None:
+            self._zip = ZipFile(self._path, 'r')
+            self._data_file = _MemberReader(self._zip, self._path, 'data.bin')
+            try:
+                self._string_table = self._zip.read('strings.bin')
+            except KeyError:
+                self._string_table = None
+
+        self._data_file.seek(offset)
+        _load_column(column, self._data_file, self._string_table, self._row_count, repair_levels)
+
+    def __del__(self):
+        if self._zip is not None:
+            self._data_file.close()
+            self._zip.close()
 
 
 def replace_single_equals(formula):
@@ -256,7 +400,7 @@ def replace_single_equals(formula):
     return formula
 
 
-def read(data, path, prog_cb):
+def read(data, path, prog_cb, lazy=False):
 
     data.title = os.path.splitext(os.path.basename(path))[0]
 
@@ -311,6 +455,8 @@ def read(data, path, prog_cb):
                 transform.description = meta_transform.get('description', '')
                 transform.suffix = meta_transform.get('suffix', '')
 
+        dps_by_id = { }
+
         for meta_column in meta_dataset['fields']:
             name = meta_column['name']
             id = meta_column.get('id', 0)
@@ -350,6 +496,9 @@ def read(data, path, prog_cb):
             column.parent_id = meta_column.get('parentId', 0)
             column.cell_tracker.edited_cell_ranges = meta_column.get('edits', [])
 
+            if 'dps' in meta_column:
+                dps_by_id[column.id] = meta_column['dps']
+
             if column.is_filter:
                 column.filter_no = meta_column.get('filterNo', -1)
                 column.active = meta_column.get('active', True)
@@ -385,95 +534,47 @@ def read(data, path, prog_cb):
                         columns_w_bad_levels.append(column.id)
         except Exception:
             columns_w_bad_levels = filter(lambda col: col.measure_type is not MeasureType.CONTINUOUS, data.dataset)
-            columns_w_bad_levels = map(lambda col: col.id, columns_w_bad_levels)
+            columns_w_bad_levels = list(map(lambda col: col.id, columns_w_bad_levels))
 
         prog_cb(0.03)
 
-        with TemporaryDirectory() as dir:
-            zip.extract('data.bin', dir)
-            data_path = os.path.join(dir, 'data.bin')
-            data_file = open(data_path, 'rb')
-
-            try:
-                zip.extract('strings.bin', dir)
-                string_table_present = True
-                string_table_path = os.path.join(dir, 'strings.bin')
-                string_table = open(string_table_path, 'rb')
-            except Exception:
-                string_table_present = False
+        try:
+            string_table = zip.read('strings.bin')
+        except KeyError:
+            string_table = None
 
-            BUFF_SIZE = 65536
-            buff = memoryview(bytearray(BUFF_SIZE))
+        with _MemberReader(zip, path, 'data.bin') as data_file:
 
             ncols = data.dataset.column_count
-            col_no = 0
-
-            for column in data.dataset:
-
-                if column.data_type == DataType.DECIMAL:
-                    elem_fmt = '<d'
-                    elem_width = 8
-                    repair_levels = False
-                    transform = None
-                elif column.data_type == DataType.TEXT and column.measure_type == MeasureType.ID:
-                    elem_fmt = '<i'
-                    elem_width = 4
-                    repair_levels = False
-                    if string_table_present:
-                        def transform(x):
-                            if x == -2147483648:
-                                return ''
-                            else:
-                                return _read_string_from_table(string_table, x)
-                    else:
-                        def transform(x):
-                            if x == -2147483648:
-                                return ''
-                            else:
-                                return str(x)
+            loader = _DataLoader(path, row_count) if lazy else None
+            offset = 0
+
+            for col_no in range(ncols):
+                column = data[col_no]
+                repair_levels = column.id in columns_w_bad_levels
+                elem_width = 8 if column.data_type == DataType.DECIMAL else 4
+
+                # filters are needed to display the data set, and decimal
+                # columns from older files can't be deferred, because
+                # their dps can only be determined from their values
+                if (loader is not None
+                        and not column.is_filter
+                        and (column.data_type != DataType.DECIMAL
+                             or column.id in dps_by_id)):
+                    column.set_loader(partial(loader.load, offset, repair_levels))
+                    column.dps = dps_by_id.get(column.id, 0)
                 else:
-                    elem_fmt = '<i'
-                    elem_width = 4
-                    repair_levels = column.id in columns_w_bad_levels
-                    transform = None
-
-                for row_offset in range(0, row_count, int(BUFF_SIZE / elem_width)):
-                    n_bytes_to_read = min(elem_width * (row_count - row_offset), BUFF_SIZE)
-                    buff_view = buff[0:n_bytes_to_read]
-                    data_file.readinto(buff_view)
-
-                    # 'if' surrounding loops, rather than an 'if' inside one loop
-                    # gives a performance improvement (i expect)
-                    if repair_levels:
-                        i = 0
-                        for values in struct.iter_unpack(elem_fmt, buff_view):
-                            v = values[0]
-                            if v != -2147483648:  # missing value
-                                column.append_level(v, str(v))
-                            column.set_value(row_offset + i, v)
-                            i += 1
-                    elif transform:
-                        i = 0
-                        for values in struct.iter_unpack(elem_fmt, buff_view):
-                            value = transform(values[0])
-                            column.set_value(row_offset + i, value)
-                            i += 1
-                    else:
-                        i = 0
-                        for values in struct.iter_unpack(elem_fmt, buff_view):
-                            column.set_value(row_offset + i, values[0])
-                            i += 1
-
-                    prog_cb(0.1 + 0.85 * (col_no + row_offset / row_count) / ncols)
-
-                col_no += 1
-
-            data_file.close()
-            if string_table_present:
-                string_table.close()
-
-        for column in data:
-            column.determine_dps()
+                    data_file.seek(offset)
+                    _load_column(
+                        column,
+                        data_file,
+                        string_table,
+                        row_count,
+                        repair_levels,
+                        lambda p: prog_cb(0.1 + 0.85 * (col_no + p) / ncols))
+                    column.determine_dps()
+
+                offset += elem_width * row_count
 
         is_analysis = re.compile('^[0-9][0-9]+ .+/analysis$')
         is_resource = re.compile('^[0-9][0-9]+ .+/resources/.+')
@@ -1,4 +1,6 @@
 
+import numpy as np
+
 from jamovi.core import ColumnType
 from jamovi.core import DataType
 from jamovi.core import MeasureType
@@ -62,23 +64,32 @@ def write(data, path, prog_cb, format):
             labels = map(lambda x: x[1], column.levels)
             rcol.add_level_labels(labels)
 
+    # the values are read a column at a time. factors are written as
+    # codes; the position of each value's level, counting from one
+
     for col_no in range(data.column_count):
         column = data[col_no]
-        if treat_as_factor(column):
-            if column.data_type == DataType.TEXT:
-                values = list(map(lambda x: x[1], column.levels))
-            else:
-                values = list(map(lambda x: x[0], column.levels))
-            for row_no in range(data.row_count):
-                value = column[row_no]
-                if value != '' and value != -2147483648:
-                    writer.insert_value(row_no, col_no, values.index(value) + 1)
-                else:
-                    writer.insert_value(row_no, col_no, -2147483648)
+        prog_cb(col_no / data.column_count)
+
+        if column.data_type is DataType.TEXT and column.measure_type is MeasureType.ID:
+            values = map(column.get_value, range(data.row_count))
         else:
-            for row_no in range(data.row_count):
-                value = column[row_no]
-                writer.insert_value(row_no, col_no, value)
+            if column.data_type is DataType.DECIMAL:
+                dtype = np.float64
+            else:
+                dtype = np.int32
+            values = np.frombuffer(column.read_range(0, data.row_count), dtype=dtype)
+            if treat_as_factor(column):
+                raws = np.array(list(map(lambda x: x[0], column.levels)), dtype=np.int32)
+                order = np.argsort(raws)
+                codes = np.full(len(values), -2147483648, dtype=np.int32)
+                present = values != -2147483648
+                codes[present] = order[np.searchsorted(raws, values[present], sorter=order)] + 1
+                values = codes
+            values = values.tolist()
+
+        for row_no, value in enumerate(values):
+            writer.insert_value(row_no, col_no, value)
 
     writer.close()
 
@@ -124,11 +135,13 @@ class Parser(RDataParser):
             column.append_level(0, 'FALSE')
 
         if data is not None:
-            for index, value in enumerate(data):
-                column.set_value(index, value)
-        else:
-            for index in range(count):
-                column.set_value(index, '')
+            # the column arrives whole, and is written whole
+            if column.data_type is DataType.DECIMAL:
+                values = np.asarray(data, dtype=np.float64)
+            else:
+                values = np.asarray(data, dtype=np.int32)
+            column.write_range(0, values[:count])
+        # otherwise the (empty) strings follow through handle_text_value()
 
         self._levels = [ ]
 
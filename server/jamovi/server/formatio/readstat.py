@@ -2,7 +2,8 @@
 from collections import OrderedDict
 from numbers import Number
 from datetime import date
-import math
+
+import numpy as np
 
 from jamovi.core import ColumnType
 from jamovi.core import DataType
@@ -35,11 +36,14 @@ def get_writers():
 def read(data, path, prog_cb, format):
     parser = Parser(data, prog_cb)
     parser.parse(path, format)
+    parser.flush()
     for column in data.dataset:
         column.determine_dps()
 
 
 TIME_START = date(1970, 1, 1)
+CHUNK_CELLS = 262144
+NaN = float('nan')
 
 
 class Parser(ReadStatParser):
@@ -54,6 +58,13 @@ class Parser(ReadStatParser):
         self._metadata = None
         self._labels = [ ]
 
+        # the values are collected a chunk of rows at a time, and written
+        # to the columns together
+        self._chunk_rows = 0
+        self._chunk_start = 0
+        self._chunk_end = 0
+        self._values = [ ]
+
     def handle_metadata(self, metadata):
         if metadata.row_count >= 0:  # negative values are possible here!
             self._data.set_row_count(metadata.row_count)
@@ -172,66 +183,107 @@ class Parser(ReadStatParser):
 
     def handle_value(self, var_index, row_index, value):
 
-        if row_index >= self._data.row_count:
-            self._data.set_row_count(row_index + 1)
+        if row_index >= self._chunk_start + self._chunk_rows:
+            self.flush()
+            if self._chunk_rows == 0:
+                self._chunk_rows = max(1, CHUNK_CELLS // self._data.column_count)
+            self._chunk_start = row_index - row_index % self._chunk_rows
+            self._values = list(map(
+                lambda i: [ None ] * self._chunk_rows,
+                range(self._data.column_count)))
+
+        self._values[var_index][row_index - self._chunk_start] = value
+        if row_index >= self._chunk_end:
+            self._chunk_end = row_index + 1
+
+    def flush(self):
+        # writes the values collected, a column at a time
+        if self._chunk_end <= self._chunk_start:
+            return
+
+        n = self._chunk_end - self._chunk_start
+
+        if self._chunk_end > self._data.row_count:
+            self._data.set_row_count(self._chunk_end)
         else:
-            if var_index == 0 and row_index % 100 == 0:
-                self._prog_cb(row_index / self._data.row_count)
+            self._prog_cb(self._chunk_end / self._data.row_count)
+
+        for var_index, values in enumerate(self._values):
+            column = self._data[var_index]
+            self._write_values(column, self._chunk_start, values[:n])
 
-        vt = type(value)
+        self._chunk_start = self._chunk_end
+        self._values = [ ]
 
-        column = self._data[var_index]
+    def _write_values(self, column, row_start, values):
 
         if column.data_type is DataType.TEXT:
-            if value is not None:
-                if vt is not str:
-                    value = str(value)
-                if column.has_levels:
-                    if not column.has_level(value):
-                        column.append_level(
-                            column.level_count,
-                            value,
-                            value)
-                    if column.level_count > 50:
-                        column.change(measure_type=MeasureType.ID)
-                column.set_value(row_index, value)
+            values = list(map(
+                lambda v: '' if v is None else (v if type(v) is str else str(v)),
+                values))
+            distinct = list(OrderedDict.fromkeys(values))
+            if '' in distinct:
+                distinct.remove('')
+
+            if column.has_levels:
+                new_levels = list(filter(
+                    lambda v: not column.has_level(v),
+                    distinct))
+                if column.level_count + len(new_levels) > 50:
+                    column.change(measure_type=MeasureType.ID)
+                else:
+                    for value in new_levels:
+                        column.append_level(column.level_count, value, value)
+
+            if column.has_levels:
+                lookup = dict(map(
+                    lambda v: (v, column.get_value_for_label(v)),
+                    distinct))
+                lookup[''] = -2147483648
+                raws = np.fromiter(map(lookup.__getitem__, values), dtype=np.int32, count=len(values))
+                column.write_range(row_start, raws)
             else:
-                column.set_value(row_index, '')
+                for i, value in enumerate(values):
+                    column.set_value(row_start + i, value)
+
+        elif column.data_type is DataType.DECIMAL:
+            floats = np.fromiter(
+                map(lambda v: float(v) if isinstance(v, Number) else NaN, values),
+                dtype=np.float64, count=len(values))
+            column.write_range(row_start, floats)
+
         elif (column.measure_type is MeasureType.NOMINAL
                 or column.measure_type is MeasureType.ORDINAL):
-            if isinstance(value, Number):
-                if not math.isclose(float(value) % 1.0, 0.0):
-                    column.change(data_type=DataType.DECIMAL)
-                    self.handle_value(var_index, row_index, value)
-                    return
-
-                try:
-                    value = int(value)
-                    if value.bit_length() > 32:
-                        raise Exception()
-                except Exception:
-                    column.change(
-                        data_type=DataType.DECIMAL,
-                        measure_type=MeasureType.CONTINUOUS)
-                column.set_value(row_index, value)
-            elif vt is date:
-                delta = value - TIME_START
-                ul_value = delta.days
-                if not column.has_level(ul_value):
-                    column.insert_level(ul_value, value.isoformat(), str(ul_value))
-                column.set_value(row_index, ul_value)
-            else:
-                column.set_value(row_index, -2147483648)
-        elif column.data_type is DataType.DECIMAL:
-            if isinstance(value, Number):
-                column.set_value(row_index, float(value))
-            else:
-                column.set_value(row_index, float('nan'))
+            raws = np.full(len(values), -2147483648, dtype=np.int32)
+            for i, value in enumerate(values):
+                if isinstance(value, Number):
+                    if float(value) % 1.0 != 0.0:
+                        column.change(data_type=DataType.DECIMAL)
+                        self._write_values(column, row_start, values)
+                        return
+                    try:
+                        value = int(value)
+                        if value.bit_length() > 32:
+                            raise Exception()
+                    except Exception:
+                        column.change(
+                            data_type=DataType.DECIMAL,
+                            measure_type=MeasureType.CONTINUOUS)
+                        self._write_values(column, row_start, values)
+                        return
+                    raws[i] = value
+                elif type(value) is date:
+                    ul_value = (value - TIME_START).days
+                    if not column.has_level(ul_value):
+                        column.insert_level(ul_value, value.isoformat(), str(ul_value))
+                    raws[i] = ul_value
+            column.write_range(row_start, raws)
+
         elif column.data_type is DataType.INTEGER:
-            if isinstance(value, Number):
-                column.set_value(row_index, int(value))
-            else:
-                column.set_value(row_index, -2147483648)
+            raws = np.fromiter(
+                map(lambda v: int(v) if isinstance(v, Number) else -2147483648, values),
+                dtype=np.int32, count=len(values))
+            column.write_range(row_start, raws)
 
 
 def write(data, path, prog_cb, format):
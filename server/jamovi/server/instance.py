@@ -26,6 +26,7 @@ from .modules import Modules
 from .instancemodel import InstanceModel
 from . import formatio
 from .modtracker import ModTracker
+from .resultscache import ResultsCache
 
 import posixpath
 import math
@@ -34,13 +35,20 @@ import logging
 import time
 import asyncio
 import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from itertools import islice
 
+import numpy as np
+
 from tempfile import NamedTemporaryFile
 from tempfile import mktemp
 
 from .utils import fs
 from .utils import is_int32
+from .utils import merge_ranges
+from .utils import pack_column
+from .utils import unpack_column
 
 log = logging.getLogger('jamovi')
 
@@ -72,8 +80,12 @@ class Instance:
         self._mm = None
         self._data = InstanceModel(self)
         self._coms = None
+        self._dataset_lock = asyncio.Lock()
+        self._loader = None
+        self._recycle_pending = False
 
         self._mod_tracker = ModTracker(self._data)
+        self._results_cache = ResultsCache(os.path.join(instance_path, 'cache'))
 
         self._inactive_since = None
 
@@ -100,6 +112,14 @@ class Instance:
     def session(self):
         return self._session
 
+    @property
+    def results_cache(self):
+        return self._results_cache
+
+    @property
+    def is_dataset_locked(self):
+        return self._dataset_lock.locked()
+
     @staticmethod
     def _normalise_path(path):
         nor_path = path
@@ -189,6 +209,8 @@ class Instance:
 
     def close(self):
         Modules.instance().remove_listener(self._module_event)
+        if self._loader is not None:
+            self._loader.cancel()
         if self._mm is not None:
             self._mm.close()
 
@@ -217,7 +239,7 @@ class Instance:
 
     async def on_request(self, request):
         if type(request) == jcoms.DataSetRR:
-            self._on_dataset(request)
+            await self._on_dataset(request)
         elif type(request) == jcoms.OpenRequest:
             await self._on_open(request)
         elif type(request) == jcoms.SaveRequest:
@@ -472,7 +494,10 @@ class Instance:
                     coms.send, None, self._instance_id, request,
                     complete=False, progress=(1000 * p, 1000)))
 
-        await ioloop.run_in_executor(None, formatio.write, self._data, path, prog_cb, content)
+        # the data set is read from another thread, so it mustn't change
+        async with self._dataset_lock:
+            self._data.load_columns()
+            await ioloop.run_in_executor(None, formatio.write, self._data, path, prog_cb, content)
 
         if not is_export:
             self._data.title = os.path.splitext(os.path.basename(path))[0]
@@ -518,6 +543,11 @@ class Instance:
             await self._on_import(request)
             return
 
+        async with self._dataset_lock:
+            await self._on_open_locked(request)
+
+    async def _on_open_locked(self, request):
+
         try:
             path = request.filePath
 
@@ -541,7 +571,12 @@ class Instance:
                         coms.send, None, self._instance_id, request,
                         complete=False, progress=(1000 * p, 1000)))
 
-            await ioloop.run_in_executor(None, formatio.read, self._data, norm_path, prog_cb, is_example)
+            await ioloop.run_in_executor(None, formatio.read, self._data, norm_path, prog_cb, is_example, True)
+
+            # the columns of .omv files are loaded on first access; the
+            # remainder are loaded in the background
+            self._loader = asyncio.ensure_future(
+                self._data.load_columns_async(self._dataset_lock))
 
             response = jcoms.OpenProgress()
             response.path = virt_path
@@ -570,6 +605,10 @@ class Instance:
                 old_mm.close()
 
     async def _on_import(self, request):
+        async with self._dataset_lock:
+            await self._on_import_locked(request)
+
+    async def _on_import_locked(self, request):
 
         if request.filePath != '':
             paths = [ request.filePath ]
@@ -592,37 +631,77 @@ class Instance:
                 self._paths = paths
                 self._i = 0
                 self._mm = None
+                self._buffer_path = None
+                self._pool = None
+                self._reads = [ None ] * len(paths)
+
+                # where there are several files, they're read concurrently
+                # in other processes, into memory maps of their own. .omv
+                # files are read here, as they bring along the instance's
+                # resources
+                parallel = list(filter(
+                    lambda i: os.path.splitext(paths[i])[1].lower() not in ('.omv', '.omt'),
+                    range(len(paths))))
+
+                if len(paths) > 1 and len(parallel) > 0:
+                    context = multiprocessing.get_context('spawn')
+                    n_workers = min(len(parallel), os.cpu_count() or 1)
+                    self._pool = ProcessPoolExecutor(n_workers, mp_context=context)
+                    for i in parallel:
+                        buffer_path = MultipleDataSets._new_buffer_path()
+                        norm_path = Instance._normalise_path(paths[i])
+                        future = self._pool.submit(formatio.read_to_buffer, norm_path, buffer_path)
+                        self._reads[i] = (buffer_path, asyncio.wrap_future(future))
+
+            def __del__(self):
+                self.close()
 
+            @staticmethod
+            def _new_buffer_path():
                 if os.name == 'nt':
-                    self._buffer_path = None
+                    return mktemp()
                 else:
-                    self._buffer_path = NamedTemporaryFile(delete=False).name
+                    return NamedTemporaryFile(delete=False).name
 
-            def __del__(self):
+            @staticmethod
+            def _del_buffer(buffer_path):
+                try:
+                    os.remove(buffer_path)
+                except Exception:
+                    pass
+
+            def _close_buffer(self):
                 if self._mm is not None:
                     self._mm.close()
-                self._del_buffer()
-
-            def _del_buffer(self):
+                    self._mm = None
                 if self._buffer_path is not None:
-                    try:
-                        os.remove(self._buffer_path)
-                    except Exception:
-                        pass
+                    MultipleDataSets._del_buffer(self._buffer_path)
                     self._buffer_path = None
 
+            def close(self):
+                self._close_buffer()
+                for i in range(self._i, len(self._reads)):
+                    if self._reads[i] is not None:
+                        buffer_path, future = self._reads[i]
+                        future.cancel()
+                        MultipleDataSets._del_buffer(buffer_path)
+                self._reads = [ ]
+                if self._pool is not None:
+                    self._pool.shutdown(wait=False)
+                    self._pool = None
+
             def __aiter__(self):
                 return self
 
             async def __anext__(self):
 
-                if os.name == 'nt':
-                    self._del_buffer()
-                    self._buffer_path = mktemp()
-
                 if self._i >= len(self._paths):
+                    self.close()
                     raise StopAsyncIteration()
 
+                # the previous data set has been copied from by now
+                self._close_buffer()
+
                 path = self._paths[self._i]
 
                 norm_path = Instance._normalise_path(path)
@@ -630,12 +709,6 @@ class Instance:
 
                 model = InstanceModel(instance)
 
-                if self._mm is not None:
-                    self._mm.close()
-
-                self._mm = MemoryMap.create(self._buffer_path, 4 * 1024 * 1024)
-                model.dataset = DataSet.create(self._mm)
-
                 ioloop = asyncio.get_event_loop()
 
                 def prog_cb(p):
@@ -644,13 +717,25 @@ class Instance:
                             coms.send, None, instance_id, request,
                             complete=False, progress=(1000 * (self._i + p) / n_files, 1000)))
 
-                await ioloop.run_in_executor(None, formatio.read, model, norm_path, prog_cb, False)
+                if self._reads[self._i] is not None:
+                    self._buffer_path, future = self._reads[self._i]
+                    used_size = await future
+                    self._mm = MemoryMap.attach(self._buffer_path, used_size)
+                    model.dataset = DataSet.retrieve(self._mm)
+                    model.setup()
+                    prog_cb(1)
+                else:
+                    self._buffer_path = MultipleDataSets._new_buffer_path()
+                    self._mm = MemoryMap.create(self._buffer_path, 4 * 1024 * 1024)
+                    model.dataset = DataSet.create(self._mm)
+                    await ioloop.run_in_executor(None, formatio.read, model, norm_path, prog_cb, False)
 
                 self._i += 1
                 return (name, model)
 
+        datasets = MultipleDataSets(paths)
+
         try:
-            datasets = MultipleDataSets(paths)
             await self._data.import_from(datasets, n_files > 1)
             self._mod_tracker.clear()
 
@@ -671,6 +756,7 @@ class Instance:
             self._coms.send_error(message, cause, self._instance_id, request)
 
         finally:
+            datasets.close()
             self._data.analyses.rerun()
 
     def _open_callback(self, task, progress):
@@ -806,11 +892,23 @@ class Instance:
                 n_block.rowCount = block.rowCount
                 n_block.columnCount = block.columnCount
 
-    def _on_dataset(self, request):
+    async def _on_dataset(self, request):
 
         if self._data is None:
             return
 
+        # recalculations yield to the event loop, so the data set
+        # operations are serialised
+        async with self._dataset_lock:
+            await self._on_dataset_locked(request)
+
+    async def _on_dataset_locked(self, request):
+
+        def prog_cb(p):
+            self._coms.send(
+                None, self._instance_id, request,
+                complete=False, progress=(1000 * p, 1000))
+
         try:
 
             response = jcoms.DataSetRR()
@@ -820,7 +918,7 @@ class Instance:
                 self._clone_cell_selections(request, response)
                 if request.noUndo is False:
                     self._mod_tracker.begin_event(request)
-                self._on_dataset_set(request, response)
+                await self._on_dataset_set(request, response, prog_cb)
                 if request.noUndo is False:
                     self._mod_tracker.end_event()
             elif request.op == jcoms.GetSet.Value('GET'):
@@ -831,13 +929,13 @@ class Instance:
                 undo_request = self._mod_tracker.begin_undo()
                 response.op = undo_request.op
                 self._clone_cell_selections(undo_request, response)
-                self._on_dataset_set(undo_request, response)
+                await self._on_dataset_set(undo_request, response, prog_cb)
                 self._mod_tracker.end_undo(response)
             elif request.op == jcoms.GetSet.Value('REDO'):
                 redo_request = self._mod_tracker.get_redo()
                 response.op = redo_request.op
                 self._clone_cell_selections(redo_request, response)
-                self._on_dataset_set(redo_request, response)
+                await self._on_dataset_set(redo_request, response, prog_cb)
             else:
                 raise ValueError()
 
@@ -928,20 +1026,21 @@ class Instance:
         else:
             log.error('_on_store_callback(): shouldnt get here')
 
-    def _on_dataset_set(self, request, response):
-        changes = { 'columns': set(), 'transforms': set(), 'deleted_columns': set(), 'deleted_transforms': set(), 'refresh': False, 'filters_changed': False }
+    async def _on_dataset_set(self, request, response, prog_cb=None):
+        changes = { 'columns': set(), 'transforms': set(), 'deleted_columns': set(), 'deleted_transforms': set(), 'data_changed': set(), 'refresh': False, 'filters_changed': False }
 
-        self._on_dataset_del_cols(request, response, changes)
+        await self._on_dataset_del_cols(request, response, changes, prog_cb)
         self._on_dataset_del_rows(request, response, changes)
-        self._on_dataset_ins_cols(request, response, changes)
+        await self._on_dataset_ins_cols(request, response, changes, prog_cb)
         self._on_dataset_ins_rows(request, response, changes)
-        self._on_dataset_mod_cols(request, response, changes)
+        await self._on_dataset_mod_cols(request, response, changes, prog_cb)
         if request.incData:
-            self._apply_cells(request, response, changes)
+            await self._apply_cells(request, response, changes, prog_cb)
 
         response.refresh = changes['refresh']
-        if changes['filters_changed']:
-            self._data.refresh_filter_state()
+
+        self._invalidate_analyses(changes)
+        self._recycle()
 
         self._populate_schema_info(request, response)
         # constuct response column schemas
@@ -964,6 +1063,49 @@ class Instance:
                 transform_schema = response.schema.transforms.add()
                 self._populate_transform_schema(transform, transform_schema)
 
+    def _recycle(self):
+        # the space released by deleted columns and rows is reused, but
+        # when much of the memory map is going unused, it's compacted.
+        # the engines read the memory map directly, so neither happens
+        # while they're running analyses of this instance; it's left
+        # until they're finished
+        if self._session.engines_busy(self):
+            self._recycle_pending = True
+            return
+
+        self._recycle_pending = False
+        self._mm.recycle()
+
+        released = self._mm.released_size
+        if released > max(self._mm.used_size // 2, 64 * 1024 * 1024):
+            self._data.compact()
+
+    def notify_engines_idle(self):
+        if self._recycle_pending:
+            asyncio.ensure_future(self._recycle_when_idle())
+
+    async def _recycle_when_idle(self):
+        # the columns move during compaction, so this waits for whatever
+        # is using the data set to finish
+        async with self._dataset_lock:
+            if self._recycle_pending and self._mm is not None:
+                self._recycle()
+
+    def _invalidate_analyses(self, changes):
+        # rerun the analyses using columns whose values have changed. a
+        # change to the filters affects every analysis. renames and
+        # deletions are handled by the client, which updates the options
+        if changes['filters_changed']:
+            data_changed = set(self._data)
+        else:
+            data_changed = set(changes['data_changed'])
+            for column in changes['data_changed']:
+                data_changed.update(column.dependents)
+        data_changed.difference_update(changes['deleted_columns'])
+
+        if len(data_changed) > 0:
+            self._data.analyses.invalidate(set(map(lambda column: column.name, data_changed)))
+
     def _on_dataset_get(self, request, response):
         if request.incSchema:
             self._populate_schema(request, response)
@@ -1002,8 +1144,9 @@ class Instance:
             # this is done so that the cell changes are sent back
             for column in self._data:
                 changes['columns'].add(column)
+                changes['data_changed'].add(column)
 
-    def _on_dataset_ins_cols(self, request, response, changes):
+    async def _on_dataset_ins_cols(self, request, response, changes, prog_cb=None):
         filter_inserted = False
         to_calc = set()
 
@@ -1082,10 +1225,7 @@ class Instance:
             column.set_needs_parse()
         for column in to_calc:
             column.parse_formula()
-        for column in to_calc:
-            column.set_needs_recalc()
-        for column in to_calc:
-            column.recalc()
+        await self._data.recalc_columns_async(to_calc, prog_cb)
 
         if filter_inserted:
             # we could do this, but a newly inserted filter is all 'true'
@@ -1105,7 +1245,10 @@ class Instance:
                     changes['columns'].add(column)
 
     def _on_dataset_del_rows(self, request, response, changes):
-        rows_removed = False
+        # the ranges are all deleted together, so the data set is only
+        # closed up, and recalculated, once
+        ranges = [ ]
+        row_count = self._data.row_count
         sorted_data = sorted(request.rows, key=lambda row_data: row_data.rowStart + row_data.rowCount - 1, reverse=True)
 
         for row_data in sorted_data:
@@ -1119,25 +1262,26 @@ class Instance:
                 self._mod_tracker.log_row_deletion(row_data)
                 row_start = row_data.rowStart
                 row_end = row_data.rowStart + row_data.rowCount - 1
-                if row_start >= self._data.row_count:
+                if row_start >= row_count:
                     continue
-                elif row_end >= self._data.row_count:
-                    row_end = self._data.row_count - 1
+                elif row_end >= row_count:
+                    row_end = row_count - 1
 
                 row_data_pb = response.rows.add()
                 row_data_pb.rowStart = row_start
                 row_data_pb.rowCount = row_end - row_start + 1
                 row_data_pb.action = jcoms.DataSetRR.RowData.RowDataAction.Value('REMOVE')
 
-                self._data.delete_rows(row_start, row_end)
-                rows_removed = True
+                ranges.append((row_start, row_end))
 
-        if rows_removed:
+        if ranges:
+            self._data.delete_row_ranges(ranges)
             changes['refresh'] = True
             for column in self._data:  # the column info needs sending back because the cell edit ranges have changed
                 changes['columns'].add(column)
+                changes['data_changed'].add(column)
 
-    def _on_dataset_del_cols(self, request, response, changes):
+    async def _on_dataset_del_cols(self, request, response, changes, prog_cb=None):
 
         request_schema_columns = []
         for column in request.schema.columns:
@@ -1207,10 +1351,7 @@ class Instance:
         else:
             to_recalc = to_reparse
 
-        for column in to_recalc:
-            column.set_needs_recalc()
-        for column in to_recalc:
-            column.recalc()
+        await self._data.recalc_columns_async(to_recalc, prog_cb)
 
         for column in to_delete:
             changes['deleted_columns'].add(column)
@@ -1318,7 +1459,7 @@ class Instance:
                         next_column_name = self._calc_column_name(check_column, old_name, transform_name)
                         self._apply_column_name(check_column, next_column_name, cols_changed, reparse)
 
-    def _on_dataset_mod_cols(self, request, response, changes):
+    async def _on_dataset_mod_cols(self, request, response, changes, prog_cb=None):
 
         if self._data.ex_filtered and self._data.has_filters:
             # some operations are forbidden when filtered rows are hidden/excluded
@@ -1343,6 +1484,8 @@ class Instance:
         # columns that need to be reparsed, and/or recalced
         reparse = set()
         recalc = set()
+        # columns whose values may have changed (unlike a rename)
+        data_changed = set()
 
         # the changes to be sent back to the client in the response
         cols_changed = set()
@@ -1382,6 +1525,7 @@ class Instance:
                     for column in self._data:
                         if column.transform == trans_id:
                             reparse.add(column)
+                            data_changed.add(column)
                 elif transform_name_changed:
                     for column in self._data:
                         if column.transform == trans_id:
@@ -1524,20 +1668,24 @@ class Instance:
 
                 # if these things haven't changed, no need
                 # to trigger recalcs
-                if (column.name == old_name
-                        and column.column_type == old_type
-                        and column.data_type == old_d_type
-                        and column.measure_type == old_m_type
-                        and column.formula == old_formula
-                        and column.filter_no == old_filter_no
-                        and column.levels == old_levels
-                        and column.active == old_active
-                        and column.trim_levels == old_trim
-                        and column.transform == old_transform
-                        and column.parent_id == old_parent_id):
+                values_unchanged = (
+                    column.column_type == old_type
+                    and column.data_type == old_d_type
+                    and column.measure_type == old_m_type
+                    and column.formula == old_formula
+                    and column.filter_no == old_filter_no
+                    and column.active == old_active
+                    and column.trim_levels == old_trim
+                    and column.transform == old_transform
+                    and column.parent_id == old_parent_id
+                    and column.levels == old_levels)
+
+                if column.name == old_name and values_unchanged:
                     continue
 
                 recalc.add(column)
+                if not values_unchanged:
+                    data_changed.add(column)
 
                 if column.formula != old_formula:
                     reparse.add(column)
@@ -1575,6 +1723,7 @@ class Instance:
                     if column.transform == trans_pb.id:
                         column.transform = 0
                         reparse.add(column)
+                        data_changed.add(column)
                         parent_name = ''
                         if column.parent_id > 0:
                             parent = self._data.get_column_by_id(column.parent_id)
@@ -1598,6 +1747,7 @@ class Instance:
                 trans.parse_formula()
                 if not trans.in_error:  # fixed
                     reparse.update(trans.dependents)
+                    data_changed.update(trans.dependents)
                     trans_changed.add(trans)
 
         # see if we can clear errors in other columns
@@ -1620,12 +1770,9 @@ class Instance:
                 recalc = self._data
                 break
 
-        for column in recalc:
-            column.set_needs_recalc()
-        for column in recalc:
-            column.recalc()
-            for dep in column.dependents:
-                dep.recalc()
+        # the dependents are recalculated too, as set_needs_recalc()
+        # propagates to them
+        await self._data.recalc_columns_async(recalc, prog_cb)
 
         cols_changed.update(recalc)
 
@@ -1640,6 +1787,7 @@ class Instance:
             changes['columns'].add(column)
         for transform in trans_changed:
             changes['transforms'].add(transform)
+        changes['data_changed'].update(data_changed)
 
     def _parse_cells(self, request):
 
@@ -1648,7 +1796,6 @@ class Instance:
             blocks = [None] * block_count
             bottom_most_row_index = -1
             right_most_column_index = -1
-            size = 0
 
             for i in range(block_count):
                 block_pb = request.data[i]
@@ -1663,13 +1810,11 @@ class Instance:
                         parser.feed(block_pb.cbHtml)
                         parser.close()
                         cells = parser.result()
-                        size += self._mod_tracker.get_size_of(block_pb.cbHtml)
                     else:
                         parser = CSVParser()
                         parser.feed(block_pb.cbText)
                         parser.close()
                         cells = parser.result()
-                        size += self._mod_tracker.get_size_of(block_pb.cbText)
 
                     block['row_count'] = 0
                     if (len(cells) > 0):
@@ -1690,7 +1835,12 @@ class Instance:
                     is_actually_clear = True
                     for c in range(col_count):
                         cells[c] = [None] * row_count
-                        if block_pb.clear is False:
+                        if block_pb.clear is False and len(block_pb.columns) > 0:
+                            column_pb = block_pb.columns[c]
+                            cells[c] = unpack_column(column_pb, row_count)
+                            if any(map(lambda v: v is not None, cells[c])):
+                                is_actually_clear = False
+                        elif block_pb.clear is False:
                             for r in range(row_count):
                                 cell_pb = block_pb.values[(c * row_count) + r]
                                 if cell_pb.HasField('o'):
@@ -1704,7 +1854,6 @@ class Instance:
                                 elif cell_pb.HasField('s'):
                                     cells[c][r] = cell_pb.s
                                     is_actually_clear = False
-                            size += self._mod_tracker.get_size_of(cells[c][r])
                     if is_actually_clear != block['clear']:
                         block['clear'] = is_actually_clear
 
@@ -1714,12 +1863,9 @@ class Instance:
                     if bottom_most_row_index < block_pb.rowStart + row_count - 1:
                         bottom_most_row_index = block_pb.rowStart + row_count - 1
                 else:
-                    size = 0
                     bottom_most_row_index = -1
                     right_most_column_index = -1
 
-            self._mod_tracker.log_space_used(size)
-
             return blocks, bottom_most_row_index, right_most_column_index
         else:
             return [ ], -1, -1
@@ -1750,7 +1896,7 @@ class Instance:
 
         return data
 
-    def _apply_cells(self, request, response, changes):
+    async def _apply_cells(self, request, response, changes, prog_cb=None):
 
         data, bottom_most_row_index, right_most_column_index = self._parse_cells(request)
 
@@ -1786,6 +1932,7 @@ class Instance:
         cols_changed = set()  # schema changes to send
         reparse = set()
         recalc = set()  # computed columns that need to update from these changes
+        recalc_rows = [ ]  # the rows that have changed, as (start, end) tuples
 
         n_cols_before = self._data.total_column_count
         n_rows_before = self._data.row_count
@@ -1992,8 +2139,10 @@ class Instance:
             if self._data.ex_filtered and self._data.has_filters:
                 for row_no in indices_map:
                     self._mod_tracker.set_cells_as_edited(column, row_no, row_no)
+                    recalc_rows.append((row_no, row_no + 1))
             else:
                 self._mod_tracker.set_cells_as_edited(column, row_start, row_start + row_count - 1)
+                recalc_rows.append((row_start, row_start + row_count))
 
             cols_changed.add(column)
 
@@ -2017,6 +2166,7 @@ class Instance:
                     filter_changed = True
 
         self._data.is_edited = True
+        changes['data_changed'].update(cols_changed)
 
         for i in range(n_cols_before, self._data.total_column_count):  # cols added
             column = self._data[i]
@@ -2035,10 +2185,15 @@ class Instance:
             column.set_needs_parse()
         for column in reparse:
             column.parse_formula()
-        for column in recalc:
-            column.set_needs_recalc()
-        for column in recalc:
-            column.recalc()
+        if n_rows_changed or reparse:
+            await self._data.recalc_columns_async(recalc, prog_cb)
+        else:
+            for column in recalc:
+                column.set_needs_recalc()
+            # only the edited rows of row-wise formulas need recalculating
+            recalc_rows = merge_ranges(recalc_rows)
+            for column in recalc:
+                column.recalc_rows(recalc_rows)
 
         if filter_changed or n_rows_changed:
             changes['filters_changed'] = True
@@ -2093,6 +2248,8 @@ class Instance:
 
     def _populate_cells(self, request, response):
 
+        response.packed = request.packed
+
         for block_pb in response.data:
             col_start = block_pb.columnStart
             row_start = block_pb.rowStart
@@ -2104,17 +2261,13 @@ class Instance:
             row_data.rowCount = row_count
             row_data.action = jcoms.DataSetRR.RowData.RowDataAction.Value('MODIFY')
 
-            row_nums = range(row_start, row_start + row_count)
-
             if not self._data.ex_filtered:
-                filtered = map(lambda row_no: self._data.is_row_filtered(row_no), row_nums)
-                filtered = map(lambda filtered: 1 if filtered else 0, filtered)
-                row_data.filterData = bytes(filtered)
+                filtered = self._data.filtered_rows(row_start, row_start + row_count)
+                row_data.filterData = filtered.astype(np.uint8).tobytes()
                 indices_map = list(range(row_start, row_start + row_count))
             else:
-                row_nums = map(lambda row_no: self._data.get_index_ex_filtered(row_no), row_nums)
-                row_data.rowNums[:] = row_nums
                 indices_map = self._data.get_indices_ex_filtered(row_start, row_count)
+                row_data.rowNums[:] = indices_map
 
             base_index = 0
             search_index = col_start
@@ -2128,7 +2281,11 @@ class Instance:
                 base_index = column.index + 1
                 search_index = 0
 
-                if column.data_type == DataType.DECIMAL:
+                if request.packed:
+                    # the column slice is sent as a packed array, rather
+                    # than as a message for each cell
+                    pack_column(column, indices_map, self._data.row_count, block_pb.columns.add())
+                elif column.data_type == DataType.DECIMAL:
                     for j in range(row_count):
                         cell = block_pb.values.add()
                         row_no = indices_map[j]
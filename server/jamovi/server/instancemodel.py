@@ -4,11 +4,15 @@ from .rowtracker import RowTracker
 from .column import Column
 from .analyses import Analyses
 from .utils import NullLog
+from .utils import merge_ranges
 from ..core import ColumnType
 from ..core import DataType
 from ..core import MeasureType
 
 import collections
+import asyncio
+
+import numpy as np
 
 
 class InstanceModel:
@@ -81,6 +85,20 @@ class InstanceModel:
     def get_indices_ex_filtered(self, row_start, row_count):
         return self._dataset.get_indices_ex_filtered(row_start, row_count)
 
+    def filtered_rows(self, start, end):
+        # a bool for each row, read from the filter mask in one pass.
+        # rows beyond the end of the data set aren't filtered
+        filtered = np.zeros(end - start, dtype=bool)
+        stop = min(end, self._dataset.row_count)
+        mask = self._dataset.filter_mask
+        if stop <= start or mask is None:
+            return filtered
+        mask = np.frombuffer(mask, dtype=np.uint8)[start // 8:(stop + 7) // 8]
+        included = np.unpackbits(mask, bitorder='little')
+        offset = start % 8
+        filtered[:stop - start] = included[offset:offset + stop - start] == 0
+        return filtered
+
     def __getitem__(self, index_or_name):
         if type(index_or_name) is int:
             index = index_or_name
@@ -249,13 +267,35 @@ class InstanceModel:
         return new_column
 
     def set_row_count(self, count):
+        self.load_columns()
         self._dataset.set_row_count(count)
 
+    def reserve(self, size):
+        # a hint of the space (in bytes) the data will need, so the
+        # memory map can grow once up front, rather than as it's filled
+        self._dataset.reserve(size)
+
+    def compact(self):
+        # moves the columns together, dropping the space released by
+        # deleted columns and rows. the columns move, so the wrappers
+        # are bound to them again
+        self._dataset.compact()
+        for column in self._columns:
+            if column._child is not None:
+                column._child = self._dataset[column.index]
+
     def delete_rows(self, start, end):
-        self._dataset.delete_rows(start, end)
+        self.delete_row_ranges([ (start, end) ])
+
+    def delete_row_ranges(self, ranges):
+        # deletes the (start, end) ranges together, with a single pass
+        # over the data, and a single recalc
+        self.load_columns()
+        self._dataset.delete_row_ranges(merge_ranges(ranges))
         self._recalc_all()
 
     def insert_rows(self, start, count):
+        self.load_columns()
         self._dataset.insert_rows(start, start + count - 1)
         self._recalc_all()
 
@@ -331,6 +371,11 @@ class InstanceModel:
         self._dataset.refresh_filter_state()
 
     def delete_columns(self, start, end):
+        # the space of the deleted columns is released, so the wrappers
+        # are detached from them (keeping their ids)
+        for column in self._columns[start:end + 1]:
+            column._id = column.id
+            column._child = None
         self._dataset.delete_columns(start, end)
         del self._columns[start:end + 1]
 
@@ -381,6 +426,14 @@ class InstanceModel:
                 data_type=DataType.TEXT,
                 measure_type=MeasureType.NOMINAL)
 
+        # the columns are matched on their import names (or names)
+        dest_columns_by_name = { }
+        for dest_column in self._columns:
+            dest_name = dest_column.import_name
+            if dest_name == '':
+                dest_name = dest_column.name
+            dest_columns_by_name.setdefault(dest_name, dest_column)
+
         try:
             async for (name, source) in sources:
 
@@ -397,19 +450,15 @@ class InstanceModel:
 
                     is_new_column = False
 
-                    for dest_column in self._columns:
-                        dest_name = dest_column.import_name
-                        if dest_name == '':
-                            dest_name = dest_column.name
-                        if dest_name == source_name:
-                            break
-                    else:
+                    dest_column = dest_columns_by_name.get(source_name)
+                    if dest_column is None:
                         dest_column = self.insert_column(
                             self.column_count,
                             source_column.name,
                             source_name)
                         is_new_column = True
                         dest_column.column_type = ColumnType.DATA
+                        dest_columns_by_name[source_name] = dest_column
 
                     if dest_column.column_type != ColumnType.DATA:
                         continue
@@ -450,18 +499,21 @@ class InstanceModel:
 
                 offset = self.row_count
 
-                # now copy the cell data across
+                # now copy the cell data across, a column at a time
                 self.set_row_count(offset + source.row_count)
 
                 for i in range(0, len(source_columns)):
-                    source_column = source_columns[i]
-                    dest_column = dest_columns[i]
-                    for row_no in range(source.row_count):
-                        dest_column.set_value(offset + row_no, source_column[row_no])
+                    InstanceModel._append_values(
+                        source_columns[i], dest_columns[i], offset, source.row_count)
 
-                if name_column is not None:
-                    for row_no in range(source.row_count):
-                        name_column.set_value(offset + row_no, name)
+                if name_column is not None and source.row_count > 0:
+                    if name_column.has_level(name):
+                        value = name_column.get_value_for_label(name)
+                    else:
+                        value = name_column.level_count
+                        name_column.append_level(value, name, '')
+                    values = np.full(source.row_count, value, dtype=np.int32)
+                    name_column.write_range(offset, values)
 
         finally:
             # now we can reparse everything
@@ -473,7 +525,7 @@ class InstanceModel:
                     column.parse_formula()
 
             # now recalculate everything
-            self._recalc_all()
+            await self.recalc_columns_async(self)
 
             for column in self:
                 if column.column_type == ColumnType.DATA:
@@ -486,6 +538,40 @@ class InstanceModel:
             # requires save
             self.is_edited = True
 
+    @staticmethod
+    def _append_values(source, dest, offset, row_count):
+        # the columns are alike (see import_from()), except text levels
+        # may have different values in each. these are matched on labels
+
+        if row_count == 0:
+            return
+
+        if dest.data_type is DataType.TEXT and dest.measure_type is MeasureType.ID:
+            for row_no in range(row_count):
+                dest.set_value(offset + row_no, source[row_no])
+            return
+
+        values = source.read_range(0, row_count)
+
+        if dest.data_type is DataType.TEXT:
+            levels = source.levels
+            raws = np.array([ -2147483648 ] + list(map(lambda level: level[0], levels)), dtype=np.int32)
+            mapped = np.empty(len(raws), dtype=np.int32)
+            mapped[0] = -2147483648
+            for i, level in enumerate(levels, 1):
+                label = level[1]
+                if dest.has_level(label):
+                    mapped[i] = dest.get_value_for_label(label)
+                else:
+                    value = dest.level_count
+                    dest.append_level(value, label, '')
+                    mapped[i] = value
+            order = np.argsort(raws)
+            values = np.frombuffer(values, dtype=np.int32)
+            values = mapped[order[np.searchsorted(raws, values, sorter=order)]]
+
+        dest.write_range(offset, values)
+
     def is_row_filtered(self, index):
         if index < self._dataset.row_count:
             return self._dataset.is_row_filtered(index)
@@ -777,13 +863,89 @@ class InstanceModel:
             wrapper.auto_measure = True
         self._add_virtual_columns()
 
-    def _recalc_all(self):
-        for column in self:
-            column.set_needs_recalc()
+    @property
+    def needs_load(self):
+        return any(map(lambda column: column.needs_load, self))
+
+    def load_columns(self):
         for column in self:
-            column.recalc()
+            column.load()
+
+    async def load_columns_async(self, lock):
+        # loads the columns not yet loaded, one per iteration of the
+        # event loop, until a different data set is opened. loading
+        # allocates in the memory map, so each is loaded holding the
+        # lock of the data set, which recalcs, saves, etc. hold too
+        dataset = self._dataset
+        for column in list(self):
+            if not column.needs_load:
+                continue
+            async with lock:
+                if self._dataset is not dataset:
+                    break
+                column.load()
+            await asyncio.sleep(0)
+
+    def _recalc_all(self):
+        self.recalc_columns(self)
         self.refresh_filter_state()
 
+    def recalc_columns(self, columns):
+        for wave in self._recalc_waves(columns):
+            for column in wave:
+                column.recalc()
+
+    async def recalc_columns_async(self, columns, prog_cb=None):
+        # the columns of each wave are evaluated concurrently in the
+        # executor, leaving the event loop free. the results are applied
+        # back on the event loop, as the data set is not thread safe.
+        # the caller holds the lock of the data set, so nothing else
+        # (i.e. loading a column) can move the memory map in the meantime
+        ioloop = asyncio.get_event_loop()
+        waves = self._recalc_waves(columns)
+        n_columns = sum(map(len, waves))
+        n_done = 0
+
+        for wave in waves:
+            # columns are loaded here, as loading isn't thread safe
+            for column in wave:
+                for dependency in column.dependencies:
+                    dependency.load()
+            evaluations = await asyncio.gather(*map(
+                lambda column: ioloop.run_in_executor(None, column.evaluate),
+                wave))
+            for column, evaluation in zip(wave, evaluations):
+                column.commit(evaluation)
+
+            n_done += len(wave)
+            if prog_cb is not None:
+                prog_cb(n_done / n_columns)
+
+    def _recalc_waves(self, columns):
+        # groups the columns needing recalculation into waves, where the
+        # columns of each wave depend only on columns in earlier waves
+
+        for column in columns:
+            column.set_needs_recalc()
+
+        pending = list(filter(lambda column: column.needs_recalc, self))
+        depths = { }
+
+        def depth(column):
+            if column not in depths:
+                deps = filter(lambda dep: dep.needs_recalc, column.dependencies)
+                depths[column] = 1 + max(map(depth, deps), default=-1)
+            return depths[column]
+
+        waves = [ ]
+        for column in pending:
+            d = depth(column)
+            while len(waves) <= d:
+                waves.append([ ])
+            waves[d].append(column)
+
+        return waves
+
     def _print_column_info(self):
         for column in self:
             if column.has_deps:
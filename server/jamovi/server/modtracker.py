@@ -1,10 +1,7 @@
 
 from jamovi.core import ColumnType
-from jamovi.core import DataType
-import math
-import sys
-
 from . import jamovi_pb2 as jcoms
+from .utils import pack_column
 
 
 class ModTracker:
@@ -22,7 +19,6 @@ class ModTracker:
         self._suspend_cell_tracking = False
         self._event_data = None
         self._event = None
-        self._logged_space_used = 0
 
     def clear(self):
         self._history = []
@@ -33,7 +29,6 @@ class ModTracker:
         self._suspend_cell_tracking = False
         self._event_data = None
         self._event = None
-        self._logged_space_used = 0
 
     @property
     def count(self):
@@ -62,13 +57,9 @@ class ModTracker:
     def begin_event(self, event):
         self._active = True
         self._event = event
-        self._logged_space_used = 0
 
         self._create_undo_event_data(event)
 
-    def get_size_of(self, obj):
-        return sys.getsizeof(obj)
-
     def end_event(self):
         if self._pos < len(self._history) - 1:
             self._history = self._history[0:(self._pos + 1)]
@@ -76,7 +67,7 @@ class ModTracker:
         if len(self._history) == 0:
             event_data = { 'redo': self._event }
             self._history.append(event_data)
-            event_data['space_used'] = sys.getsizeof(self._event)
+            event_data['space_used'] = 0
             self._pos = 0
         else:
             event_data = self._history[len(self._history) - 1]
@@ -85,15 +76,15 @@ class ModTracker:
         self._history.append(self._event_data)
         self._pos = self._pos + 1
 
-        last_size = 0
-        if self._pos > 0:
-            prev_event_data = self._history[self._pos - 1]
-            prev_event_data['space_used'] += self._logged_space_used
-            last_size = prev_event_data['space_used']
+        # space_used is the running total of the serialised sizes of the
+        # redo and undo events
+        prev_event_data = self._history[self._pos - 1]
+        prev_event_data['space_used'] += self._event.ByteSize()
+        last_size = prev_event_data['space_used']
 
         event_data = self._history[self._pos]
 
-        event_data['space_used'] = last_size + event_data['space_used']
+        event_data['space_used'] = last_size + event_data['undo'].ByteSize()
 
         make_space = event_data['space_used'] - ModTracker.MAX_SPACE_AVALIABLE
         if make_space > 0:
@@ -107,10 +98,9 @@ class ModTracker:
                     start = i
                     offset = data['space_used']
 
-            if start == 0:
-                self._history = []
-            else:
-                self._history = self._history[start + 1:(len(self._history))]
+            # the events up to and including start are dropped. (the
+            # first event remaining is only used for its redo)
+            self._history = self._history[start + 1:(len(self._history))]
 
             if len(self._history) > ModTracker.MAX_HISTORY_LENGTH:
                 self._history = self._history[-ModTracker.MAX_HISTORY_LENGTH:]
@@ -243,10 +233,6 @@ class ModTracker:
 
         self._event_data = data
 
-    def log_space_used(self, size):
-        if self._active:
-            self._logged_space_used += size
-
     def log_filters_visible_change(self, oldValue):
         if self._active:
             new_event = self._event_data['undo']
@@ -450,6 +436,8 @@ class ModTracker:
             column.cell_tracker.set_cells_as_edited(row_start, row_end)
 
     def _populate_data(self, block_pb):
+        # the values are stored as compressed, packed arrays; the size of
+        # these is the exact number of bytes used
         col_start = block_pb.columnStart
         row_start = block_pb.rowStart
         row_count = block_pb.rowCount
@@ -458,11 +446,9 @@ class ModTracker:
         search_index = col_start
         is_clear = True
         size = 0
-        end_redo = False
-        for cc in range(col_count):
-            if end_redo:
-                break
+        indices = range(row_start, row_start + row_count)
 
+        for cc in range(col_count):
             column = self._data.get_column(search_index, base_index, True)
 
             if column is None:
@@ -471,66 +457,19 @@ class ModTracker:
             base_index = column.index + 1
             search_index = 0
 
-            if column.data_type == DataType.DECIMAL:
-                for r in range(row_start, row_start + row_count):
-                    cell = block_pb.values.add()
-                    if r >= column.row_count:
-                        cell.o = jcoms.SpecialValues.Value('MISSING')
-                        size += sys.getsizeof(cell.o)
-                    else:
-                        value = column[r]
-                        if math.isnan(value):
-                            cell.o = jcoms.SpecialValues.Value('MISSING')
-                            size += sys.getsizeof(cell.o)
-                        else:
-                            cell.d = value
-                            size += sys.getsizeof(cell.d)
-                            is_clear = False
-                    if is_clear is False and size > ModTracker.MAX_SPACE_AVALIABLE:
-                        end_redo = True
-                        break
-            elif column.data_type == DataType.TEXT:
-                for r in range(row_start, row_start + row_count):
-                    cell = block_pb.values.add()
-                    if r >= column.row_count:
-                        cell.o = jcoms.SpecialValues.Value('MISSING')
-                        size += sys.getsizeof(cell.o)
-                    else:
-                        value = column[r]
-                        if value == '':
-                            cell.o = jcoms.SpecialValues.Value('MISSING')
-                            size += sys.getsizeof(cell.o)
-                        else:
-                            cell.s = value
-                            size += sys.getsizeof(cell.s)
-                            is_clear = False
-                    if is_clear is False and size > ModTracker.MAX_SPACE_AVALIABLE:
-                        end_redo = True
-                        break
-            else:
-                for r in range(row_start, row_start + row_count):
-                    cell = block_pb.values.add()
-                    if r >= column.row_count:
-                        cell.o = jcoms.SpecialValues.Value('MISSING')
-                        size += sys.getsizeof(cell.o)
-                    else:
-                        value = column[r]
-                        if value == -2147483648:
-                            cell.o = jcoms.SpecialValues.Value('MISSING')
-                            size += sys.getsizeof(cell.o)
-                        else:
-                            cell.i = value
-                            is_clear = False
-                            size += sys.getsizeof(cell.i)
-                    if is_clear is False and size > ModTracker.MAX_SPACE_AVALIABLE:
-                        end_redo = True
-                        break
+            column_pb = block_pb.columns.add()
+            if pack_column(column, indices, column.row_count, column_pb, compress=True) > 0:
+                is_clear = False
+            size += column_pb.ByteSize()
+
+            if is_clear is False and size > ModTracker.MAX_SPACE_AVALIABLE:
+                self._active = False
+                break
+
         if is_clear:
             block_pb.clear = True
             size = 0
-            del block_pb.values[:]
-        elif end_redo:
-            self._active = False
+            del block_pb.columns[:]
 
         return size
 
@@ -70,18 +70,18 @@ class Options:
             dest_pb.o = AnalysisOption.Other.Value('TRUE')
         elif value is False:
             dest_pb.o = AnalysisOption.Other.Value('FALSE')
-        elif type(value) == str:
+        elif isinstance(value, str):
             dest_pb.s = value
-        elif type(value) == int:
+        elif isinstance(value, int):
             dest_pb.i = value
-        elif type(value) == float:
+        elif isinstance(value, float):
             dest_pb.d = value
-        elif type(value) == list:
+        elif isinstance(value, list):
             dest_pb.c.hasNames = False
             for v in value:
                 child_pb = dest_pb.c.options.add()
                 Options._populate_pb(child_pb, v)
-        elif type(value) == dict:
+        elif isinstance(value, dict):
             dest_pb.c.hasNames = True
             for k, v in value.items():
                 dest_pb.c.names.append(k)
@@ -149,6 +149,24 @@ class Options:
             else:
                 i += 1
 
+    def get_using(self):
+        # the string values of the (non-results) options; this is a
+        # superset of the names of the columns the analysis uses
+        using = set()
+        for name, option_pb in zip(self._pb.names, self._pb.options):
+            if not name.startswith('results/'):
+                Options._collect_strings(option_pb, using)
+        return using
+
+    @staticmethod
+    def _collect_strings(pb, strings):
+        typ = pb.WhichOneof('type')
+        if typ == 's':
+            strings.add(pb.s)
+        elif typ == 'c':
+            for child_pb in pb.c.options:
+                Options._collect_strings(child_pb, strings)
+
     @staticmethod
     def _get_option_pb(pb, name):
         for i in range(len(pb.names)):
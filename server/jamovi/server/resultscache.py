@@ -0,0 +1,147 @@
+
+# caches the results of analyses, keyed on the analysis, its options
+# and the data it uses, so returning to an earlier state (undoing, or
+# toggling an option back) needn't run the analysis again. the most
+# recently used results are kept in memory, the rest on disk
+
+import os
+import os.path
+from collections import OrderedDict
+from hashlib import blake2b
+import logging
+
+from . import jamovi_pb2 as jcoms
+
+log = logging.getLogger('jamovi')
+
+
+class ResultsCache:
+
+    MEMORY_LIMIT = 16 * 1024 * 1024
+    DISK_LIMIT = 128 * 1024 * 1024
+
+    def __init__(self, path):
+        self._path = path
+        self._memory = OrderedDict()
+        self._memory_used = 0
+        self._disk = None  # the sizes of the files, least recent first
+        self._disk_used = 0
+
+    def key(self, analysis):
+        # the filter columns are included, as they determine the rows
+        # the analysis uses
+        dataset = analysis.dataset
+        hasher = blake2b(digest_size=20)
+        hasher.update(analysis.ns.encode('utf-8') + b'\0')
+        hasher.update(analysis.name.encode('utf-8') + b'\0')
+        hasher.update(analysis.options.as_bytes())
+        hasher.update(str(dataset.row_count).encode('utf-8'))
+
+        using = analysis.options.get_using()
+        for column in dataset:
+            if column.is_filter or column.name in using:
+                ResultsCache._hash_column(hasher, column)
+
+        return hasher.hexdigest()
+
+    @staticmethod
+    def _hash_column(hasher, column):
+        # the content hash covers the values, levels and types
+        hasher.update(repr((
+            column.name,
+            column.active,
+            column.content_hash())).encode('utf-8'))
+
+    def get(self, key):
+        content = self._memory.get(key)
+        if content is not None:
+            self._memory.move_to_end(key)
+        else:
+            content = self._read(key)
+            if content is None:
+                return None
+            self._remember(key, content)
+
+        results = jcoms.AnalysisResponse()
+        results.ParseFromString(content)
+        return results
+
+    def put(self, key, results):
+        content = results.SerializeToString()
+        self._remember(key, content)
+        self._write(key, content)
+
+    def _remember(self, key, content):
+        if len(content) > ResultsCache.MEMORY_LIMIT:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_used -= len(old)
+        self._memory[key] = content
+        self._memory_used += len(content)
+        while self._memory_used > ResultsCache.MEMORY_LIMIT:
+            key, content = self._memory.popitem(last=False)
+            self._memory_used -= len(content)
+
+    def _scan(self):
+        # the files left from earlier in the session, oldest first
+        self._disk = OrderedDict()
+        self._disk_used = 0
+        try:
+            os.makedirs(self._path, exist_ok=True)
+            entries = list(os.scandir(self._path))
+        except OSError as e:
+            log.exception(e)
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries:
+            if entry.name.endswith('.tmp'):
+                continue
+            size = entry.stat().st_size
+            self._disk[entry.name] = size
+            self._disk_used += size
+
+    def _read(self, key):
+        if self._disk is None:
+            self._scan()
+        if key not in self._disk:
+            return None
+        path = os.path.join(self._path, key)
+        try:
+            with open(path, 'rb') as file:
+                content = file.read()
+            os.utime(path)
+        except OSError as e:
+            log.exception(e)
+            self._disk_used -= self._disk.pop(key)
+            return None
+        self._disk.move_to_end(key)
+        return content
+
+    def _write(self, key, content):
+        if self._disk is None:
+            self._scan()
+        if len(content) > ResultsCache.DISK_LIMIT:
+            return
+
+        path = os.path.join(self._path, key)
+        temp_path = path + '.tmp'
+        try:
+            with open(temp_path, 'wb') as file:
+                file.write(content)
+            os.replace(temp_path, path)
+        except OSError as e:
+            log.exception(e)
+            return
+
+        self._disk_used -= self._disk.pop(key, 0)
+        self._disk[key] = len(content)
+        self._disk_used += len(content)
+
+        while self._disk_used > ResultsCache.DISK_LIMIT:
+            key, size = self._disk.popitem(last=False)
+            self._disk_used -= size
+            try:
+                os.remove(os.path.join(self._path, key))
+            except OSError as e:
+                log.exception(e)
@@ -25,6 +25,10 @@ class SessionAnalyses:
         all_analyses = chain.from_iterable(all_analyses)
         return all_analyses.__iter__()
 
+    def __contains__(self, analysis):
+        instance = self._session.get(analysis.instance.id)
+        return instance is not None and instance.analyses.get(analysis.id) is analysis
+
     def get(self, analysis_id, instance_id=None):
         for analysis in self:
             if analysis_id == analysis.id:
@@ -89,6 +93,9 @@ class Session(dict):
     async def restart_engines(self):
         await self._em.restart_engines()
 
+    def engines_busy(self, instance):
+        return self._em.is_busy(instance)
+
     def rerun_analyses(self):
         for analysis in self._analyses:
             analysis.rerun()
@@ -99,6 +106,8 @@ class Session(dict):
             cause = event.get('cause', '')
             for instance in self.values():
                 instance.terminate(message, cause)
+        elif event['type'] == 'idle':
+            event['instance'].notify_engines_idle()
 
     def add_options_changed_listener(self, listener):
         self._analysis_listeners.append(listener)
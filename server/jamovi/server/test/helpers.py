@@ -0,0 +1,138 @@
+import os.path
+import asyncio
+import logging
+import tempfile
+
+from jamovi.core import MemoryMap
+from jamovi.core import DataSet
+from jamovi.server import jamovi_pb2 as jcoms
+from jamovi.server.instance import Instance
+from jamovi.server.instancemodel import InstanceModel
+
+
+log = logging.getLogger(__name__)
+
+
+class TempDataSets:
+
+    # creates data sets for the tests, each in its own memory map, in a
+    # temporary directory. close() closes the memory maps and removes the
+    # directory
+
+    def __init__(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.path = self._temp_dir.name
+        self._mms = [ ]
+
+    def create_memory_map(self):
+        buffer_path = os.path.join(self.path, 'buffer{}'.format(len(self._mms)))
+        mm = MemoryMap.create(buffer_path, 65536)
+        self._mms.append(mm)
+        return mm
+
+    def create_dataset(self):
+        return DataSet.create(self.create_memory_map())
+
+    def create(self, log=log, instance=None):
+        data = InstanceModel(instance)
+        data.set_log(log)
+        data.dataset = self.create_dataset()
+        return data
+
+    def close(self):
+        for mm in self._mms:
+            mm.close()
+        self._temp_dir.cleanup()
+
+
+def dump(data):
+    # the columns of an InstanceModel (or a DataSet) for comparing, with
+    # nans as 'nan' (as nan != nan)
+    columns = [ ]
+    for column in data:
+        values = [ column.get_value(row_no) for row_no in range(data.row_count) ]
+        values = [ 'nan' if isinstance(v, float) and v != v else v for v in values ]
+        columns.append((
+            column.name,
+            column.data_type,
+            column.measure_type,
+            column.levels,
+            column.dps,
+            values))
+    return columns
+
+
+class Coms:
+
+    # in place of the client connection, records what's sent
+
+    def __init__(self):
+        self.sent = [ ]
+        self.errors = [ ]
+
+    def send(self, message=None, instance_id=None, response_to=None, complete=True, progress=(0, 0)):
+        if complete:
+            self.sent.append(message)
+
+    def send_error(self, message=None, cause=None, instance_id=None, response_to=None):
+        self.errors.append((message, cause))
+
+    def add_close_listener(self, listener):
+        pass
+
+    def remove_close_listener(self, listener):
+        pass
+
+
+class Session:
+
+    # in place of the session; without engines
+
+    id = 'session'
+
+    def __init__(self):
+        self.busy = False
+
+    def engines_busy(self, instance):
+        return self.busy
+
+
+class TempInstance:
+
+    # an instance in a temporary directory, with its own event loop.
+    # request() performs a request, as from the client, and returns the
+    # response
+
+    def __init__(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        self.session = Session()
+        self.coms = Coms()
+        instance_path = os.path.join(self._temp_dir.name, 'instance')
+        self.instance = Instance(self.session, instance_path, 'instance')
+        self.instance.set_coms(self.coms)
+
+    @property
+    def data(self):
+        return self.instance._data
+
+    def request(self, request):
+        self.coms.errors.clear()
+        self.loop.run_until_complete(self.instance.on_request(request))
+        if len(self.coms.errors) > 0:
+            raise RuntimeError(self.coms.errors[0])
+        return self.coms.sent[-1]
+
+    def open(self, path=''):
+        request = jcoms.OpenRequest()
+        request.filePath = path
+        return self.request(request)
+
+    def close(self):
+        self.instance.close()
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        self._temp_dir.cleanup()
@@ -0,0 +1,120 @@
+import unittest
+
+from jamovi.server import jamovi_pb2 as jcoms
+from jamovi.server.analyses import Analysis
+from jamovi.server.options import Options
+
+from .helpers import TempInstance
+
+
+class TestInvalidate(unittest.TestCase):
+
+    def setUp(self):
+        self._temp = TempInstance()
+        self._temp.open()
+        self._paste('1\t0.5\tx\n2\t1.5\ty\n3\t2.5\tx')
+
+        self._notified = [ ]
+        analyses = self._temp.data.analyses
+        analyses.add_options_changed_listener(self._notified.append)
+
+    def tearDown(self):
+        self._temp.close()
+
+    def _paste(self, text):
+        request = jcoms.DataSetRR()
+        request.op = jcoms.GetSet.Value('SET')
+        request.incData = True
+        block_pb = request.data.add()
+        block_pb.rowStart = 0
+        block_pb.columnStart = 0
+        block_pb.rowCount = 3
+        block_pb.columnCount = 3
+        block_pb.incCBData = True
+        block_pb.cbText = text
+        self._temp.request(request)
+
+    def _options(self, **values):
+        options_pb = jcoms.AnalysisOptions()
+        options_pb.hasNames = True
+        for name, value in values.items():
+            options_pb.names.append(name)
+            Options._populate_pb(options_pb.options.add(), value)
+        return options_pb
+
+    def _create(self, id, options_pb):
+        # the module doesn't exist, so the options are set here
+        analyses = self._temp.data.analyses
+        analysis = analyses.create(id, 'name', 'ns', options_pb)
+        analysis.options = Options.create([ ], { })
+        analysis.options.set(options_pb)
+        analysis.status = Analysis.Status.COMPLETE
+        return analysis
+
+    def _modify(self, column_name, **attrs):
+        # modifies a column's schema, as the client does
+        column = self._temp.data[column_name]
+        request = jcoms.DataSetRR()
+        request.op = jcoms.GetSet.Value('SET')
+        request.incSchema = True
+        column_pb = request.schema.columns.add()
+        self._temp.instance._populate_column_schema(column, column_pb)
+        column_pb.action = jcoms.DataSetSchema.ColumnSchema.Action.Value('MODIFY')
+        for key, value in attrs.items():
+            setattr(column_pb, key, value)
+        return column_pb, request
+
+    def test_get_using(self):
+        options_pb = self._options(
+            vars=[ 'A', 'C' ],
+            group='B',
+            nested={ 'x': [ 'D' ], 'n': 3 },
+            flag=True)
+        options_pb.names.append('results/B')
+        Options._populate_pb(options_pb.options.add(), 'E')
+        analysis = self._create(1, options_pb)
+        self.assertEqual(analysis.options.get_using(), { 'A', 'B', 'C', 'D' })
+
+    def test_invalidate(self):
+        using_a = self._create(1, self._options(vars=[ 'A' ]))
+        using_c = self._create(2, self._options(vars=[ 'B', 'C' ]))
+        disabled = self._create(3, self._options(vars=[ 'C' ]))
+        disabled.enabled = False
+
+        self._temp.data.analyses.invalidate({ 'C', 'Z' })
+
+        self.assertEqual(self._notified, [ using_c ])
+        self.assertEqual(using_c.changes, { 'C' })
+        self.assertEqual(using_c.revision, 1)
+        self.assertIs(using_c.status, Analysis.Status.NONE)
+        for analysis in (using_a, disabled):
+            self.assertEqual(analysis.revision, 0)
+            self.assertIs(analysis.status, Analysis.Status.COMPLETE)
+
+    def test_rename_level(self):
+        using_a = self._create(1, self._options(vars=[ 'A' ]))
+        using_c = self._create(2, self._options(vars=[ 'C' ]))
+
+        column_pb, request = self._modify('C')
+        column_pb.levels[0].label = 'renamed'
+        self._temp.request(request)
+
+        # the data the analysis receives has changed
+        self.assertEqual(self._temp.data['C'].get_value(0), 'renamed')
+        self.assertEqual(self._notified, [ using_c ])
+        self.assertEqual(using_c.changes, { 'C' })
+        self.assertEqual(using_a.revision, 0)
+
+    def test_rename_column(self):
+        using_c = self._create(1, self._options(vars=[ 'C' ]))
+
+        # the client updates the options of the analyses
+        column_pb, request = self._modify('C', name='D')
+        self._temp.request(request)
+
+        self.assertEqual(self._notified, [ ])
+        self.assertEqual(using_c.revision, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
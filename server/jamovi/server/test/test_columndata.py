@@ -0,0 +1,127 @@
+import unittest
+
+import random
+
+from jamovi.core import DataType
+from jamovi.core import MeasureType
+from jamovi.server import jamovi_pb2 as jcoms
+from jamovi.server.utils import pack_column
+from jamovi.server.utils import unpack_column
+
+from .helpers import TempDataSets
+
+
+N_ROWS = 1000
+
+
+class TestColumnData(unittest.TestCase):
+
+    def setUp(self):
+        self._datasets = TempDataSets()
+        self._ds = self._datasets.create_dataset()
+
+        columns = [
+            ('a', DataType.DECIMAL, MeasureType.CONTINUOUS),
+            ('b', DataType.INTEGER, MeasureType.NOMINAL),
+            ('t', DataType.TEXT, MeasureType.NOMINAL),
+            ('s', DataType.TEXT, MeasureType.ID),
+            ('r', DataType.INTEGER, MeasureType.CONTINUOUS),
+        ]
+        for name, data_type, measure_type in columns:
+            column = self._ds.append_column(name)
+            column.set_data_type(data_type)
+            column.set_measure_type(measure_type)
+        self._ds.set_row_count(N_ROWS)
+
+        rand = random.Random(1)
+        for row_no in range(N_ROWS):
+            self._ds['a'].set_value(row_no, rand.choice([ float('nan'), -0.5, rand.random() ]))
+            self._ds['b'].set_value(row_no, rand.choice([ -2147483648, 1, 5 ]), True)
+            self._ds['t'].set_value(row_no, rand.choice([ '', 'x', 'ÿ', 'z z' ]), True)
+            self._ds['s'].set_value(row_no, rand.choice([ '', 'ünï{}'.format(row_no) ]), True)
+            self._ds['r'].set_value(row_no, rand.randint(-2 ** 31 + 1, 2 ** 31 - 1))
+
+    def tearDown(self):
+        self._datasets.close()
+
+    def _expected(self, column, indices, row_count):
+        # the values as unpacked; None where missing
+        values = [ ]
+        for row_no in indices:
+            value = column.get_value(row_no) if row_no < row_count else None
+            if value == '' or value == -2147483648 or value != value:
+                value = None
+            values.append(value)
+        return values
+
+    def _round_trip(self, column, indices, row_count, compress=False):
+        column_pb = jcoms.DataSetRR.ColumnData()
+        count = pack_column(column, indices, row_count, column_pb, compress)
+        values = unpack_column(column_pb, len(indices))
+        return values, count, column_pb
+
+    def test_round_trip(self):
+        rand = random.Random(2)
+        blocks = [
+            list(range(N_ROWS)),                        # contiguous
+            list(range(100, 300)),
+            sorted(rand.sample(range(N_ROWS), 300)),    # scattered
+            [ 5, 3, 999, 0 ],
+            list(range(N_ROWS - 10, N_ROWS + 10)),      # beyond the end
+            [ ],
+        ]
+        for column in self._ds:
+            for indices in blocks:
+                expected = self._expected(column, indices, N_ROWS)
+                values, count, column_pb = self._round_trip(column, indices, N_ROWS)
+                self.assertEqual(values, expected, column.name)
+                self.assertEqual(count, len(expected) - expected.count(None), column.name)
+                self.assertFalse(column_pb.compressed)
+
+    def test_types(self):
+        ColumnDataType = jcoms.DataSetRR.ColumnData.ColumnDataType
+        indices = list(range(N_ROWS))
+        types = {
+            'a': ColumnDataType.Value('DECIMAL'),
+            'b': ColumnDataType.Value('INTEGER'),
+            'r': ColumnDataType.Value('INTEGER'),
+            't': ColumnDataType.Value('TEXT'),
+            's': ColumnDataType.Value('TEXT'),
+        }
+        for column in self._ds:
+            values, count, column_pb = self._round_trip(column, indices, N_ROWS)
+            self.assertEqual(column_pb.type, types[column.name], column.name)
+
+        # text levels are sent as their labels
+        values, count, column_pb = self._round_trip(self._ds['t'], indices, N_ROWS)
+        self.assertEqual(set(values), { None, 'x', 'ÿ', 'z z' })
+
+    def test_row_count(self):
+        # rows at and beyond the row count are missing
+        column = self._ds['r']
+        values, count, column_pb = self._round_trip(column, list(range(20)), 10)
+        self.assertEqual(values[10:], [ None ] * 10)
+        self.assertEqual(values[:10], list(map(column.get_value, range(10))))
+        self.assertEqual(count, 10)
+
+    def test_compressed(self):
+        indices = list(range(N_ROWS))
+        for column in self._ds:
+            expected = self._expected(column, indices, N_ROWS)
+            values, count, column_pb = self._round_trip(column, indices, N_ROWS, compress=True)
+            self.assertEqual(values, expected, column.name)
+
+        # compressed where that's smaller ...
+        column = self._ds['b']
+        values, count, column_pb = self._round_trip(column, indices, N_ROWS, compress=True)
+        self.assertTrue(column_pb.compressed)
+        self.assertLess(len(column_pb.values), N_ROWS * 4)
+
+        # ... but not otherwise
+        values, count, column_pb = self._round_trip(self._ds['r'], [ 7 ], N_ROWS, compress=True)
+        self.assertFalse(column_pb.compressed)
+        self.assertEqual(values, [ self._ds['r'].get_value(7) ])
+
+
+if __name__ == '__main__':
+    unittest.main()
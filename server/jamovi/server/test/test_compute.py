@@ -0,0 +1,226 @@
+import unittest
+from unittest import mock
+
+import math
+import random
+import asyncio
+import logging
+
+from jamovi.core import DataType
+from jamovi.core import MeasureType
+from jamovi.core import ColumnType
+from jamovi.server.utils import merge_ranges
+
+from .helpers import TempDataSets
+
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())  # the formulas log errors for some rows
+
+N_ROWS = 2000
+
+FORMULAS = [
+    'a + b',
+    'a - b',
+    'a * b',
+    'a / b',
+    'b / c',
+    'b % c',
+    'a ^ c',
+    '-a',
+    'not b',
+    'a > b',
+    'b == c',
+    'a > b and b > c',
+    'a < b or c',
+    'ABS(a)',
+    'SQRT(a)',
+    'LN(a)',
+    'MAX(a, b)',
+    'IF(b > c, a, b)',
+    'VMEAN(a)',
+    'VSUM(b)',
+    'Z(a)',
+    'a - VMEAN(a)',
+    'VN(c) + ROW()',
+]
+
+
+def values_equal(a, b):
+    # numpy and python can differ in the last place (i.e. for powers)
+    if isinstance(a, float) and isinstance(b, float):
+        if math.isnan(a) or math.isnan(b):
+            return math.isnan(a) and math.isnan(b)
+        return math.isclose(a, b, rel_tol=1e-12)
+    return a == b
+
+
+class TestCompute(unittest.TestCase):
+
+    def setUp(self):
+        self._datasets = TempDataSets()
+        self._data = self._datasets.create(log)
+
+        rand = random.Random(1)
+
+        a = self._append('a', DataType.DECIMAL, MeasureType.CONTINUOUS)
+        b = self._append('b', DataType.INTEGER, MeasureType.CONTINUOUS)
+        c = self._append('c', DataType.INTEGER, MeasureType.NOMINAL)
+        self._data.set_row_count(N_ROWS)
+
+        for row_no in range(N_ROWS):
+            a.set_value(row_no, rand.choice([ float('nan'), 0.0, -1.5, 2.0, rand.uniform(-5, 5), 1e300 ]))
+            b.set_value(row_no, rand.choice([ -2147483648, 0, 1, -3, 7, rand.randint(-10, 10) ]))
+            c.set_value(row_no, rand.choice([ -2147483648, 0, 1, 2 ]))
+
+    def tearDown(self):
+        self._datasets.close()
+
+    def _append(self, name, data_type, measure_type):
+        column = self._data.append_column(name, name)
+        column.column_type = ColumnType.DATA
+        column.change(data_type=data_type, measure_type=measure_type)
+        return column
+
+    def _computed(self, name, formula):
+        column = self._data.append_column(name, name)
+        column.column_type = ColumnType.COMPUTED
+        column.formula = formula
+        column.set_needs_parse()
+        column.parse_formula()
+        return column
+
+    def _values(self, column):
+        return [ column.get_value(row_no) for row_no in range(N_ROWS) ]
+
+    def _assert_values_equal(self, a, b, msg=None):
+        self.assertEqual(len(a), len(b), msg)
+        for row_no, (x, y) in enumerate(zip(a, b)):
+            self.assertTrue(values_equal(x, y), '{}: row {}, {!r} != {!r}'.format(msg, row_no, x, y))
+
+    def test_vectorised_matches_rows(self):
+        for index, formula in enumerate(FORMULAS):
+            column = self._computed('x{}'.format(index), formula)
+            self.assertEqual(column.formula_message, '', formula)
+
+            # no falling back to evaluating row by row
+            with mock.patch.object(column, '_evaluate_rows', side_effect=AssertionError(formula)):
+                column.set_needs_recalc()
+                column.recalc()
+            vectorised = self._values(column)
+
+            ul_type = column._ul_type()
+            rows = column._evaluate_rows(0, N_ROWS, ul_type)
+            column._write(0, rows, True)
+
+            self._assert_values_equal(vectorised, self._values(column), formula)
+
+    def test_filter_vectorised_matches_rows(self):
+        column = self._data.insert_column(0, 'F1', 'F1')
+        column.column_type = ColumnType.FILTER
+        column.formula = 'b > c and LN(a) > c'
+        column.active = True
+        self._data.update_filter_names()
+        column.set_needs_parse()
+        column.parse_formula()
+
+        column.set_needs_recalc()
+        column.recalc()
+        vectorised = self._values(column)
+
+        column._write(0, column._evaluate_rows(0, N_ROWS, int), True)
+
+        self.assertEqual(vectorised, self._values(column))
+
+    def test_falls_back_to_rows(self):
+        # where the vectorised evaluation fails, the column is evaluated
+        # row by row instead
+        reference = self._computed('ref', 'a * b + c')
+        reference.set_needs_recalc()
+        reference.recalc()
+
+        column = self._computed('x', 'a * b + c')
+        with mock.patch.object(column._node, 'vvalues', side_effect=RuntimeError('unsupported')):
+            with self.assertLogs(__name__, level='ERROR'):
+                column.set_needs_recalc()
+                column.recalc()
+
+        self._assert_values_equal(self._values(reference), self._values(column))
+        self.assertFalse(column.needs_recalc)
+
+    def test_recalc_rows(self):
+        # recalculating only the edited rows gives the same values as
+        # recalculating everything, including where the formulas depend
+        # on other rows (and so everything is recalculated)
+        formulas = [ 'a + b', 'x0 * c', 'VMEAN(a) + b', 'a - VMEAN(x1)', 'ROW() + b' ]
+        columns = [ ]
+        for index, formula in enumerate(formulas):
+            columns.append(self._computed('x{}'.format(index), formula))
+        self._data.recalc_columns(columns)
+
+        self.assertTrue(columns[0].can_recalc_rows)
+        self.assertTrue(columns[1].can_recalc_rows)
+        self.assertFalse(columns[2].can_recalc_rows)
+
+        a = self._data['a']
+        b = self._data['b']
+        rand = random.Random(2)
+        ranges = [ ]
+        for start in (5, 6, 500, 1000, 1990, 7):
+            end = start + rand.randint(1, 10)
+            for row_no in range(start, min(end, N_ROWS)):
+                a.set_value(row_no, rand.uniform(-100, 100))
+                b.set_value(row_no, rand.randint(-100, 100))
+            ranges.append((start, end))
+
+        # as the instance does for edits
+        a.set_needs_recalc()
+        b.set_needs_recalc()
+        for column in columns:
+            column.set_needs_recalc()
+        for column in columns:
+            column.recalc_rows(merge_ranges(ranges))
+
+        for index, (column, formula) in enumerate(zip(columns, formulas)):
+            self.assertFalse(column.needs_recalc)
+            reference = self._computed('ref{}'.format(index), formula.replace('x', 'ref'))
+            reference.set_needs_recalc()
+            reference.recalc()
+            self._assert_values_equal(self._values(reference), self._values(column), formula)
+            self.assertEqual(reference.dps, column.dps, formula)
+
+    def test_recalc_async_matches_recalc(self):
+        columns = [ ]
+        for index, formula in enumerate([ 'a + b', 'x0 * c', 'VMEAN(x1) + a', 'IF(x0 > x2, c, b)' ]):
+            columns.append(self._computed('x{}'.format(index), formula))
+
+        self._data.recalc_columns(columns)
+        expected = [ self._values(column) for column in columns ]
+
+        for column in columns:
+            column.set_needs_recalc()
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self._data.recalc_columns_async([ self._data['a'] ]))
+        finally:
+            loop.close()
+
+        for column, values in zip(columns, expected):
+            self._assert_values_equal(values, self._values(column), column.formula)
+            self.assertFalse(column.needs_recalc)
+
+
+class TestMergeRanges(unittest.TestCase):
+
+    def test_merge_ranges(self):
+        self.assertEqual(merge_ranges([ ]), [ ])
+        self.assertEqual(merge_ranges([ (3, 4) ]), [ (3, 4) ])
+        # overlapping, adjacent, contained and out of order
+        self.assertEqual(
+            merge_ranges([ (10, 12), (0, 2), (2, 4), (1, 3), (11, 12), (6, 8) ]),
+            [ (0, 4), (6, 8), (10, 12) ])
+
+
+if __name__ == '__main__':
+    unittest.main()
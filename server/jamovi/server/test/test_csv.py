@@ -0,0 +1,92 @@
+import unittest
+from unittest import mock
+
+import os.path
+import random
+import logging
+
+from jamovi.core import DataType
+from jamovi.core import MeasureType
+from jamovi.server.formatio import csv
+
+from .helpers import TempDataSets
+from .helpers import dump
+
+
+log = logging.getLogger(__name__)
+
+N_ROWS = 1000
+
+
+class TestCSV(unittest.TestCase):
+
+    def setUp(self):
+        self._datasets = TempDataSets()
+        self._temp_path = self._datasets.path
+
+        # the types of the columns change after the first rows, so they're
+        # promoted in later chunks (or segments)
+        rand = random.Random(1)
+        self._path = os.path.join(self._temp_path, 'data.csv')
+        with open(self._path, 'w') as file:
+            file.write('int,late_float,late_text,late_euro,text,many,quoted,empty\n')
+            for row_no in range(N_ROWS):
+                late = row_no > N_ROWS * 0.8
+                row = [
+                    str(rand.choice([ 1, 2, 3, '' ])),
+                    str(rand.randint(0, 5)) if not late else '3.25',
+                    rand.choice([ '1', '02', '3' ]) if not late else rand.choice([ '1', 'q' ]),
+                    str(rand.randint(0, 5)) if not late else '"1,5"',
+                    rand.choice([ 'b', 'a', 'c', '', 'zz' ]),
+                    's{}'.format(rand.randint(0, 500)),
+                    rand.choice([ '"x, y"', '"line\nbreak"', 'z' ]),
+                    '',
+                ]
+                file.write(','.join(row) + '\n')
+
+    def tearDown(self):
+        self._datasets.close()
+
+    def _read(self):
+        data = self._datasets.create(log)
+        csv.read(data, self._path, lambda p: None)
+        return data
+
+    def _assert_same(self, expected, actual):
+        self.assertEqual(len(expected), len(actual))
+        for x, y in zip(expected, actual):
+            self.assertEqual(x, y, x[0])
+
+    def test_promoted_across_chunks(self):
+        with mock.patch.object(csv, 'CHUNK_SIZE', N_ROWS * 2):
+            expected = dump(self._read())
+
+        types = dict(map(lambda column: (column[0], column[1:3]), expected))
+        self.assertEqual(types['int'], (DataType.INTEGER, MeasureType.NOMINAL))
+        self.assertEqual(types['late_float'], (DataType.DECIMAL, MeasureType.CONTINUOUS))
+        self.assertEqual(types['late_text'], (DataType.TEXT, MeasureType.NOMINAL))
+        self.assertEqual(types['late_euro'], (DataType.DECIMAL, MeasureType.CONTINUOUS))
+        self.assertEqual(types['many'], (DataType.TEXT, MeasureType.ID))
+
+        for chunk_size in (1, 7, 64, N_ROWS - 1):
+            with mock.patch.object(csv, 'CHUNK_SIZE', chunk_size):
+                self._assert_same(expected, dump(self._read()))
+
+    def test_parallel_matches_serial(self):
+        expected = dump(self._read())
+
+        with mock.patch.object(csv, 'SEGMENT_SIZE', 2048), \
+                mock.patch.object(csv, 'PARALLEL_THRESHOLD', 0), \
+                mock.patch('os.cpu_count', return_value=2):
+            with open(self._path, 'rb') as file:
+                segments = csv.split(file, 'utf-8', csv.csv.excel)
+            self.assertGreater(len(segments), 1)
+
+            with mock.patch.object(csv, 'read_parallel', wraps=csv.read_parallel) as read_parallel:
+                actual = dump(self._read())
+            self.assertTrue(read_parallel.called)
+            self._assert_same(expected, actual)
+
+
+if __name__ == '__main__':
+    unittest.main()
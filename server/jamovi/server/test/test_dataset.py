@@ -0,0 +1,481 @@
+import unittest
+
+import math
+import random
+import asyncio
+
+import numpy as np
+
+from jamovi.core import DataSet
+from jamovi.core import DataType
+from jamovi.core import MeasureType
+from jamovi.core import ColumnType
+
+from jamovi.server import jamovi_pb2 as jcoms
+
+from .helpers import TempDataSets
+from .helpers import TempInstance
+from .helpers import dump
+
+
+N_ROWS = 5000
+
+
+class TestFilters(unittest.TestCase):
+
+    def setUp(self):
+        self._datasets = TempDataSets()
+        self._ds = self._datasets.create_dataset()
+
+        self._filters = [ ]
+        for name in ('F1', 'F2'):
+            column = self._ds.append_column(name)
+            column.set_data_type(DataType.INTEGER)
+            column.set_measure_type(MeasureType.NOMINAL)
+            column.column_type = ColumnType.FILTER
+            column.active = True
+            self._filters.append(column)
+
+        column = self._ds.append_column('a')
+        column.set_data_type(DataType.DECIMAL)
+        column.set_measure_type(MeasureType.CONTINUOUS)
+
+        self._ds.set_row_count(N_ROWS)
+        for column in self._filters:
+            column.write_range(0, np.ones(N_ROWS, dtype=np.int32), True)
+        self._ds.refresh_filter_state()
+
+    def tearDown(self):
+        self._datasets.close()
+
+    def _state(self):
+        ds = self._ds
+        n_rows = ds.row_count
+        n_rows_ex_filtered = ds.row_count_ex_filtered
+        mask = np.unpackbits(np.frombuffer(ds.filter_mask, dtype=np.uint8), bitorder='little')
+        return (
+            n_rows_ex_filtered,
+            [ ds.is_row_filtered(row_no) for row_no in range(n_rows) ],
+            (mask[:n_rows] == 0).tolist(),
+            ds.get_indices_ex_filtered(0, n_rows_ex_filtered),
+            ds.get_indices_ex_filtered(n_rows_ex_filtered // 3, n_rows_ex_filtered // 2),
+            [ ds.get_index_ex_filtered(index) for index in range(0, n_rows, 7) ],
+            [ column.levels for column in self._filters ])
+
+    def _expected_filtered(self):
+        values = [ np.asarray(column.read_range(0, self._ds.row_count)) for column in self._filters ]
+        return (np.logical_and.reduce(values) == 0).tolist()
+
+    def test_incremental_matches_rebuild(self):
+        rand = random.Random(1)
+
+        for i in range(40):
+            column = rand.choice(self._filters)
+            if rand.random() < 0.5:
+                # single cells
+                for row_no in rand.sample(range(N_ROWS), 20):
+                    column.set_value(row_no, rand.choice([ 0, 1 ]))
+            else:
+                # a block, crossing 64 bit words
+                start = rand.randrange(N_ROWS)
+                count = rand.randint(1, min(300, N_ROWS - start))
+                values = np.array([ rand.choice([ 0, 1 ]) for j in range(count) ], dtype=np.int32)
+                column.write_range(start, values)
+
+            incremental = self._state()
+            self.assertEqual(incremental[1], self._expected_filtered())
+            self.assertEqual(incremental[1], incremental[2])
+
+            self._ds.refresh_filter_state()
+            self.assertEqual(incremental, self._state())
+
+    def test_everything_filtered(self):
+        self._filters[0].write_range(0, np.zeros(N_ROWS, dtype=np.int32))
+        self.assertEqual(self._ds.row_count_ex_filtered, 0)
+        self.assertEqual(self._ds.get_index_ex_filtered(0), N_ROWS)
+
+        self._filters[0].set_value(N_ROWS - 1, 1)
+        self.assertEqual(self._ds.row_count_ex_filtered, 1)
+        self.assertEqual(self._ds.get_indices_ex_filtered(0, 1), [ N_ROWS - 1 ])
+
+        state = self._state()
+        self._ds.refresh_filter_state()
+        self.assertEqual(state, self._state())
+
+
+class TestRows(unittest.TestCase):
+
+    def setUp(self):
+        self._datasets = TempDataSets()
+
+    def tearDown(self):
+        self._datasets.close()
+
+    def _create(self):
+        # the same data set each time
+        ds = self._datasets.create_dataset()
+
+        columns = [
+            ('F', DataType.INTEGER, MeasureType.NOMINAL),
+            ('a', DataType.DECIMAL, MeasureType.CONTINUOUS),
+            ('b', DataType.INTEGER, MeasureType.NOMINAL),
+            ('t', DataType.TEXT, MeasureType.NOMINAL),
+            ('s', DataType.TEXT, MeasureType.ID),
+        ]
+        for name, data_type, measure_type in columns:
+            column = ds.append_column(name)
+            column.set_data_type(data_type)
+            column.set_measure_type(measure_type)
+
+        ds['F'].column_type = ColumnType.FILTER
+        ds['F'].active = True
+        ds.set_row_count(N_ROWS)
+
+        rand = random.Random(1)
+        for row_no in range(N_ROWS):
+            ds['F'].set_value(row_no, rand.choice([ 0, 1, 1 ]), True)
+            ds['a'].set_value(row_no, rand.choice([ float('nan'), rand.random() ]))
+            ds['b'].set_value(row_no, rand.choice([ -2147483648, 1, 5, 9 ]), True)
+            ds['t'].set_value(row_no, rand.choice([ '', 'x', 'y', 'z{}'.format(row_no % 7) ]), True)
+            ds['s'].set_value(row_no, rand.choice([ '', 'id{}'.format(row_no) ]), True)
+        ds.refresh_filter_state()
+
+        return ds
+
+    def _dump(self, ds):
+        state = (
+            ds.row_count,
+            ds.row_count_ex_filtered,
+            ds.get_indices_ex_filtered(0, ds.row_count_ex_filtered))
+        return dump(ds), state
+
+    def _delete(self, rows, ranges):
+        # the ranges are inclusive
+        deleted = set()
+        for start, end in ranges:
+            deleted.update(range(start, end + 1))
+        return [ value for row_no, value in enumerate(rows) if row_no not in deleted ]
+
+    def test_delete_row_ranges(self):
+        ranges = [ (0, 0), (3, 9), (10, 10), (100, 163), (500, 1500), (N_ROWS - 5, N_ROWS - 1) ]
+
+        ds = self._create()
+        expected_columns, expected_state = self._dump(ds)
+        ds.delete_row_ranges(ranges)
+        columns, state = self._dump(ds)
+
+        n_rows = N_ROWS - sum(map(lambda r: r[1] - r[0] + 1, ranges))
+        self.assertEqual(state[0], n_rows)
+        for expected, actual in zip(expected_columns, columns):
+            self.assertEqual(self._delete(expected[-1], ranges), actual[-1], expected[0])
+
+        # the same as deleting the ranges one at a time
+        each = self._create()
+        for start, end in reversed(ranges):
+            each.delete_rows(start, end)
+        self.assertEqual((columns, state), self._dump(each))
+
+        # and the filter state is as though rebuilt
+        ds.refresh_filter_state()
+        self.assertEqual(state, self._dump(ds)[1])
+
+    def test_delete_every_row(self):
+        ds = self._create()
+        ds.delete_row_ranges([ (0, 99), (100, N_ROWS - 1) ])
+        self.assertEqual(ds.row_count, 0)
+        self.assertEqual(ds.row_count_ex_filtered, 0)
+
+        ds.set_row_count(3)
+        self.assertEqual(ds['s'].get_value(2), '')
+        self.assertTrue(math.isnan(ds['a'].get_value(2)))
+
+    def test_insert_rows(self):
+        ds = self._create()
+        expected_columns, expected_state = self._dump(ds)
+
+        ds.insert_rows(1000, 1099)
+        ds.insert_rows(0, 0)
+        columns, state = self._dump(ds)
+
+        self.assertEqual(state[0], N_ROWS + 101)
+        for expected, actual in zip(expected_columns, columns):
+            values = actual[-1]
+            self.assertEqual(expected[-1][:1000], values[1:1001], expected[0])
+            self.assertEqual(expected[-1][1000:], values[1101:], expected[0])
+
+        inserted = range(1001, 1101)
+        self.assertTrue(all(map(lambda row_no: math.isnan(ds['a'].get_value(row_no)), inserted)))
+        self.assertEqual(list(map(ds['s'].get_value, inserted)), [ '' ] * 100)
+
+        ds.refresh_filter_state()
+        self.assertEqual(state, self._dump(ds)[1])
+
+
+class TestVersion(unittest.TestCase):
+
+    # each change to a column bumps its version, and changes its content
+    # hash (which the results cache is keyed on)
+
+    N_ROWS = 20000  # spans several blocks
+
+    def setUp(self):
+        self._datasets = TempDataSets()
+        self._ds = self._datasets.create_dataset()
+
+        columns = [
+            ('a', DataType.DECIMAL, MeasureType.CONTINUOUS),
+            ('b', DataType.INTEGER, MeasureType.NOMINAL),
+            ('t', DataType.TEXT, MeasureType.NOMINAL),
+            ('s', DataType.TEXT, MeasureType.ID),
+        ]
+        for name, data_type, measure_type in columns:
+            column = self._ds.append_column(name)
+            column.set_data_type(data_type)
+            column.set_measure_type(measure_type)
+        self._ds.set_row_count(self.N_ROWS)
+        for index, label in enumerate([ 'x', 'y', 'z' ]):
+            self._ds['t'].append_level(index, label)
+
+        rand = random.Random(1)
+        for row_no in range(self.N_ROWS):
+            self._ds['a'].set_value(row_no, rand.random(), True)
+            self._ds['b'].set_value(row_no, rand.choice([ 1, 5, 9 ]), True)
+            self._ds['t'].set_value(row_no, rand.choice([ 'x', 'y', 'z' ]), True)
+            self._ds['s'].set_value(row_no, 'id{}'.format(row_no), True)
+
+    def tearDown(self):
+        self._datasets.close()
+
+    def _assert_changes(self, column, change):
+        # returns the hash from before the change
+        version = column.version
+        content_hash = column.content_hash()
+        change()
+        self.assertGreater(column.version, version, column.name)
+        self.assertNotEqual(column.content_hash(), content_hash, column.name)
+        return content_hash
+
+    def _assert_restores(self, column, change, restore):
+        # the same content has the same hash, though the version differs
+        content_hash = self._assert_changes(column, change)
+        version = column.version
+        restore()
+        self.assertGreater(column.version, version, column.name)
+        self.assertEqual(column.content_hash(), content_hash, column.name)
+
+    def test_set_value(self):
+        last = self.N_ROWS - 1
+        for column, value in ((self._ds['a'], -1.5), (self._ds['b'], 7), (self._ds['s'], 'changed')):
+            for row_no in (0, last // 2, last):
+                old = column.get_value(row_no)
+                self._assert_restores(
+                    column,
+                    lambda: column.set_value(row_no, value),
+                    lambda: column.set_value(row_no, old))
+
+    def test_set_value_missing(self):
+        for column in self._ds:
+            row_no = self.N_ROWS // 3
+            old = column.get_value(row_no)
+            self._assert_restores(
+                column,
+                lambda: column.clear_at(row_no),
+                lambda: column.set_value(row_no, old))
+
+    def test_write_range(self):
+        start = 4000
+        for column, values in (
+                (self._ds['a'], np.zeros(5000, dtype=np.float64)),
+                (self._ds['b'], np.zeros(10000, dtype=np.int32))):
+            old = column.read_range(start, len(values))
+            self._assert_restores(
+                column,
+                lambda: column.write_range(start, values),
+                lambda: column.write_range(start, old))
+
+    def test_rows(self):
+        ds = self._ds
+        hashes = [ column.content_hash() for column in ds ]
+        versions = [ column.version for column in ds ]
+
+        ds.insert_rows(10000, 10009)
+        for column, content_hash, version in zip(ds, hashes, versions):
+            self.assertGreater(column.version, version, column.name)
+            self.assertNotEqual(column.content_hash(), content_hash, column.name)
+
+        # deleting the rows restores the hash
+        versions = [ column.version for column in ds ]
+        ds.delete_rows(10000, 10009)
+        for column, content_hash, version in zip(ds, hashes, versions):
+            self.assertGreater(column.version, version, column.name)
+            self.assertEqual(column.content_hash(), content_hash, column.name)
+
+        ds.delete_rows(0, 0)
+        for column, content_hash in zip(ds, hashes):
+            self.assertNotEqual(column.content_hash(), content_hash, column.name)
+
+        ds.set_row_count(self.N_ROWS + 10)
+        for column, content_hash in zip(ds, hashes):
+            self.assertNotEqual(column.content_hash(), content_hash, column.name)
+
+    def test_levels(self):
+        for name in ('b', 't'):
+            column = self._ds[name]
+            levels = column.levels
+
+            # renaming a level
+            renamed = [ (value, label + '!', import_value) for value, label, import_value in levels ]
+            self._assert_restores(
+                column,
+                lambda: column.set_levels(renamed),
+                lambda: column.set_levels(levels))
+
+            # reordering the levels
+            self._assert_restores(
+                column,
+                lambda: column.set_levels(list(reversed(levels))),
+                lambda: column.set_levels(levels))
+
+        column = self._ds['b']
+        levels = column.levels
+        self._assert_changes(column, lambda: column.append_level(11, '11'))
+        self._assert_changes(column, lambda: column.insert_level(3, '3'))
+        self._assert_changes(column, lambda: column.clear_levels())
+        self._assert_changes(column, lambda: column.set_levels(levels))
+
+    def test_change_type(self):
+        column = self._ds['b']
+        self._assert_changes(column, lambda: column.change(measure_type=MeasureType.CONTINUOUS))
+        self._assert_changes(column, lambda: column.change(data_type=DataType.DECIMAL))
+
+
+class TestMemoryMap(unittest.TestCase):
+
+    def setUp(self):
+        self._datasets = TempDataSets()
+        self._mm = self._datasets.create_memory_map()
+        self._ds = DataSet.create(self._mm)
+
+        for index in range(10):
+            self._append('c{}'.format(index))
+        column = self._ds.append_column('s')
+        column.set_data_type(DataType.TEXT)
+        column.set_measure_type(MeasureType.ID)
+
+        self._ds.set_row_count(N_ROWS)
+        for index in range(10):
+            self._ds[index].write_range(0, np.arange(N_ROWS, dtype=np.float64) + index, True)
+        for row_no in range(N_ROWS):
+            self._ds['s'].set_value(row_no, 'id{}'.format(row_no), True)
+
+    def tearDown(self):
+        self._datasets.close()
+
+    def _append(self, name):
+        column = self._ds.append_column(name)
+        column.set_data_type(DataType.DECIMAL)
+        column.set_measure_type(MeasureType.CONTINUOUS)
+        return column
+
+    def test_reuse_after_recycle(self):
+        self._ds.delete_columns(2, 5)
+        released = self._mm.released_size
+        self.assertGreater(released, 0)
+
+        # the released space isn't reused until it's recycled (the engines
+        # may still be reading it)
+        used = self._mm.used_size
+        column = self._append('new0')
+        self._ds.set_row_count(N_ROWS)
+        self.assertGreater(self._mm.used_size, used)
+        self.assertEqual(self._mm.released_size, released)
+
+        self._mm.recycle()
+        used = self._mm.used_size
+        for index in range(1, 4):
+            column = self._append('new{}'.format(index))
+            column.write_range(0, np.ones(N_ROWS), True)
+        self.assertEqual(self._mm.used_size, used)
+        self.assertLess(self._mm.released_size, released)
+
+        # the reused space holds the new values only
+        self.assertEqual(set(column.read_range(0, N_ROWS)), { 1.0 })
+
+    def test_compact(self):
+        self._ds.delete_columns(1, 4)
+        self._ds.delete_rows(100, 2000)
+        self._ds['s'].set_value(0, 'a longer string than before')
+
+        expected = dump(self._ds)
+        used = self._mm.used_size
+        self._ds.compact()
+
+        self.assertEqual(self._mm.released_size, 0)
+        self.assertLess(self._mm.used_size, used)
+        self.assertEqual(expected, dump(self._ds))
+
+        # and it goes on working
+        self._ds['s'].set_value(3, 'changed')
+        self._ds.insert_rows(0, 9)
+        self._append('new')
+        self.assertEqual(self._ds['s'].get_value(13), 'changed')
+        self.assertEqual(self._ds.row_count, N_ROWS - 1901 + 10)
+
+
+class TestRecycle(unittest.TestCase):
+
+    # the space released by deleting isn't reused while the engines may
+    # be reading the data set
+
+    def setUp(self):
+        self._temp = TempInstance()
+        self._temp.open()
+
+        request = jcoms.DataSetRR()
+        request.op = jcoms.GetSet.Value('SET')
+        request.incData = True
+        block_pb = request.data.add()
+        block_pb.rowStart = 0
+        block_pb.columnStart = 0
+        block_pb.rowCount = N_ROWS
+        block_pb.columnCount = 2
+        block_pb.incCBData = True
+        block_pb.cbText = '\n'.join(map(lambda row_no: '{}\t{}.5'.format(row_no, row_no), range(N_ROWS)))
+        self._temp.request(request)
+
+    def tearDown(self):
+        self._temp.close()
+
+    def _delete_column(self):
+        request = jcoms.DataSetRR()
+        request.op = jcoms.GetSet.Value('SET')
+        request.incSchema = True
+        column_pb = request.schema.columns.add()
+        column_pb.action = jcoms.DataSetSchema.ColumnSchema.Action.Value('REMOVE')
+        column_pb.id = self._temp.data[0].id
+        column_pb.index = 0
+        self._temp.request(request)
+
+    def test_recycle_when_idle(self):
+        instance = self._temp.instance
+        self._temp.session.busy = True
+        self._delete_column()
+        self.assertTrue(instance._recycle_pending)
+
+        # still busy
+        instance.notify_engines_idle()
+        self._temp.loop.run_until_complete(asyncio.sleep(0))
+        self.assertTrue(instance._recycle_pending)
+
+        self._temp.session.busy = False
+        instance.notify_engines_idle()
+        self._temp.loop.run_until_complete(asyncio.sleep(0))
+        self.assertFalse(instance._recycle_pending)
+
+    def test_recycle_straight_away(self):
+        self._delete_column()
+        self.assertFalse(self._temp.instance._recycle_pending)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,662 @@
+import unittest
+from unittest import mock
+
+import os.path
+import time
+import asyncio
+import tempfile
+from types import SimpleNamespace
+
+from jamovi.core import DataType
+from jamovi.core import MeasureType
+from jamovi.core import ColumnType
+from jamovi.server import enginemanager
+from jamovi.server import jamovi_pb2 as jcoms
+from jamovi.server.enginemanager import Engine
+from jamovi.server.enginemanager import EngineManager
+from jamovi.server.analyses import Analysis
+from jamovi.server.options import Options
+from jamovi.server.resultscache import ResultsCache
+
+from .helpers import TempDataSets
+
+
+class FakeEngine(Engine):
+
+    # in place of an engine process. analyses are 'sent' to it, and
+    # finish() completes them, as though the results had arrived.
+    # acknowledge() acknowledges a cancel
+
+    def __init__(self, parent, data_path, conn_path):
+        super().__init__(parent, data_path, conn_path)
+        self.ready = False
+        self.sent = [ ]
+        self.cancels = 0
+        self.retired = False
+
+    def start(self):
+        self.ready = True
+
+    def retire(self):
+        self.retired = True
+
+    def send(self, analysis, run=True):
+        if not self.ready:
+            return False
+        if analysis.status is Analysis.Status.COMPLETE and analysis.needs_op:
+            analysis.op.waiting = False
+            self.status = Engine.Status.OPPING
+        else:
+            analysis.status = Analysis.Status.RUNNING
+            self.status = Engine.Status.RUNNING if run else Engine.Status.INITING
+            self.revision = analysis.revision
+        self.sent.append((analysis, run, self.status))
+        self.analysis = analysis
+        return True
+
+    def cancel(self):
+        self.cancels += 1
+        self.status = Engine.Status.CANCELLING
+
+    def acknowledge(self):
+        self._set_waiting()
+
+    def finish(self):
+        analysis = self.analysis
+        if self.status is Engine.Status.OPPING:
+            analysis.op.set_result(None)
+        elif self.status is Engine.Status.INITING:
+            analysis.status = Analysis.Status.INITED
+        else:
+            analysis.status = Analysis.Status.COMPLETE
+        self._set_waiting()
+
+
+class FakeAnalyses:
+
+    # in place of an instance's analyses
+
+    def __init__(self):
+        self._analyses = [ ]
+        self._listeners = [ ]
+        self.results = [ ]
+
+    def create(self, instance):
+        dataset = SimpleNamespace(instance=instance, needs_load=False)
+        id = len(self._analyses) + 1
+        analysis = Analysis(dataset, id, 'name', 'ns', Options(), self, True)
+        self._analyses.append(analysis)
+        return analysis
+
+    def delete(self, analysis):
+        self._analyses.remove(analysis)
+        analysis.status = Analysis.Status.DELETED
+        self._notify_options_changed(analysis)
+
+    def add_options_changed_listener(self, listener):
+        self._listeners.append(listener)
+
+    def _notify_options_changed(self, analysis):
+        for listener in self._listeners:
+            listener(analysis)
+
+    def _notify_results_changed(self, analysis):
+        self.results.append(analysis)
+
+    def __iter__(self):
+        return self._analyses.__iter__()
+
+
+class NoCache:
+
+    def key(self, analysis):
+        return None
+
+    def get(self, key):
+        return None
+
+
+def create_instance(id, visible=True):
+    return SimpleNamespace(id=id, is_active=visible, results_cache=NoCache())
+
+
+class EngineManagerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._analyses = FakeAnalyses()
+        self._instance = create_instance('visible')
+        self._hidden = create_instance('hidden', visible=False)
+
+        # the engines the pool grows by are fake too
+        patch = mock.patch.object(enginemanager, 'Engine', FakeEngine)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self._loop.close()
+        asyncio.set_event_loop(None)
+
+    def _create(self, min_engines=1, max_engines=1):
+        config = { 'min_engines': min_engines, 'max_engines': max_engines }
+        with mock.patch.object(enginemanager.conf, 'get', lambda key, otherwise=None: config.get(key, otherwise)):
+            em = EngineManager('data_path', self._analyses)
+        self.addCleanup(em._dir.cleanup)
+        em.start()
+        return em
+
+    def _analysis(self, status=Analysis.Status.NONE, instance=None):
+        analysis = self._analyses.create(instance or self._instance)
+        analysis.status = status
+        return analysis
+
+
+class TestScheduling(EngineManagerTestCase):
+
+    def test_order(self):
+        # visible before hidden; initing before saving, before running
+        em = self._create()
+        engine = em._engines[0]
+        engine.ready = False
+
+        hidden = self._analysis(instance=self._hidden)
+        init = self._analysis()
+        run = self._analysis(Analysis.Status.INITED)
+        save = self._analysis(Analysis.Status.COMPLETE)
+        for analysis in (hidden, run, init):
+            em._enqueue(analysis)
+        save.save('path', 'part')  # queued through the listener
+        self.assertEqual(engine.sent, [ ])
+
+        engine.ready = True
+        order = [ ]
+        for i in range(4):
+            em._dispatch()
+            order.append(engine.sent[-1][:2])
+            engine.analysis.status = Analysis.Status.COMPLETE
+            engine._set_waiting()
+
+        self.assertEqual(order, [ (init, False), (save, True), (run, True), (hidden, False) ])
+        self.assertEqual(len(em._queued), 0)
+
+    def test_superseded_entries(self):
+        em = self._create()
+        engine = em._engines[0]
+        engine.ready = False
+
+        analysis = self._analysis()
+        em._enqueue(analysis)
+        em._enqueue(analysis)
+        # queued to init, then again to run; the later entry is current
+        analysis.status = Analysis.Status.INITED
+        em._enqueue(analysis)
+        self.assertEqual(len(em._queue), 3)
+
+        deleted = self._analysis()
+        em._enqueue(deleted)
+        self._analyses._analyses.remove(deleted)
+
+        nothing_to_do = self._analysis()
+        em._enqueue(nothing_to_do)
+        nothing_to_do.status = Analysis.Status.COMPLETE
+
+        entry, run = em._next()
+        self.assertIs(entry[2], analysis)
+        self.assertTrue(run)
+        self.assertEqual(em._next(), (None, None))
+        self.assertEqual(len(em._queue), 0)
+
+    def test_init_then_run(self):
+        # an analysis is queued again to run, once it's inited
+        em = self._create()
+        engine = em._engines[0]
+
+        analysis = self._analysis()
+        em._enqueue(analysis)
+        em._dispatch()
+        self.assertEqual(engine.sent[-1][:2], (analysis, False))
+        engine.finish()
+        self.assertEqual(engine.sent[-1][:2], (analysis, True))
+        engine.finish()
+        self.assertEqual(analysis.status, Analysis.Status.COMPLETE)
+        self.assertTrue(engine.is_waiting)
+
+
+class TestCancel(EngineManagerTestCase):
+
+    def _running(self, em):
+        analysis = self._analysis(Analysis.Status.INITED)
+        em._enqueue(analysis)
+        em._dispatch()
+        engine = em._engines[0]
+        self.assertIs(engine.analysis, analysis)
+        return analysis, engine
+
+    def test_cancel_superseded(self):
+        em = self._create()
+        analysis, engine = self._running(em)
+
+        # the options change, so the run is cancelled, and once the
+        # cancel is acknowledged, the analysis is inited again
+        analysis.run()
+        self.assertEqual(engine.cancels, 1)
+        self.assertEqual(engine.status, Engine.Status.CANCELLING)
+        self.assertIs(engine.analysis, analysis)
+        self.assertEqual(len(engine.sent), 1)
+
+        engine.acknowledge()
+        self.assertEqual(engine.sent[-1][:2], (analysis, False))
+        self.assertEqual(engine.revision, analysis.revision)
+
+    def test_cancel_earlier_revision(self):
+        em = self._create()
+        analysis, engine = self._running(em)
+        analysis.revision += 1
+        self._analyses._notify_options_changed(analysis)
+        self.assertEqual(engine.cancels, 1)
+        self.assertEqual(engine.status, Engine.Status.CANCELLING)
+
+        # a cancelling engine isn't cancelled again
+        analysis.revision += 1
+        self._analyses._notify_options_changed(analysis)
+        self.assertEqual(engine.cancels, 1)
+
+    def test_cancel_deleted(self):
+        em = self._create()
+        analysis, engine = self._running(em)
+        self._analyses.delete(analysis)
+        self.assertEqual(engine.cancels, 1)
+        engine.acknowledge()
+        self.assertTrue(engine.is_waiting)
+        self.assertEqual(len(em._queued), 0)
+
+    def test_busy_until_acknowledged(self):
+        # the engine may read the data set until the analysis aborts, so
+        # the instance isn't idle until then
+        em = self._create()
+        events = [ ]
+        em.add_engine_listener(events.append)
+        analysis, engine = self._running(em)
+
+        self._analyses.delete(analysis)
+        self.assertTrue(em.is_busy(self._instance))
+        self.assertFalse(em.is_busy(self._hidden))
+        self.assertEqual(events, [ ])
+
+        engine.acknowledge()
+        self.assertFalse(em.is_busy(self._instance))
+        self.assertEqual(events, [ { 'type': 'idle', 'instance': self._instance } ])
+
+    def test_save_while_running(self):
+        # saving isn't a change; the run continues, and the save follows
+        em = self._create()
+        analysis, engine = self._running(em)
+
+        future = analysis.save('path', 'part')
+        self.assertEqual(engine.cancels, 0)
+        self.assertIs(engine.analysis, analysis)
+        self.assertEqual(engine.status, Engine.Status.RUNNING)
+
+        engine.finish()
+        self.assertEqual(engine.sent[-1], (analysis, True, Engine.Status.OPPING))
+        engine.finish()
+        self.assertTrue(future.done())
+        self.assertEqual(analysis.status, Analysis.Status.COMPLETE)
+        self.assertTrue(engine.is_waiting)
+
+    def test_change_while_saving(self):
+        # an op isn't cancelled; the change is run after it
+        em = self._create()
+        analysis = self._analysis(Analysis.Status.COMPLETE)
+        future = analysis.save('path', 'part')
+        engine = em._engines[0]
+        self.assertEqual(engine.status, Engine.Status.OPPING)
+
+        analysis.run()
+        self.assertEqual(engine.cancels, 0)
+        engine.finish()
+        self.assertTrue(future.done())
+        self.assertEqual(engine.sent[-1][:2], (analysis, False))
+
+    def test_coalesce(self):
+        em = self._create()
+        analysis, engine = self._running(em)
+
+        async def wait():
+            await asyncio.sleep(0.1)
+
+        with mock.patch.object(EngineManager, 'COALESCE_WINDOW', 0.05):
+            # the first change is sent straight away (once the engine is
+            # free)
+            analysis.run()
+            engine.acknowledge()
+            self.assertEqual(len(engine.sent), 2)
+
+            # but those which follow quickly are coalesced into one run,
+            # once they stop
+            for i in range(3):
+                analysis.run()
+            self.assertEqual(engine.cancels, 2)
+            engine.acknowledge()
+            self.assertEqual(len(engine.sent), 2)
+
+            self._loop.run_until_complete(wait())
+            self.assertEqual(len(engine.sent), 3)
+            self.assertEqual(engine.sent[-1][:2], (analysis, False))
+            self.assertEqual(engine.revision, analysis.revision)
+
+            # and once the window has passed, a change is sent straight
+            # away again
+            engine.finish()
+            engine.finish()
+            self._loop.run_until_complete(wait())
+            analysis.run()
+            self.assertEqual(engine.sent[-1][:2], (analysis, False))
+            self.assertEqual(engine.revision, analysis.revision)
+
+
+class TestReceive(EngineManagerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._waiting = [ ]
+        parent = SimpleNamespace(_on_engine_waiting=self._waiting.append)
+        self._engine = Engine(parent, 'data_path', 'conn_path')
+
+    def _message(self, analysis, revision, complete=True):
+        results = jcoms.AnalysisResponse()
+        results.instanceId = analysis.instance.id
+        results.analysisId = analysis.id
+        results.revision = revision
+        results.incAsText = complete
+        results.status = jcoms.AnalysisStatus.Value('ANALYSIS_COMPLETE' if complete else 'ANALYSIS_RUNNING')
+        message = jcoms.ComsMessage()
+        message.payload = results.SerializeToString()
+        return message
+
+    def test_revisions(self):
+        engine = self._engine
+        analysis = self._analysis(Analysis.Status.RUNNING)
+        analysis.revision = 3
+        engine.analysis = analysis
+        engine.status = Engine.Status.RUNNING
+
+        # results of earlier revisions, and other analyses, are ignored
+        engine._receive(self._message(analysis, 2))
+        other = self._analysis()
+        other.revision = 3
+        engine._receive(self._message(other, 3))
+        self.assertIsNone(analysis.results)
+        self.assertEqual(self._analyses.results, [ ])
+        self.assertEqual(engine.status, Engine.Status.RUNNING)
+
+        engine._receive(self._message(analysis, 3, complete=False))
+        self.assertEqual(self._analyses.results, [ analysis ])
+        self.assertEqual(engine.status, Engine.Status.RUNNING)
+
+        engine._receive(self._message(analysis, 3))
+        self.assertEqual(analysis.status, Analysis.Status.COMPLETE)
+        self.assertEqual(engine.status, Engine.Status.WAITING)
+        self.assertIsNone(engine.analysis)
+        self.assertEqual(self._waiting, [ analysis ])
+
+        # and nothing's received while waiting
+        engine._receive(self._message(analysis, 3))
+        self.assertEqual(len(self._analyses.results), 2)
+
+    def test_cancelling(self):
+        engine = self._engine
+        engine._socket = mock.Mock()
+        analysis = self._analysis(Analysis.Status.RUNNING)
+        engine.analysis = analysis
+        engine.status = Engine.Status.RUNNING
+
+        engine.cancel()
+        message = jcoms.ComsMessage()
+        message.ParseFromString(engine._socket.send.call_args[0][0])
+        request = jcoms.AnalysisRequest()
+        request.ParseFromString(message.payload)
+        self.assertEqual(request.perform, jcoms.AnalysisRequest.Perform.Value('CANCEL'))
+        self.assertEqual(engine.status, Engine.Status.CANCELLING)
+        self.assertIs(engine.analysis, analysis)
+
+        # the results of the analysis aborting are discarded
+        in_progress = self._message(analysis, 0, complete=False)
+        in_progress.status = jcoms.Status.Value('IN_PROGRESS')
+        engine._receive(in_progress)
+        self.assertIsNone(analysis.results)
+        self.assertEqual(engine.status, Engine.Status.CANCELLING)
+        self.assertEqual(self._waiting, [ ])
+
+        # until the cancel is acknowledged
+        ack = jcoms.ComsMessage()
+        ack.id = message.id
+        engine._receive(ack)
+        self.assertIsNone(analysis.results)
+        self.assertTrue(engine.is_waiting)
+        self.assertIsNone(engine.analysis)
+        self.assertEqual(self._waiting, [ analysis ])
+
+    def test_cancelling_completed(self):
+        # the analysis completed before the cancel reached the engine
+        engine = self._engine
+        engine._socket = mock.Mock()
+        analysis = self._analysis(Analysis.Status.RUNNING)
+        engine.analysis = analysis
+        engine.status = Engine.Status.RUNNING
+
+        engine.cancel()
+        engine._receive(self._message(analysis, 0))
+        self.assertIsNone(analysis.results)
+        self.assertTrue(engine.is_waiting)
+        self.assertEqual(self._waiting, [ analysis ])
+
+
+class TestReplay(EngineManagerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._temp_dir.cleanup)
+        self._datasets = TempDataSets()
+        self.addCleanup(self._datasets.close)
+
+        instance = self._instance
+        instance.results_cache = ResultsCache(os.path.join(self._temp_dir.name, 'cache'))
+        instance.get_path_to_resource = lambda resource: os.path.join(self._temp_dir.name, resource)
+
+        self._data = self._datasets.create(instance=instance)
+        column = self._data.append_column('a', 'a')
+        column.column_type = ColumnType.DATA
+        column.change(data_type=DataType.INTEGER, measure_type=MeasureType.CONTINUOUS)
+        self._data.set_row_count(5)
+        for row_no in range(5):
+            column.set_value(row_no, row_no)
+
+    def _analysis(self, status=Analysis.Status.INITED):
+        analysis = super()._analysis(status)
+        analysis.dataset = self._data
+        options_pb = jcoms.AnalysisOptions()
+        options_pb.hasNames = True
+        options_pb.names.append('vars')
+        Options._populate_pb(options_pb.options.add(), [ 'a' ])
+        analysis.options = Options.create([ ], { })
+        analysis.options.set(options_pb)
+        return analysis
+
+    def _put(self, em, analysis, image=None):
+        # results, as from an earlier run of the analysis
+        results = jcoms.AnalysisResponse()
+        results.instanceId = 'earlier'
+        results.analysisId = 99
+        results.status = jcoms.AnalysisStatus.Value('ANALYSIS_COMPLETE')
+        results.results.group.elements.add().preformatted = 'results'
+        if image is not None:
+            results.results.group.elements.add().image.path = image
+        key = em._cache_key(analysis)
+        self._instance.results_cache.put(key, results)
+        return key
+
+    def test_cache_key(self):
+        em = self._create()
+        analysis = self._analysis(Analysis.Status.NONE)
+        key = self._instance.results_cache.key(analysis)
+        self.assertIsNotNone(key)
+        self.assertEqual(em._cache_key(analysis), key)
+        analysis.status = Analysis.Status.INITED
+        self.assertEqual(em._cache_key(analysis), key)
+
+        # ops aren't cached, nor are disabled analyses
+        analysis.status = Analysis.Status.COMPLETE
+        self.assertIsNone(em._cache_key(analysis))
+        analysis.status = Analysis.Status.INITED
+        analysis.enabled = False
+        self.assertIsNone(em._cache_key(analysis))
+
+    def test_replay(self):
+        em = self._create()
+        engine = em._engines[0]
+        analysis = self._analysis()
+        analysis.revision = 2
+        self._put(em, analysis)
+
+        em._enqueue(analysis)
+        em._dispatch()
+        self.assertEqual(engine.sent, [ ])
+        self.assertEqual(self._analyses.results, [ analysis ])
+        self.assertEqual(analysis.status, Analysis.Status.COMPLETE)
+        self.assertEqual(analysis.results.instanceId, 'visible')
+        self.assertEqual(analysis.results.analysisId, analysis.id)
+        self.assertEqual(analysis.results.revision, 2)
+        self.assertEqual(analysis.results.results.group.elements[0].preformatted, 'results')
+        self.assertTrue(analysis.clear_state)
+
+    def test_no_replay_when_data_changes(self):
+        em = self._create()
+        engine = em._engines[0]
+        analysis = self._analysis()
+        self._put(em, analysis)
+
+        self._data['a'].set_value(0, 10)
+        em._enqueue(analysis)
+        em._dispatch()
+        self.assertEqual(engine.sent[-1][:2], (analysis, True))
+        self.assertIsNone(analysis.results)
+
+    def test_no_replay_when_image_missing(self):
+        em = self._create()
+        engine = em._engines[0]
+        analysis = self._analysis()
+        self._put(em, analysis, image='image.png')
+
+        em._enqueue(analysis)
+        em._dispatch()
+        self.assertEqual(engine.sent[-1][:2], (analysis, True))
+        self.assertIsNone(analysis.results)
+
+        # once the image exists, it's replayed
+        with open(self._instance.get_path_to_resource('image.png'), 'wb'):
+            pass
+        same = self._analysis()
+        em._enqueue(same)
+        em._dispatch()
+        self.assertEqual(len(engine.sent), 1)
+        self.assertEqual(same.status, Analysis.Status.COMPLETE)
+
+    def test_put(self):
+        # results are put in the cache as they complete
+        parent = SimpleNamespace(_on_engine_waiting=lambda analysis: None)
+        engine = Engine(parent, 'data_path', 'conn_path')
+        analysis = self._analysis(Analysis.Status.RUNNING)
+        key = self._instance.results_cache.key(analysis)
+        engine.analysis = analysis
+        engine.status = Engine.Status.RUNNING
+        engine.cache_key = key
+
+        results = jcoms.AnalysisResponse()
+        results.instanceId = analysis.instance.id
+        results.analysisId = analysis.id
+        results.revision = analysis.revision
+        results.incAsText = True
+        results.status = jcoms.AnalysisStatus.Value('ANALYSIS_COMPLETE')
+        message = jcoms.ComsMessage()
+        message.payload = results.SerializeToString()
+        engine._receive(message)
+
+        self.assertEqual(self._instance.results_cache.get(key).analysisId, analysis.id)
+
+
+class TestPool(EngineManagerTestCase):
+
+    def _grow(self, em, n_analyses):
+        analyses = [ self._analysis(Analysis.Status.INITED) for i in range(n_analyses) ]
+        with mock.patch('os.getloadavg', return_value=(0.0, 0.0, 0.0)):
+            for analysis in analyses:
+                em._enqueue(analysis)
+                em._dispatch()
+            em._dispatch()
+        if em._retry_handle is not None:
+            em._retry_handle.cancel()
+            em._retry_handle = None
+        return analyses
+
+    def test_grow(self):
+        em = self._create(min_engines=1, max_engines=3)
+        em._cpu_count = 8
+
+        # grows while every engine is busy, up to max_engines
+        self._grow(em, 5)
+        self.assertEqual(len(em._engines), 3)
+        self.assertTrue(all(map(lambda engine: not engine.is_waiting, em._engines)))
+
+        # but not while the cpus are busy
+        em = self._create(min_engines=1, max_engines=3)
+        em._cpu_count = 8
+        with mock.patch('os.getloadavg', return_value=(9.0, 0.0, 0.0)):
+            for analysis in [ self._analysis(Analysis.Status.INITED) for i in range(3) ]:
+                em._enqueue(analysis)
+                em._dispatch()
+        self.assertEqual(len(em._engines), 1)
+
+    def test_retire_idle(self):
+        em = self._create(min_engines=1, max_engines=3)
+        em._cpu_count = 8
+        self._grow(em, 3)
+        engines = list(em._engines)
+        self.assertEqual(len(engines), 3)
+
+        # the engines not yet idle for long enough remain
+        engines[0].finish()
+        engines[1].finish()
+        em._retire_idle()
+        self.assertEqual(em._engines, engines)
+        self.assertIsNotNone(em._retire_handle)
+
+        # the busy remain too
+        past = time.monotonic() - EngineManager.ENGINE_IDLE_TIMEOUT
+        for engine in engines:
+            engine.idle_since = past
+        em._retire_idle()
+        self.assertEqual(em._engines, engines[2:])
+        self.assertEqual(list(map(lambda engine: engine.retired, engines)), [ True, True, False ])
+        self.assertIsNone(em._retire_handle)
+
+    def test_retire_to_min_engines(self):
+        em = self._create(min_engines=2, max_engines=3)
+        em._cpu_count = 8
+        self._grow(em, 3)
+        engines = list(em._engines)
+        self.assertEqual(len(engines), 3)
+
+        past = time.monotonic() - EngineManager.ENGINE_IDLE_TIMEOUT
+        for engine in engines:
+            engine.finish()
+            engine.idle_since = past
+        em._retire_idle()
+        self.assertEqual(em._engines, engines[:2])
+        self.assertTrue(engines[2].retired)
+
+
+if __name__ == '__main__':
+    unittest.main()
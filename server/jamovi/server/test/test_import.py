@@ -0,0 +1,111 @@
+import unittest
+from unittest import mock
+
+import os.path
+
+from jamovi.core import MemoryMap
+from jamovi.core import DataType
+from jamovi.core import MeasureType
+from jamovi.server import jamovi_pb2 as jcoms
+from jamovi.server import formatio
+from jamovi.server.instancemodel import InstanceModel
+
+from .helpers import TempInstance
+from .helpers import TempDataSets
+from .helpers import dump
+
+
+# the text columns have different levels in each file, and the files
+# have different columns
+FILES = {
+    'a': 'g,n,v\nx,1,0.5\ny,2,1.5\nx,3,\ny,,2.25\n',
+    'b': 'v,g,w\n3.5,z,p\n4.5,x,q\n,,p\n',
+    'c': 'g,n\ny,7\nq,8\nx,9\nq,10\nz,11\n',
+}
+
+
+class TestMultipleImport(unittest.TestCase):
+
+    def setUp(self):
+        self._temp = TempInstance()
+        self._temp.open()
+        self._datasets = TempDataSets()
+
+        self._paths = [ ]
+        for name, content in FILES.items():
+            path = os.path.join(self._datasets.path, name + '.csv')
+            with open(path, 'w') as file:
+                file.write(content)
+            self._paths.append(path)
+
+    def tearDown(self):
+        self._temp.close()
+        self._datasets.close()
+
+    def _import(self, paths):
+        # the files are read in other processes, into memory maps of their
+        # own, and attached to here
+        request = jcoms.OpenRequest()
+        request.op = jcoms.OpenRequest.Op.Value('IMPORT_REPLACE')
+        request.filePaths.extend(paths)
+        self._temp.request(request)
+        return self._temp.data
+
+    def _import_sequential(self, paths):
+        # the files read one after the other, here
+        instance = self._temp.instance
+        datasets = self._datasets
+
+        async def read():
+            for path in paths:
+                model = InstanceModel(instance)
+                model.dataset = datasets.create_dataset()
+                formatio.read(model, path, lambda p: None)
+                yield (os.path.splitext(os.path.basename(path))[0], model)
+
+        reference = TempInstance()
+        try:
+            reference.open()
+            reference.loop.run_until_complete(reference.data.import_from(read(), True))
+            return dump(reference.data)
+        finally:
+            reference.close()
+
+    def test_matches_sequential(self):
+        with mock.patch('jamovi.server.instance.MemoryMap', wraps=MemoryMap) as memory_map:
+            data = self._import(self._paths)
+        self.assertEqual(memory_map.attach.call_count, len(self._paths))
+
+        expected = self._import_sequential(self._paths)
+        self.assertEqual(dump(data), expected)
+
+    def test_columns(self):
+        data = self._import(self._paths)
+        n_rows = 4 + 3 + 5
+        self.assertEqual(data.row_count, n_rows)
+
+        def values(name):
+            return [ data[name].get_value(row_no) for row_no in range(n_rows) ]
+
+        # the source of each row
+        source = data['source']
+        self.assertEqual(source.index, 0)
+        self.assertEqual([ level[1] for level in source.levels ], [ 'a', 'b', 'c' ])
+        self.assertEqual(values('source'), [ 'a' ] * 4 + [ 'b' ] * 3 + [ 'c' ] * 5)
+
+        # the columns are matched on their names, and the text levels on
+        # their labels
+        g = data['g']
+        self.assertEqual((g.data_type, g.measure_type), (DataType.TEXT, MeasureType.NOMINAL))
+        self.assertEqual(sorted(level[1] for level in g.levels), [ 'q', 'x', 'y', 'z' ])
+        self.assertEqual(values('g'), [ 'x', 'y', 'x', 'y', 'z', 'x', '', 'y', 'q', 'x', 'q', 'z' ])
+
+        self.assertEqual(values('n')[:4], [ 1, 2, 3, -2147483648 ])
+        self.assertEqual(values('n')[7:], [ 7, 8, 9, 10, 11 ])
+        self.assertEqual(values('v')[4:6], [ 3.5, 4.5 ])
+        self.assertEqual(values('w')[4:7], [ 'p', 'q', 'p' ])
+        self.assertEqual(values('w')[7:], [ '' ] * 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
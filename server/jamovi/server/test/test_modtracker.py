@@ -0,0 +1,121 @@
+import unittest
+from unittest import mock
+
+import random
+
+from jamovi.server import jamovi_pb2 as jcoms
+from jamovi.server.modtracker import ModTracker
+
+from .helpers import TempInstance
+
+
+N_ROWS = 3000
+N_COLS = 3
+
+
+class TestModTracker(unittest.TestCase):
+
+    def setUp(self):
+        self._temp = TempInstance()
+        self._temp.open()
+
+    def tearDown(self):
+        self._temp.close()
+
+    def _paste(self, seed, row_count=N_ROWS):
+        # a paste from the clipboard, as tab separated text
+        rand = random.Random(seed)
+        rows = [ ]
+        for row_no in range(row_count):
+            rows.append('\t'.join([
+                str(rand.randint(0, 9)),
+                '{:.3f}'.format(rand.random()),
+                rand.choice([ 'a', 'b', 'c{}'.format(row_no % 10) ]),
+            ]))
+
+        request = jcoms.DataSetRR()
+        request.op = jcoms.GetSet.Value('SET')
+        request.incData = True
+        block_pb = request.data.add()
+        block_pb.rowStart = 0
+        block_pb.columnStart = 0
+        block_pb.rowCount = row_count
+        block_pb.columnCount = N_COLS
+        block_pb.incCBData = True
+        block_pb.cbText = '\n'.join(rows)
+        self._temp.request(request)
+
+    def _undo(self):
+        request = jcoms.DataSetRR()
+        request.op = jcoms.GetSet.Value('UNDO')
+        self._temp.request(request)
+
+    def _redo(self):
+        request = jcoms.DataSetRR()
+        request.op = jcoms.GetSet.Value('REDO')
+        self._temp.request(request)
+
+    def _values(self):
+        data = self._temp.data
+        return [ list(map(column.get_value, range(data.row_count))) for column in data if not column.is_virtual ]
+
+    def test_undo_redo_paste(self):
+        tracker = self._temp.instance._mod_tracker
+
+        self._paste(1)
+        first = self._values()
+        self._paste(2)
+        second = self._values()
+        self.assertNotEqual(first, second)
+
+        # the cells pasted over are kept as compressed, packed columns
+        undo = tracker.history[tracker.position]['undo']
+        self.assertEqual(len(undo.data), 1)
+        self.assertEqual(len(undo.data[0].columns), N_COLS)
+        self.assertTrue(all(map(lambda column_pb: column_pb.compressed, undo.data[0].columns)))
+        self.assertEqual(len(undo.data[0].values), 0)
+
+        self._undo()
+        self.assertEqual(self._values(), first)
+        self._redo()
+        self.assertEqual(self._values(), second)
+        self._undo()
+        self._undo()
+        self.assertEqual(self._temp.data.row_count, 0)
+
+        self._redo()
+        self.assertEqual(self._values(), first)
+        self._redo()
+        self.assertEqual(self._values(), second)
+
+    def test_space_used(self):
+        # the space used is the total size of the undo and redo events
+        tracker = self._temp.instance._mod_tracker
+
+        self._paste(1)
+        self._paste(2)
+        history = tracker.history
+        events = [ ]
+        for event_data in history:
+            events.extend(map(event_data.get, ('undo', 'redo')))
+        size = sum(map(lambda event: event.ByteSize(), filter(None, events)))
+        self.assertEqual(history[-1]['space_used'], size)
+
+        # the earliest history is dropped to make space
+        with mock.patch.object(ModTracker, 'MAX_SPACE_AVALIABLE', size * 2):
+            for seed in range(3, 12):
+                previous = self._values()
+                self._paste(seed)
+                self.assertLessEqual(tracker.history[-1]['space_used'], size * 2)
+                self.assertLess(tracker.count, 8)
+            last = self._values()
+
+            # and what remains can be undone
+            self._undo()
+            self.assertEqual(self._values(), previous)
+            self._redo()
+            self.assertEqual(self._values(), last)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import unittest
+
+import os.path
+import random
+import asyncio
+import logging
+import zipfile
+
+from jamovi.core import DataType
+from jamovi.core import MeasureType
+from jamovi.core import ColumnType
+from jamovi.server.formatio import omv
+
+from .helpers import TempDataSets
+from .helpers import dump
+
+
+log = logging.getLogger(__name__)
+
+N_ROWS = 3000
+
+
+class TestOMV(unittest.TestCase):
+
+    def setUp(self):
+        self._datasets = TempDataSets()
+        self._temp_path = self._datasets.path
+
+        self._data = self._datasets.create(log)
+
+        rand = random.Random(1)
+
+        a = self._append('a', DataType.DECIMAL, MeasureType.CONTINUOUS)
+        b = self._append('b', DataType.INTEGER, MeasureType.NOMINAL)
+        t = self._append('t', DataType.TEXT, MeasureType.NOMINAL)
+        s = self._append('s', DataType.TEXT, MeasureType.ID)
+        self._data.set_row_count(N_ROWS)
+
+        for label in ('x', 'ÿ', 'z z'):
+            t.append_level(len(t.levels), label, label)
+
+        for row_no in range(N_ROWS):
+            a.set_value(row_no, rand.choice([ float('nan'), 1.25, rand.random() ]))
+            b.set_value(row_no, rand.choice([ -2147483648, 1, 5, 9 ]))
+            t.set_value(row_no, rand.choice([ -2147483648, 0, 1, 2 ]))
+            s.set_value(row_no, rand.choice([ '', 'ünï{}'.format(row_no), 'id{}'.format(row_no) ]))
+
+        for column in self._data:
+            column.determine_dps()
+
+        self._path = os.path.join(self._temp_path, 'data.omv')
+        omv.write(self._data, self._path, lambda p: None)
+
+        # the data is read from stored (uncompressed) entries in place,
+        # so files with stored entries are tested too
+        self._stored_path = os.path.join(self._temp_path, 'stored.omv')
+        with zipfile.ZipFile(self._path) as zip_in, \
+                zipfile.ZipFile(self._stored_path, 'w', zipfile.ZIP_STORED) as zip_out:
+            for info in zip_in.infolist():
+                zip_out.writestr(info.filename, zip_in.read(info.filename), zipfile.ZIP_STORED)
+
+    def tearDown(self):
+        self._datasets.close()
+
+    def _append(self, name, data_type, measure_type):
+        column = self._data.append_column(name, name)
+        column.column_type = ColumnType.DATA
+        column.change(data_type=data_type, measure_type=measure_type)
+        return column
+
+    def _read(self, path, lazy):
+        data = self._datasets.create(log)
+        omv.read(data, path, lambda p: None, lazy=lazy)
+        return data
+
+    def test_round_trip(self):
+        expected = dump(self._data)
+        for path in (self._path, self._stored_path):
+            data = self._read(path, False)
+            self.assertEqual(data.row_count, N_ROWS)
+            self.assertFalse(any(map(lambda column: column.needs_load, data)))
+            self.assertEqual(expected, dump(data), path)
+
+    def test_lazy_load(self):
+        expected = dump(self._data)
+        for path in (self._path, self._stored_path):
+            data = self._read(path, True)
+            self.assertTrue(all(map(lambda column: column.needs_load, data)))
+
+            # the columns are loaded as they're accessed, in any order
+            self.assertEqual(data['s'].get_value(5), self._data['s'].get_value(5))
+            self.assertFalse(data['s'].needs_load)
+            self.assertTrue(data['a'].needs_load)
+
+            self.assertEqual(expected, dump(data), path)
+
+    def test_lazy_load_in_background(self):
+        expected = dump(self._data)
+        data = self._read(self._path, True)
+        self.assertTrue(data.needs_load)
+
+        async def load():
+            await data.load_columns_async(asyncio.Lock())
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(load())
+        finally:
+            loop.close()
+
+        self.assertFalse(data.needs_load)
+        self.assertEqual(expected, dump(data))
+
+    def test_lazy_edit(self):
+        # edits to columns not yet loaded (i.e. inserting rows) load them
+        # first
+        data = self._read(self._path, True)
+        data.insert_rows(2, 3)
+        self.assertFalse(data.needs_load)
+        self.assertEqual(data['a'].get_value(5), self._data['a'].get_value(2))
+        self.assertEqual(data['s'].get_value(1), self._data['s'].get_value(1))
+
+
+if __name__ == '__main__':
+    unittest.main()
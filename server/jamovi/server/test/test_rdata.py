@@ -0,0 +1,155 @@
+import unittest
+from unittest import mock
+
+import os.path
+import math
+import random
+import logging
+from array import array
+
+from jamovi.core import DataType
+from jamovi.core import MeasureType
+from jamovi.core import ColumnType
+from jamovi.librdata import DataType as RDataType
+from jamovi.server.formatio import rdata
+
+from .helpers import TempDataSets
+
+
+log = logging.getLogger(__name__)
+
+N_ROWS = 2000
+
+
+class RecordingWriter:
+
+    # records what's written, in place of the librdata writer
+
+    class Column:
+        def __init__(self, name, data_type):
+            self.name = name
+            self.data_type = data_type
+            self.levels = None
+
+        def add_level_labels(self, labels):
+            self.levels = list(labels)
+
+    def __init__(self):
+        self.columns = [ ]
+        self.values = { }
+        self.row_count = None
+        self.closed = False
+
+    def open(self, path, format):
+        pass
+
+    def set_row_count(self, row_count):
+        self.row_count = row_count
+
+    def add_column(self, name, data_type):
+        column = RecordingWriter.Column(name, data_type)
+        self.columns.append(column)
+        return column
+
+    def insert_value(self, row_no, col_no, value):
+        self.values[(row_no, col_no)] = value
+
+    def close(self):
+        self.closed = True
+
+
+class TestRData(unittest.TestCase):
+
+    def setUp(self):
+        self._datasets = TempDataSets()
+
+        rand = random.Random(3)
+        self._num = [ rand.random() if i % 13 else float('nan') for i in range(N_ROWS) ]
+        self._factor = [ rand.choice([ 1, 2, 3, -2147483648 ]) for i in range(N_ROWS) ]
+        self._logical = [ rand.choice([ 0, 1, -2147483648 ]) for i in range(N_ROWS) ]
+        self._text = [ 's{}'.format(i % 97) if i % 7 else '' for i in range(N_ROWS) ]
+
+    def tearDown(self):
+        self._datasets.close()
+
+    def _read(self):
+        # drives the parser as librdata does; the columns arrive whole
+        data = self._datasets.create(log)
+        parser = rdata.Parser(data, lambda p: None)
+        parser.handle_table('df')
+        parser.handle_column('num', RDataType.NUMERIC, array('d', self._num), N_ROWS)
+        for label in ('lo', 'mid', 'hi'):
+            parser.handle_value_label(label, 0)
+        parser.handle_column('factor', RDataType.INTEGER, array('i', self._factor), N_ROWS)
+        parser.handle_column('logical', RDataType.LOGICAL, self._logical, N_ROWS)
+        parser.handle_column('text', RDataType.CHARACTER, None, N_ROWS)
+        for index, value in enumerate(self._text):
+            parser.handle_text_value(value, index)
+
+        for column in data.dataset:
+            column.determine_dps()
+
+        return data
+
+    def test_read(self):
+        data = self._read()
+        self.assertEqual(data.row_count, N_ROWS)
+        self.assertEqual([ column.name for column in data ], [ 'num', 'factor', 'logical', 'text' ])
+
+        num = data['num']
+        self.assertEqual((num.data_type, num.measure_type), (DataType.DECIMAL, MeasureType.CONTINUOUS))
+        for expected, actual in zip(self._num, map(num.get_value, range(N_ROWS))):
+            self.assertTrue(expected == actual or (math.isnan(expected) and math.isnan(actual)))
+
+        factor = data['factor']
+        self.assertEqual((factor.data_type, factor.measure_type), (DataType.INTEGER, MeasureType.NOMINAL))
+        self.assertEqual(list(map(lambda level: level[:2], factor.levels)), [ (1, 'lo'), (2, 'mid'), (3, 'hi') ])
+        self.assertEqual(list(map(factor.get_value, range(N_ROWS))), self._factor)
+
+        logical = data['logical']
+        self.assertEqual(sorted(map(lambda level: level[:2], logical.levels)), [ (0, 'FALSE'), (1, 'TRUE') ])
+        self.assertEqual(list(map(logical.get_value, range(N_ROWS))), self._logical)
+
+        text = data['text']
+        self.assertEqual((text.data_type, text.measure_type), (DataType.TEXT, MeasureType.ID))
+        self.assertEqual(list(map(text.get_value, range(N_ROWS))), self._text)
+
+    def test_write(self):
+        data = self._read()
+
+        nominal = data.append_column('nominal', 'nominal')
+        nominal.column_type = ColumnType.DATA
+        nominal.change(data_type=DataType.TEXT, measure_type=MeasureType.NOMINAL)
+        for label in ('z', 'y', 'x'):
+            nominal.append_level(nominal.level_count, label, label)
+        nominal_raws = [ -2147483648 if row_no % 5 == 0 else row_no % 3 for row_no in range(N_ROWS) ]
+        for row_no, raw in enumerate(nominal_raws):
+            nominal.set_value(row_no, raw)
+
+        writer = RecordingWriter()
+        with mock.patch.object(rdata, 'Writer', lambda: writer):
+            rdata.write(data, os.path.join(self._datasets.path, 'data.rds'), lambda p: None, 'rds')
+
+        self.assertTrue(writer.closed)
+        self.assertEqual(writer.row_count, N_ROWS)
+        names = list(map(lambda column: column.name, writer.columns))
+        self.assertEqual(names, [ 'num', 'factor', 'logical', 'text', 'nominal' ])
+
+        def values(col_no):
+            return list(map(lambda row_no: writer.values[(row_no, col_no)], range(N_ROWS)))
+
+        num = values(0)
+        for expected, actual in zip(self._num, num):
+            self.assertTrue(expected == actual or (math.isnan(expected) and math.isnan(actual)))
+
+        # factors are written as the position of their level, from one
+        self.assertEqual(writer.columns[1].levels, [ 'lo', 'mid', 'hi' ])
+        self.assertEqual(values(1), self._factor)
+        self.assertEqual(values(3), self._text)
+
+        self.assertEqual(writer.columns[4].levels, [ 'z', 'y', 'x' ])
+        self.assertEqual(values(4), list(map(lambda raw: raw if raw == -2147483648 else raw + 1, nominal_raws)))
+
+
+if __name__ == '__main__':
+    unittest.main()
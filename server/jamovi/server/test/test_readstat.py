@@ -0,0 +1,132 @@
+import unittest
+from unittest import mock
+
+import random
+import logging
+from datetime import date
+from types import SimpleNamespace
+
+from jamovi.core import DataType
+from jamovi.core import MeasureType
+from jamovi.readstat import Measure
+from jamovi.server.formatio import readstat
+
+from .helpers import TempDataSets
+from .helpers import dump
+
+
+log = logging.getLogger(__name__)
+
+N_ROWS = 2000
+
+
+class Variable:
+
+    def __init__(self, name, type, measure, missing=( )):
+        self.name = name
+        self.label = None
+        self.type = type
+        self.measure = measure
+        self._missing = missing
+
+    def is_missing(self, value):
+        return value in self._missing
+
+
+class TestReadStat(unittest.TestCase):
+
+    def setUp(self):
+        self._datasets = TempDataSets()
+
+        # the variables, the key of their value labels, and their values.
+        # some change type part way through (i.e. a nominal float taking a
+        # decimal value), so the earlier chunks are converted
+        rand = random.Random(5)
+        self._variables = [
+            (Variable('dec', float, Measure.SCALE), None, lambda r: rand.random() if r % 17 else None),
+            (Variable('int', int, Measure.SCALE), None, lambda r: rand.randint(-5, 5) if r % 19 else None),
+            (Variable('nomf', float, Measure.NOMINAL), 'L1', lambda r: float(rand.randint(1, 3)) if r % 11 else None),
+            (Variable('nomi', int, Measure.ORDINAL), None, lambda r: rand.randint(1, 9)),
+            (Variable('late_dec', float, Measure.NOMINAL), None, lambda r: 2.5 if r == N_ROWS // 2 else 1.0),
+            (Variable('wide', float, Measure.NOMINAL), None, lambda r: 2.0 ** 40 if r == N_ROWS - 3 else 3.0),
+            (Variable('text', str, Measure.NOMINAL), 'L2', lambda r: rand.choice([ 'a', 'b', 'c', '', None ])),
+            (Variable('late_id', str, Measure.NOMINAL), None, lambda r: 'x{}'.format(r % 60) if r > N_ROWS // 3 else 'y'),
+            (Variable('dates', date, Measure.ORDINAL), None, lambda r: date(2000, 1, 1 + r % 28) if r % 5 else None),
+            (Variable('scale_labels', float, Measure.SCALE), 'L3', lambda r: float(rand.randint(1, 2))),
+        ]
+        self._value_labels = {
+            'L1': [ (1.0, 'one'), (2.0, 'two'), (3.0, 'three') ],
+            'L2': [ ('a', 'Apple'), ('b', 'Banana') ],
+            'L3': [ (1.0, 'lo'), (2.0, 'hi') ],
+        }
+        self._rows = [ ]
+        for row_no in range(N_ROWS):
+            self._rows.append(list(map(lambda v: v[2](row_no), self._variables)))
+
+    def tearDown(self):
+        self._datasets.close()
+
+    def _read(self, row_count=N_ROWS):
+        # drives the parser as readstat does
+        data = self._datasets.create(log)
+
+        parser = readstat.Parser(data, lambda p: None)
+        for key, labels in self._value_labels.items():
+            for value, label in labels:
+                parser.handle_value_label(key, value, label)
+        parser.handle_metadata(SimpleNamespace(row_count=row_count))
+        for index, (variable, labels_key, gen) in enumerate(self._variables):
+            parser.handle_variable(index, variable, labels_key)
+        for row_no, row in enumerate(self._rows):
+            for index, value in enumerate(row):
+                parser.handle_value(index, row_no, value)
+        parser.flush()
+
+        for column in data.dataset:
+            column.determine_dps()
+
+        return data
+
+    def test_read(self):
+        data = self._read()
+        self.assertEqual(data.row_count, N_ROWS)
+
+        types = dict(map(lambda column: (column.name, (column.data_type, column.measure_type)), data))
+        self.assertEqual(types['dec'], (DataType.DECIMAL, MeasureType.CONTINUOUS))
+        self.assertEqual(types['int'], (DataType.INTEGER, MeasureType.CONTINUOUS))
+        self.assertEqual(types['nomf'], (DataType.INTEGER, MeasureType.NOMINAL))
+        self.assertEqual(types['late_dec'], (DataType.DECIMAL, MeasureType.CONTINUOUS))
+        self.assertEqual(types['wide'], (DataType.DECIMAL, MeasureType.CONTINUOUS))
+        self.assertEqual(types['late_id'], (DataType.TEXT, MeasureType.ID))
+        self.assertEqual(types['scale_labels'], (DataType.INTEGER, MeasureType.ORDINAL))
+
+        for index, (variable, labels_key, gen) in enumerate(self._variables):
+            column = data[index]
+            for row_no in (1, 2, N_ROWS // 2, N_ROWS - 3, N_ROWS - 1):
+                value = self._rows[row_no][index]
+                actual = column.get_value(row_no)
+                if value is None or value == '':
+                    continue
+                elif variable.type is str:
+                    self.assertEqual(actual, dict(self._value_labels.get(labels_key, [ ])).get(value, value), variable.name)
+                elif variable.type is date:
+                    self.assertEqual(actual, (value - readstat.TIME_START).days, variable.name)
+                else:
+                    self.assertEqual(actual, value, variable.name)
+
+    def test_chunks(self):
+        expected = dump(self._read())
+
+        for chunk_cells in (1, 64, 4097):
+            with mock.patch.object(readstat, 'CHUNK_CELLS', chunk_cells):
+                self.assertEqual(expected, dump(self._read()), chunk_cells)
+
+    def test_row_count_unknown(self):
+        # some formats don't provide the row count up front
+        expected = dump(self._read())
+        with mock.patch.object(readstat, 'CHUNK_CELLS', 640):
+            self.assertEqual(expected, dump(self._read(row_count=-1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
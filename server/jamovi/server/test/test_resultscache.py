@@ -0,0 +1,172 @@
+import unittest
+from unittest import mock
+
+import os
+import os.path
+import tempfile
+from types import SimpleNamespace
+
+from jamovi.core import DataType
+from jamovi.core import MeasureType
+from jamovi.core import ColumnType
+from jamovi.server import jamovi_pb2 as jcoms
+from jamovi.server.resultscache import ResultsCache
+from jamovi.server.options import Options
+
+from .helpers import TempDataSets
+
+
+N_ROWS = 10
+
+
+def create_results(text, size=0):
+    results = jcoms.AnalysisResponse()
+    results.results.title = text
+    results.results.preformatted = 'x' * size
+    return results
+
+
+class TestResultsCache(unittest.TestCase):
+
+    def setUp(self):
+        self._datasets = TempDataSets()
+        self._data = self._datasets.create()
+
+        a = self._append('a', DataType.DECIMAL, MeasureType.CONTINUOUS)
+        b = self._append('b', DataType.TEXT, MeasureType.NOMINAL)
+        c = self._append('c', DataType.INTEGER, MeasureType.CONTINUOUS)
+        self._data.set_row_count(N_ROWS)
+        for row_no in range(N_ROWS):
+            a.set_value(row_no, row_no / 2)
+            b.set_value(row_no, 'x' if row_no % 2 == 0 else 'y')
+            c.set_value(row_no, row_no)
+
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self._cache_path = os.path.join(self._temp_dir.name, 'cache')
+        self._cache = ResultsCache(self._cache_path)
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+        self._datasets.close()
+
+    def _append(self, name, data_type, measure_type):
+        column = self._data.append_column(name, name)
+        column.column_type = ColumnType.DATA
+        column.change(data_type=data_type, measure_type=measure_type)
+        return column
+
+    def _analysis(self, *using, name='name'):
+        options = Options.create([ ], { })
+        options_pb = jcoms.AnalysisOptions()
+        options_pb.hasNames = True
+        options_pb.names.append('vars')
+        Options._populate_pb(options_pb.options.add(), list(using))
+        options.set(options_pb)
+        return SimpleNamespace(dataset=self._data, ns='ns', name=name, options=options)
+
+    def test_hit(self):
+        analysis = self._analysis('a', 'b')
+        key = self._cache.key(analysis)
+        self.assertIsNone(self._cache.get(key))
+
+        self._cache.put(key, create_results('first'))
+        self.assertEqual(self._cache.key(self._analysis('a', 'b')), key)
+        self.assertEqual(self._cache.get(key).results.title, 'first')
+
+        # from disk, by a later cache (i.e. once the memory is evicted)
+        cache = ResultsCache(self._cache_path)
+        self.assertEqual(cache.get(key).results.title, 'first')
+
+    def test_miss(self):
+        analysis = self._analysis('a', 'b')
+        key = self._cache.key(analysis)
+        keys = { key }
+
+        def changed():
+            new_key = self._cache.key(analysis)
+            self.assertNotIn(new_key, keys)
+            keys.add(new_key)
+
+        # the options
+        self.assertNotEqual(self._cache.key(self._analysis('a')), key)
+        self.assertNotEqual(self._cache.key(self._analysis('a', 'b', name='other')), key)
+
+        # the values
+        self._data['a'].set_value(0, -1.0)
+        changed()
+        self._data['b'].set_value(1, 'x')
+        changed()
+        self._data.set_row_count(N_ROWS + 1)
+        changed()
+
+        # the levels (a rename changes the values the analysis receives)
+        column = self._data['b']
+        levels = [ (value, label + '!', import_value) for value, label, import_value in column.levels ]
+        column.change(data_type=DataType.TEXT, measure_type=MeasureType.NOMINAL, levels=levels)
+        changed()
+
+        # the active flag
+        self._data['a'].active = False
+        changed()
+
+        # a change to a column not used makes no difference
+        self._data['c'].set_value(0, 100)
+        self.assertIn(self._cache.key(analysis), keys)
+
+        # but filters (even those not named in the options) do
+        filt = self._data.append_column('Filter 1', 'Filter 1')
+        filt.column_type = ColumnType.FILTER
+        filt.change(data_type=DataType.INTEGER, measure_type=MeasureType.NOMINAL)
+        changed()
+        filt.set_value(0, 1)
+        changed()
+        filt.active = False
+        changed()
+
+    def test_memory_limit(self):
+        # room for three results
+        size = 1000
+        with mock.patch.object(ResultsCache, 'MEMORY_LIMIT', size * 7 // 2):
+            for i in range(4):
+                self._cache.put('key{}'.format(i), create_results(str(i), size))
+            # the least recently used is evicted from the memory
+            self.assertEqual(list(self._cache._memory), [ 'key1', 'key2', 'key3' ])
+            self.assertLessEqual(self._cache._memory_used, size * 7 // 2)
+
+            # getting a key makes it the most recent ...
+            self._cache.get('key1')
+            self._cache.put('key4', create_results('4', size))
+            self.assertEqual(list(self._cache._memory), [ 'key3', 'key1', 'key4' ])
+
+            # ... and those evicted are read back from disk
+            self.assertEqual(self._cache.get('key0').results.title, '0')
+            self.assertEqual(list(self._cache._memory), [ 'key1', 'key4', 'key0' ])
+
+    def test_disk_limit(self):
+        # room for two results
+        size = 1000
+        with mock.patch.object(ResultsCache, 'DISK_LIMIT', size * 5 // 2):
+            for i in range(3):
+                self._cache.put('key{}'.format(i), create_results(str(i), size))
+            # the least recently used is removed from the disk
+            self.assertEqual(sorted(os.listdir(self._cache_path)), [ 'key1', 'key2' ])
+            self.assertLessEqual(self._cache._disk_used, size * 5 // 2)
+
+            # reading a file makes it the most recent
+            cache = ResultsCache(self._cache_path)
+            cache.get('key1')
+            cache.put('key3', create_results('3', size))
+            self.assertEqual(sorted(os.listdir(self._cache_path)), [ 'key1', 'key3' ])
+            self.assertIsNone(ResultsCache(self._cache_path).get('key2'))
+
+    def test_too_large(self):
+        with mock.patch.object(ResultsCache, 'MEMORY_LIMIT', 100), \
+                mock.patch.object(ResultsCache, 'DISK_LIMIT', 100):
+            self._cache.put('key', create_results('large', 1000))
+            self.assertEqual(len(self._cache._memory), 0)
+            self.assertEqual(os.listdir(self._cache_path), [ ])
+            self.assertIsNone(self._cache.get('key'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,6 +6,8 @@ from .htmlparser import HTMLParser
 
 from .fileentry import FileEntry
 from .nulllog import NullLog
+from .columndata import pack_column
+from .columndata import unpack_column
 
 
 def int32(value):
@@ -19,3 +21,15 @@ def is_int32(value):
     except ValueError:
         return False
     return True
+
+
+def merge_ranges(ranges):
+    # merges overlapping and adjacent (start, end) tuples
+    merged = [ ]
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
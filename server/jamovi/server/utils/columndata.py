@@ -0,0 +1,106 @@
+
+# packs and unpacks the values of columns as DataSetRR.ColumnData
+# messages; a packed array of values, with a bitmap of the missing values
+
+from itertools import accumulate
+import zlib
+
+import numpy as np
+
+from jamovi.core import DataType
+from jamovi.core import MeasureType
+
+from .. import jamovi_pb2 as jcoms
+
+
+ColumnDataType = jcoms.DataSetRR.ColumnData.ColumnDataType
+
+
+def _read_raw(column, indices, row_count):
+    # the raw values (level indices for text), missing beyond row_count
+    valid = indices < row_count
+    rows = indices[valid]
+
+    if column.data_type == DataType.DECIMAL:
+        values = np.full(len(indices), np.nan)
+    else:
+        values = np.full(len(indices), -2147483648, dtype=np.int32)
+
+    if len(rows) > 0 and rows[-1] - rows[0] + 1 == len(rows):
+        rows = column.read_range(int(rows[0]), len(rows))
+        values[valid] = np.frombuffer(rows, dtype=values.dtype)
+    else:
+        values[valid] = list(map(lambda row_no: column.raw(int(row_no)), rows))
+
+    return values
+
+
+def pack_column(column, indices, row_count, column_pb, compress=False):
+    # indices beyond row_count are treated as missing. returns the
+    # number of values which aren't missing
+
+    indices = np.array(indices, dtype=np.int64)
+
+    if column.data_type == DataType.TEXT:
+        if column.measure_type == MeasureType.ID:
+            values = [ '' ] * len(indices)
+            for i in np.flatnonzero(indices < row_count):
+                values[i] = column.get_value(int(indices[i]))
+        else:
+            labels = dict(map(lambda level: (level[0], level[1]), column.levels))
+            labels[-2147483648] = ''
+            values = list(map(labels.__getitem__, _read_raw(column, indices, row_count).tolist()))
+        missing = np.fromiter(map(lambda v: v == '', values), dtype=bool, count=len(values))
+        values = list(map(lambda v: v.encode('utf-8'), values))
+        column_pb.type = ColumnDataType.Value('TEXT')
+        column_pb.offsets[:] = accumulate(map(len, values))
+        values = b''.join(values)
+    else:
+        values = _read_raw(column, indices, row_count)
+        if column.data_type == DataType.DECIMAL:
+            column_pb.type = ColumnDataType.Value('DECIMAL')
+            missing = np.isnan(values)
+            values = values.astype('<f8', copy=False)
+        else:
+            column_pb.type = ColumnDataType.Value('INTEGER')
+            missing = values == -2147483648
+            values = values.astype('<i4', copy=False)
+        values = values.tobytes()
+
+    if compress:
+        compressed = zlib.compress(values, 1)
+        if len(compressed) < len(values):
+            values = compressed
+            column_pb.compressed = True
+
+    column_pb.values = values
+    column_pb.missing = np.packbits(missing, bitorder='little').tobytes()
+
+    return len(missing) - int(np.count_nonzero(missing))
+
+
+def unpack_column(column_pb, row_count):
+    # returns the values as a list, with None for missing values
+
+    values = column_pb.values
+    if column_pb.compressed:
+        values = zlib.decompress(values)
+
+    missing = np.frombuffer(column_pb.missing, dtype=np.uint8)
+    missing = np.unpackbits(missing, count=row_count, bitorder='little')
+
+    if column_pb.type == ColumnDataType.Value('TEXT'):
+        starts = [ 0 ]
+        starts.extend(column_pb.offsets)
+        values = list(map(
+            lambda r: values[starts[r]:starts[r + 1]].decode('utf-8'),
+            range(row_count)))
+    elif column_pb.type == ColumnDataType.Value('DECIMAL'):
+        values = np.frombuffer(values, dtype='<f8', count=row_count).tolist()
+    else:
+        values = np.frombuffer(values, dtype='<i4', count=row_count).tolist()
+
+    for r in np.flatnonzero(missing):
+        values[r] = None
+
+    return values